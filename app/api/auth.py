@@ -1,42 +1,60 @@
-from fastapi import APIRouter, HTTPException, status, Form, Depends, Security
+from fastapi import APIRouter, HTTPException, status, Form, Depends, Request, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
-from google.cloud import bigquery
 from typing import Optional
 import os
+import time
 import uuid
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from pydantic import BaseModel
-load_dotenv()
-
-# JWT Configuration
-SECRET_KEY = os.getenv("SECRET_KEY") 
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+from app.core.cache import TTLCache
+from app.core.database import AsyncDatabase, UsernameTaken, get_async_db
+from app.core.metrics import metrics
+from app.core.security import PasswordHasherBusy, hash_password, verify_password
+from app.core.throttle import SlidingWindowCounter
+from app.core.tokens import (
+    ACCESS_TOKEN, ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, REFRESH_TOKEN, SECRET_KEY, TokenError,
+    check_claims, check_legacy_claims, create_access_token, create_refresh_token, decode_token, revoke_all_tokens,
+    revoke_token,
+)
+# how long a user holding a legacy (sub-only) token is trusted without checking the users table again
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
 
-USER_DATASET_ID = os.getenv("USER_DATASET_ID")
-USERNAME_TABLE_ID = os.getenv("USERNAME_TABLE_ID")
-USER_INFO_TABLE_ID = os.getenv("USER_INFO_TABLE_ID")
+# failed logins allowed per username and per client IP within the window before attempts are rejected
+LOGIN_MAX_FAILURES_PER_USERNAME = int(os.getenv("LOGIN_MAX_FAILURES_PER_USERNAME", "5"))
+LOGIN_MAX_FAILURES_PER_IP = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "20"))
+LOGIN_FAILURE_WINDOW_SECONDS = float(os.getenv("LOGIN_FAILURE_WINDOW_SECONDS", "900"))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+# only trust X-Forwarded-For when running behind a proxy that sets it (e.g. Cloud Run)
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
 
 router = APIRouter()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # Use OAuth2PasswordBearer for token handling
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="/auth/token",  # Full path including prefix
     scheme_name="JWT",
 )
 
-client = bigquery.Client(project="capstone-sophiallamas")
-dataset_id = USER_DATASET_ID
-user_table_id = USERNAME_TABLE_ID
-user_table_ref = client.dataset(dataset_id).table(user_table_id)
+# same scheme, but a missing token isn't an error (logout works with or without one)
+optional_oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl="/auth/token",
+    scheme_name="JWT",
+    auto_error=False,
+)
 
-user_info_id = USER_INFO_TABLE_ID
-user_info_ref = client.dataset(dataset_id).table(user_info_id)
+# usernames known to be taken, warmed at startup and kept up to date by register
+# a miss isn't proof the name is free (another worker may have just taken it), create_user still checks
+taken_usernames = set()
+# usernames with a registration in progress on this worker
+pending_usernames = set()
+
+# recent login failures per username and per client IP
+username_failures = SlidingWindowCounter(LOGIN_MAX_FAILURES_PER_USERNAME, LOGIN_FAILURE_WINDOW_SECONDS, LOGIN_THROTTLE_MAX_KEYS)
+ip_failures = SlidingWindowCounter(LOGIN_MAX_FAILURES_PER_IP, LOGIN_FAILURE_WINDOW_SECONDS, LOGIN_THROTTLE_MAX_KEYS)
+
+# users with legacy tokens verified against the users table, keyed by (user_id, token exp)
+verified_users = TTLCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL_SECONDS)
 
 # Create a Pydantic model for profile updates
 class ProfileUpdate(BaseModel):
@@ -44,17 +62,78 @@ class ProfileUpdate(BaseModel):
     age: Optional[int] = None
     gender: Optional[str] = None
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
+# access + refresh token pair returned by login and refresh
+def token_response(user_id: str, username: Optional[str]):
+    return {
+        "access_token": create_access_token(user_id, username),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "refresh_token": create_refresh_token(user_id, username),
+    }
+
+# returned when the password hashing pool is saturated, instead of queueing without bound
+def hasher_busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+# rejects a login attempt when its username or IP has failed too often recently
+# runs before the users query and before bcrypt, so throttled attempts cost almost nothing
+def check_login_throttle(username: str, ip: str):
+    for counter, key, kind in ((ip_failures, ip, "ip"), (username_failures, username, "username")):
+        retry_after = counter.retry_after(key)
+        if retry_after is not None:
+            metrics.increment(f"login_throttle.rejected_{kind}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many failed login attempts, please try again later",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+def record_login_failure(username: str, ip: str):
+    username_failures.hit(username)
+    ip_failures.hit(ip)
+    metrics.increment("login.failures")
+    metrics.set_gauge("login_throttle.tracked_usernames", len(username_failures))
+    metrics.set_gauge("login_throttle.tracked_ips", len(ip_failures))
+
+# replaces a stored hash that was made with a different bcrypt cost
+async def rehash_password(async_db: AsyncDatabase, user_id: str, new_hash: str):
+    await async_db.update_password(user_id, new_hash)
+
+async def warm_username_index():
+    """Load every registered username into the local index, called once at startup."""
+    # a full scan of the users table, allowed more time than a request's queries
+    taken_usernames.update(await get_async_db().list_usernames(timeout=300))
+
+def forget_verified_user(user_id: str):
+    """Forget that a legacy-token user was verified, so their next request checks the users table again."""
+    verified_users.delete_where(lambda key: key[0] == user_id)
+
+def revoke_user(user_id: str):
+    """Revoke every token issued to a user so far.
+
+    Call this when an account is deleted or a user logs out of every device.
+    """
+    forget_verified_user(user_id)
+    revoke_all_tokens(user_id)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), async_db: AsyncDatabase = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -71,19 +150,45 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             detail=f"Invalid token: {str(e)}",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # access tokens carry their claims and a jti, so checking the revocation list is all that's left
+    if "type" in payload:
+        try:
+            check_claims(payload, ACCESS_TOKEN)
+        except TokenError as e:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=f"Invalid token: {str(e)}",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return user_id
+
+    # legacy tokens have no jti, a logout with one revokes every token of the user
+    # checked before the cache, a verification from before the logout doesn't count
+    try:
+        check_legacy_claims(payload)
+    except TokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid token: {str(e)}",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    # legacy tokens only carry sub and still need the users table
+    # users verified in the last PRINCIPAL_CACHE_TTL_SECONDS skip the database check
+    exp = payload.get("exp")
+    if verified_users.get((user_id, exp)):
+        return user_id
     
     # Verify user exists in database
-    query = f"SELECT id FROM `{dataset_id}.{user_table_id}` WHERE id = @user_id"
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("user_id", "STRING", user_id)
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-
-    if results.total_rows == 0:
+    if await async_db.get_user(user_id) is None:
         raise credentials_exception
+
+    # never trust the verification for longer than the token itself is valid
+    ttl = PRINCIPAL_CACHE_TTL_SECONDS
+    if exp is not None:
+        ttl = min(ttl, exp - time.time())
+    verified_users.set((user_id, exp), True, ttl)
     
     return user_id
 
@@ -91,39 +196,31 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 @router.post("/register",
     summary="Register new user",
     description="Create a new user account. After registration, use the /token endpoint to get an access token.")
-async def register(username: str = Form(...), password: str = Form(...), name: str = Form(...), age: int = Form(...), gender: Optional[str] = Form(None)):
-    query = f"SELECT username FROM `{dataset_id}.{user_table_id}` WHERE username = @username"
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("username", "STRING", username)
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-
-    if results.total_rows > 0:
+async def register(username: str = Form(...), password: str = Form(...), name: str = Form(...), age: int = Form(...), gender: Optional[str] = Form(None), async_db: AsyncDatabase = Depends(get_async_db)):
+    # taken usernames (and names being registered right now on this worker) are rejected without a query
+    if username in taken_usernames or username in pending_usernames:
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    hashed_password = pwd_context.hash(password)
-    user_id = str(uuid.uuid4())
-
-    user_rows = [
-        {u"id": user_id, u"username": username, u"password": hashed_password}
-    ]
-
-    user_errors = client.insert_rows_json(user_table_ref, user_rows)
-
-    if user_errors:
-        raise HTTPException(status_code=500, detail=str(user_errors))
+    pending_usernames.add(username)
+    try:
+        try:
+            hashed_password = await hash_password(password)
+        except PasswordHasherBusy:
+            raise hasher_busy_exception()
+        user_id = str(uuid.uuid4())
 
-    info_rows = [
-        {u"user_id": user_id, u"name": name, u"age": age, u"gender": gender}
-    ]
+        # both rows are written in one transaction, the uniqueness check runs inside it
+        try:
+            await async_db.create_user(user_id, username, hashed_password, name, age, gender)
+        except UsernameTaken:
+            taken_usernames.add(username)
+            raise HTTPException(status_code=400, detail="Username already exists")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
-    info_errors = client.insert_rows_json(user_info_ref, info_rows)
-    
-    if info_errors:
-        raise HTTPException(status_code=500, detail=str(info_errors))
+        taken_usernames.add(username)
+    finally:
+        pending_usernames.discard(username)
 
     return {"message": "User registered successfully"}
 
@@ -141,77 +238,110 @@ async def register(username: str = Form(...), password: str = Form(...), name: s
     5. In the popup, paste ONLY the token (without 'Bearer')
     6. Click Authorize
     """)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    query = f"SELECT id, username, password FROM `{dataset_id}.{user_table_id}` WHERE username = @username"
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("username", "STRING", form_data.username)
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), async_db: AsyncDatabase = Depends(get_async_db)):
+    ip = client_ip(request)
+    check_login_throttle(form_data.username, ip)
+
+    user_data = await async_db.get_user_credentials(form_data.username)
 
-    if results.total_rows == 0:
+    if user_data is None:
+        record_login_failure(form_data.username, ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    user_data = [row for row in results][0]
-    if not pwd_context.verify(form_data.password, user_data["password"]):
+    try:
+        valid, new_hash = await verify_password(form_data.password, user_data["password"])
+    except PasswordHasherBusy:
+        raise hasher_busy_exception()
+    if not valid:
+        record_login_failure(form_data.username, ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user_data["id"]}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    # a successful login clears the username's failures (the IP's stay, it may be guessing other accounts)
+    username_failures.reset(form_data.username)
+    metrics.increment("login.successes")
+
+    # the stored hash uses an old cost factor, upgrade it now that we know the password
+    if new_hash:
+        try:
+            await rehash_password(async_db, user_data["id"], new_hash)
+        except Exception as e:
+            # the login itself succeeded, the upgrade is retried on the next one
+            print(f"Error rehashing password for user {user_data['id']}: {str(e)}")
+
+    return token_response(user_data["id"], user_data["username"])
 
-# Logout endpoint (client-side should remove the token)
+# Refresh endpoint, exchanges a refresh token for a new token pair
+@router.post("/refresh",
+    summary="Refresh access token",
+    description="Exchange a refresh token for a new access token. The refresh token is rotated: the one sent can't be used again.")
+async def refresh_access_token(request: RefreshRequest, async_db: AsyncDatabase = Depends(get_async_db)):
+    try:
+        payload = decode_token(request.refresh_token, REFRESH_TOKEN)
+    except TokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid refresh token: {str(e)}",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    # refreshing is the one place the users table is checked again, so deleted accounts stop here
+    user_data = await async_db.get_user(payload["sub"])
+    if user_data is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    revoke_token(payload)
+    return token_response(user_data["id"], user_data["username"])
+
+# Logout endpoint, revokes the tokens that are sent (the client should still remove them)
 @router.post("/logout",
     summary="Logout user",
-    description="This endpoint is for client-side use. The client should remove the stored token.")
-async def logout():
+    description="Revokes the bearer access token and, if it is sent in the body, the refresh token. The client should remove both. "
+                "A legacy access token, which has no id of its own, revokes every token of the user.")
+async def logout(request: Optional[LogoutRequest] = None, token: Optional[str] = Depends(optional_oauth2_scheme), async_db: AsyncDatabase = Depends(get_async_db)):
+    if token:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            if "type" in payload and payload.get("jti"):
+                revoke_token(payload)
+            elif payload.get("sub"):
+                # a legacy token has no jti to revoke on its own, every token of the user issued so far goes
+                revoke_user(payload["sub"])
+        except JWTError:
+            pass
+
+    if request is not None and request.refresh_token:
+        try:
+            revoke_token(decode_token(request.refresh_token, REFRESH_TOKEN))
+        except TokenError:
+            pass
+
     return {"message": "Successfully logged out"}
 
 @router.put("/profile", 
     summary="Update user profile",
     description="Update the current user's profile information")
-async def update_profile(profile: ProfileUpdate, current_user: str = Depends(get_current_user)):
+async def update_profile(profile: ProfileUpdate, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     """Updates the user's profile information."""
     try:
-        # Build update query for non-None fields only
-        update_parts = []
-        query_params = [bigquery.ScalarQueryParameter("user_id", "STRING", current_user)]
-        
-        if profile.name is not None:
-            update_parts.append("name = @name")
-            query_params.append(bigquery.ScalarQueryParameter("name", "STRING", profile.name))
-        
-        if profile.age is not None:
-            update_parts.append("age = @age")
-            query_params.append(bigquery.ScalarQueryParameter("age", "INT64", profile.age))
+        # Update non-None fields only
+        fields = {field: value for field, value in profile.dict().items() if value is not None}
         
-        if profile.gender is not None:
-            update_parts.append("gender = @gender")
-            query_params.append(bigquery.ScalarQueryParameter("gender", "STRING", profile.gender))
-        
-        if not update_parts:
+        if not fields:
             return {"message": "No fields to update"}
         
-        update_query = f"""
-            UPDATE `{USER_DATASET_ID}.{USER_INFO_TABLE_ID}`
-            SET {", ".join(update_parts)}
-            WHERE user_id = @user_id
-        """
-        
-        job_config = bigquery.QueryJobConfig(query_parameters=query_params)
-        client.query(update_query, job_config=job_config).result()
+        await async_db.update_user_info(current_user, fields)
         
         return {"message": "Profile updated successfully"}
     except Exception as e:
@@ -221,27 +351,15 @@ async def update_profile(profile: ProfileUpdate, current_user: str = Depends(get
 @router.get("/profile", 
     summary="Get user profile",
     description="Get the current user's profile information")
-async def get_profile(current_user: str = Depends(get_current_user)):
+async def get_profile(current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     """Gets the user's profile information."""
-    query = f"""
-        SELECT name, age, gender
-        FROM `{USER_DATASET_ID}.{USER_INFO_TABLE_ID}`
-        WHERE user_id = @user_id
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("user_id", "STRING", current_user)
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
+    profile = await async_db.get_user_info(current_user)
 
-    if results.total_rows == 0:
+    if profile is None:
         raise HTTPException(status_code=404, detail="User profile not found")
     
-    profile = next(results)
     return {
-        "name": profile.name,
-        "age": profile.age,
-        "gender": profile.gender
+        "name": profile["name"],
+        "age": profile["age"],
+        "gender": profile["gender"]
     }
\ No newline at end of file
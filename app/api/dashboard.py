@@ -1,81 +1,145 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from google.cloud import bigquery
-import os 
-from dotenv import load_dotenv
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+import asyncio
+from typing import Optional
 from .auth import get_current_user
-
-load_dotenv()
-
-# get all environment variables
-TRIP_DATASET_ID = os.getenv("TRIP_DATASET_ID")
-TRIP_TABLE_ID = os.getenv("TRIP_TABLE_ID")
-USER_DATASET_ID = os.getenv("USER_DATASET_ID")
-USER_INFO_TABLE_ID = os.getenv("USER_INFO_TABLE_ID")
+from .packing import packing_buffer
+from app.core.database import TRIP_KEY, AsyncDatabase, get_async_db
+from app.core.etags import content_etag, etag, not_modified
+from app.core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor, parse_fields
+from app.services.packing_progress import progress_percent
 
 router = APIRouter()
 
-# create  bigquery client
-client = bigquery.Client(project="capstone-sophiallamas")
-dataset_id = TRIP_DATASET_ID
-table_id = TRIP_TABLE_ID
+# columns the trips listing can return, it is ordered and paginated by TRIP_KEY
+# packing_progress is the trip's packing totals, shaped like the trip progress endpoint
+TRIP_FIELDS = ["trip_id", "city", "country", "start_date", "end_date", "luggage_type", "trip_purpose", "packing_progress"]
 
 # protected dashboard endpoint
 @router.get("/")
-async def dashboard(current_user: str = Depends(get_current_user)):
-    # call get name function to get the user's name based on user id
-    name = await get_name(current_user)
-    # call get user trips function to get the user's trips based on user id
-    trips = await get_user_trips(current_user)
-    # returns the user's name and trips
-    return {"message": f"Welcome to your dashboard, {name}!", "trips": trips} 
-
-# get user's name based on user id
-async def get_name(user_id: str):
-    # query to get the user's name based on user id
-    query = f"""
-        SELECT name
-        FROM `{USER_DATASET_ID}.{USER_INFO_TABLE_ID}`
-        WHERE user_id = @user_id
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("user_id", "STRING", user_id)
-        ]
+async def dashboard(
+    request: Request,
+    response: Response,
+    current_user: str = Depends(get_current_user),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    async_db: AsyncDatabase = Depends(get_async_db),
+):
+    if not async_db.database.dashboards.enabled:
+        # nothing is kept between loads, so only the page asked for is read
+        body = await get_dashboard_page(async_db, current_user, limit, cursor, fields)
+        unchanged = not_modified(request, response, content_etag("dashboard", body))
+        if unchanged is not None:
+            return unchanged
+        return body
+
+    # the user's name, trips and packing totals, from their snapshot or read at the same time
+    snapshot = await get_dashboard_snapshot(async_db, current_user)
+    if snapshot["version"] is not None:
+        # a stored snapshot gets a new version with every write, a client polling an unchanged page gets a 304
+        unchanged = not_modified(request, response, etag("dashboard", current_user, snapshot["version"], limit, cursor, fields))
+        if unchanged is not None:
+            return unchanged
+
+    # take a page of the user's trips, ordered by start date
+    trips, next_cursor = get_user_trips(snapshot, limit, cursor, fields)
+    # returns the user's name and trips, next_cursor fetches the following page (None on the last one)
+    body = {"message": f"Welcome to your dashboard, {snapshot['name']}!", "trips": trips, "next_cursor": next_cursor}
+    if snapshot["version"] is None:
+        # built without being stored, so the page is all there is to compare
+        unchanged = not_modified(request, response, content_etag("dashboard", body))
+        if unchanged is not None:
+            return unchanged
+    return body
+
+# read one page of the dashboard: the user's name and the page of trips at the same time,
+# then the packing totals of just those trips
+async def get_dashboard_page(async_db: AsyncDatabase, user_id: str, limit: int = DEFAULT_PAGE_SIZE,
+                             cursor: Optional[str] = None, fields: Optional[str] = None):
+    returned = parse_fields(fields, TRIP_FIELDS, always=["trip_id"])
+    after = decode_cursor(cursor, len(TRIP_KEY)) if cursor else None
+    with_progress = "packing_progress" in returned
+    # the key columns are read as well, the next cursor is built from them
+    columns = list(dict.fromkeys([column for column in returned if column != "packing_progress"] + TRIP_KEY))
+
+    if with_progress:
+        # edits still waiting in the packing list buffer would be missing from the totals
+        await packing_buffer.flush_user(user_id)
+    # one row past the page tells whether there is a next one
+    user_data, rows = await asyncio.gather(
+        async_db.get_user_info(user_id),
+        async_db.list_trips(user_id, columns, limit + 1, after),
     )
-    query_job = client.query(query, job_config=job_config)
-    # result is all user info
-    results = query_job.result()
+    if user_data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][column] for column in TRIP_KEY])
+
+    totals = {}
+    if with_progress:
+        totals = {row["trip_id"]: row for row in await async_db.list_trips_packing_totals([row["trip_id"] for row in rows], user_id)}
+    # a trip deleted since the page was read has no totals left
+    empty = {"lists_count": 0, "total_items": 0, "packed_items": 0}
+    trips = [{column: packing_progress(totals.get(row["trip_id"], empty)) if column == "packing_progress" else row[column]
+              for column in returned}
+             for row in rows]
+    return {"message": f"Welcome to your dashboard, {user_data['name']}!", "trips": trips, "next_cursor": next_cursor}
 
-    if results.total_rows == 0:
+# get the user's dashboard snapshot, building it on a miss
+async def get_dashboard_snapshot(async_db: AsyncDatabase, user_id: str):
+    # edits still waiting in the packing list buffer would be missing from the totals
+    await packing_buffer.flush_user(user_id)
+
+    snapshots = async_db.database.dashboards
+    snapshot = snapshots.get(user_id)
+    if snapshot is not None:
+        return snapshot
+
+    build = snapshots.begin(user_id)
+    try:
+        # the three reads don't depend on each other, so they run at the same time
+        user_data, trips, lists = await asyncio.gather(
+            async_db.get_user_info(user_id),
+            async_db.list_all_trips(user_id),
+            async_db.list_user_packing_counters(user_id),
+        )
+    except BaseException:
+        snapshots.abandon(build)
+        raise
+
+    if user_data is None:
+        snapshots.abandon(build)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    # take name from the results
-    user_data = [row for row in results][0]
-    return user_data["name"]
-
-# get user's trips based on user id
-async def get_user_trips(user_id: str):
-    query = f"""
-        SELECT trip_id, city, country, start_date, end_date, luggage_type, trip_purpose
-        FROM `{dataset_id}.{table_id}`
-        WHERE user_id = @user_id
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("user_id", "STRING", user_id)
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-
-    trips = []
-    for row in results:
-        trips.append({
-            "trip_id": row.trip_id,
-            "city": row.city,
-            "country": row.country,
-            "start_date": row.start_date,
-            "end_date": row.end_date,
-            "luggage_type": row.luggage_type,
-            "trip_purpose": row.trip_purpose
-        })
-    return trips
+    return snapshots.finish(build, user_data["name"], trips, lists)
+
+# get a page of the snapshot's trips, starting after the cursor
+def get_user_trips(snapshot, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, fields: Optional[str] = None):
+    # only the requested fields are returned
+    returned = parse_fields(fields, TRIP_FIELDS, always=["trip_id"])
+
+    rows = snapshot["trips"]
+    if cursor:
+        # the snapshot is ordered like the trips query, compare keys the same way it sorts them
+        after = [value or "" for value in decode_cursor(cursor, len(TRIP_KEY))]
+        rows = [row for row in rows if [row[column] or "" for column in TRIP_KEY] > after]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][column] for column in TRIP_KEY])
+
+    trips = [{column: packing_progress(row) if column == "packing_progress" else row[column] for column in returned}
+             for row in rows]
+    return trips, next_cursor
+
+# the trip's packing totals, shaped like the trip progress endpoint
+def packing_progress(row):
+    return {
+        "total_items": row["total_items"],
+        "packed_items": row["packed_items"],
+        "progress": progress_percent(row["packed_items"], row["total_items"]),
+        "lists_count": row["lists_count"],
+    }
@@ -1,505 +1,391 @@
-from fastapi import APIRouter, HTTPException, Depends
-from google.cloud import bigquery
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+import asyncio
 import os
-from dotenv import load_dotenv
 import uuid
-import json
 from app.services.packing_list_generator import generate_packing_list
+from app.services.packing_progress import count_packing_items, progress_percent
+from app.services.packing_list_buffer import PackingListBuffer, PackingOperationError
+from app.services.packing_list_cache import PackingListFormatError, dumps, get_parsed_packing_list
 from app.api.auth import get_current_user
+from app.core.database import AsyncDatabase, db, get_async_db
+from app.core.etags import etag, not_modified
+from app.core.idempotency import run_idempotent
+from app.core.progress_events import CLOSED, RESYNC, Subscription, format_event, progress_events
+from app.core.responses import json_response
+from app.core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor, parse_fields
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Literal, Optional, Union
 
-load_dotenv()
+# how long item edits are held before being written back, and the upper bound while edits keep coming
+PACKING_FLUSH_DEBOUNCE_SECONDS = float(os.getenv("PACKING_FLUSH_DEBOUNCE_SECONDS", "2"))
+PACKING_FLUSH_MAX_DELAY_SECONDS = float(os.getenv("PACKING_FLUSH_MAX_DELAY_SECONDS", "10"))
+# a failed write-back is retried after 1s, 2s, 4s... up to this cap
+PACKING_FLUSH_RETRY_MAX_SECONDS = float(os.getenv("PACKING_FLUSH_RETRY_MAX_SECONDS", "60"))
+# "counters" averages the stored item counters, "json" counts items from the list JSON inside the warehouse
+PACKING_PROGRESS_MODE = os.getenv("PACKING_PROGRESS_MODE", "counters")
+# seconds between keep-alive comments on an idle progress stream, so proxies don't drop it
+PROGRESS_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("PROGRESS_EVENTS_KEEPALIVE_SECONDS", "25"))
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-TRIP_DATASET_ID = os.getenv("TRIP_DATASET_ID")
-TRIP_TABLE_ID = os.getenv("TRIP_TABLE_ID")
-PACKING_TABLE_ID = os.getenv("PACKING_TABLE_ID")
+# columns the packing lists listing can return, by default only the ids like before
+PACKING_LIST_FIELDS = ["list_id", "trip_id", "total_items", "packed_items"]
 
 class PackingListUpdate(BaseModel):
     packing_list: Dict[str, Any]
 
+# a single item-level edit, items are addressed by category name and item name
+class PackingItemOperation(BaseModel):
+    op: Literal["toggle_packed", "set_quantity", "add", "remove"]
+    category_name: str
+    item_name: str
+    packed: Optional[bool] = None  # toggle_packed flips the item when this is left out
+    quantity: Optional[int] = None
+    item: Optional[Dict[str, Any]] = None  # extra fields for add (essential, notes)
+
+class PackingItemsPatch(BaseModel):
+    operations: List[PackingItemOperation]
+
 router = APIRouter()
 
-client = bigquery.Client(project="capstone-sophiallamas")
+# writes a whole packing list and its counters in one statement
+# with a user_id only that user's list is written (the buffer writes back lists it already checked)
+def write_packing_list(list_id: str, packing_list: Dict[str, Any], user_id: Optional[str] = None):
+    total_items, packed_items = count_packing_items(packing_list)
+    db.update_packing_list(list_id, dumps(packing_list), total_items, packed_items, user_id=user_id)
+    return total_items, packed_items
+
+# holds lists edited through PATCH /packing/{id}/items and writes them back on a debounce
+packing_buffer = PackingListBuffer(
+    write_packing_list,
+    debounce_seconds=PACKING_FLUSH_DEBOUNCE_SECONDS,
+    max_delay_seconds=PACKING_FLUSH_MAX_DELAY_SECONDS,
+    retry_max_seconds=PACKING_FLUSH_RETRY_MAX_SECONDS,
+)
 
 # generates a packing list based on trip details
 @router.post("/generate/{trip_id}")
-async def generate_packing_list_route(trip_id: str, current_user: str = Depends(get_current_user)):
+async def generate_packing_list_route(trip_id: str, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db),
+                                      idempotency_key: Optional[str] = Header(None)):
+    # a retry sent with the same Idempotency-Key gets the first request's list instead of calling Gemini again
+    return await run_idempotent(f"{current_user}:generate_packing_list", idempotency_key, {"trip_id": trip_id},
+                                lambda: insert_generated_packing_list(trip_id, current_user, async_db))
+
+# generates a packing list for the user's trip and inserts it
+async def insert_generated_packing_list(trip_id: str, current_user: str, async_db: AsyncDatabase):
     try:
         # Verify trip belongs to user
-        trip_query = f"""
-            SELECT trip_id FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-            WHERE trip_id = @trip_id AND user_id = @user_id
-        """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-                bigquery.ScalarQueryParameter("user_id", "STRING", current_user),
-            ]
-        )
-        trip_results = client.query(trip_query, job_config=job_config).result()
-        
-        if trip_results.total_rows == 0:
+        if not await async_db.trip_exists(trip_id, current_user):
             raise HTTPException(status_code=404, detail="Trip not found or access denied")
 
-        packing_list = str(generate_packing_list(trip_id))[7:-3]
+        # the generator calls Gemini, keep it off the event loop
+        packing_list = str(await asyncio.to_thread(generate_packing_list, trip_id))[7:-3]
         packing_list_id = str(uuid.uuid4())
+
+        # count the items once here so the progress endpoints never parse the list
+        # parsing through the shared cache also warms it for the first read of the new list
+        try:
+            total_items, packed_items = count_packing_items(get_parsed_packing_list(packing_list_id, packing_list))
+        except PackingListFormatError:
+            total_items, packed_items = 0, 0
         
-        # Save to BigQuery
-        table_id = f"{TRIP_DATASET_ID}.{PACKING_TABLE_ID}"
+        # Save to the database
         row = {
             "list_id": packing_list_id,
             "trip_id": trip_id,
-            "packing_list": packing_list
+            "packing_list": packing_list,
+            "total_items": total_items,
+            "packed_items": packed_items
         }
-        errors = client.insert_rows_json(table_id, [row])
-        if errors:
-            raise HTTPException(status_code=500, detail=f"Error saving to BigQuery: {errors}")
+        try:
+            await async_db.insert_packing_list(row)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error saving packing list: {str(e)}")
+
+        # the user's open tabs show the new list right away
+        await progress_events.publish(current_user, "list_created", **list_progress(packing_list_id, total_items, packed_items, trip_id=trip_id))
         
         return {"packing_list_id": packing_list_id, "packing_list": packing_list}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{packing_list_id}")
-async def get_packing_list(list_id: str, current_user: str = Depends(get_current_user)):
+async def get_packing_list(list_id: str, request: Request, response: Response, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     """Fetches the packing list for a trip."""
-    # First get the trip_id associated with this packing list
-    trip_query = f"""
-        SELECT t.trip_id, t.user_id 
-        FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` p
-        JOIN `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}` t ON p.trip_id = t.trip_id
-        WHERE p.list_id = @list_id
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("list_id", "STRING", list_id),
-        ]
-    )
-    trip_results = client.query(trip_query, job_config=job_config).result()
-    
-    if trip_results.total_rows == 0:
-        raise HTTPException(status_code=404, detail="Packing list not found")
-    
-    trip_data = [row for row in trip_results][0]
-    
-    # Verify the trip belongs to the current user
-    if trip_data["user_id"] != current_user:
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    # Get the packing list
-    query = f'''
-        SELECT packing_list FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` WHERE list_id = '{list_id}'
-    '''
-    results = client.query(query).to_dataframe()
-    if results.empty:
-        raise HTTPException(status_code=404, detail="list not found")
-    
-    row = results.iloc[0].to_dict()
-    packing_list_str = row.get("packing_list", "[]")
+    # lists with item edits that haven't been written back yet are served from the buffer
+    buffered = packing_buffer.get(list_id)
+    if buffered is not None:
+        if buffered.user_id != current_user:
+            raise HTTPException(status_code=403, detail="Access denied")
+        unchanged = not_modified(request, response, etag("packing_list", list_id, buffered.token, buffered.version))
+        if unchanged is not None:
+            return unchanged
+        return json_response({"packing_list": buffered.packing_list}, response)
+
+    if request.headers.get("if-none-match"):
+        # revalidating, read the version alone and skip the JSON when the client's copy is current
+        row = await async_db.get_packing_list_version(list_id, current_user)
+        unchanged = not_modified(request, response, etag("packing_list", list_id, row["version"]))
+        if unchanged is not None:
+            return unchanged
+
+    # Get the packing list together with its owner, 404 for an unknown list and 403 for someone else's
+    row = await async_db.get_packing_list(list_id, current_user)
+    # the ETag describes the version read with the JSON, the list may have changed since the revalidation above
+    unchanged = not_modified(request, response, etag("packing_list", list_id, row["version"]))
+    if unchanged is not None:
+        return unchanged
 
     try:
-        packing_list = json.loads(packing_list_str)
-    except json.JSONDecodeError:
+        packing_list = get_parsed_packing_list(list_id, row.get("packing_list"))
+    except PackingListFormatError:
         raise HTTPException(status_code=500, detail="Packing list contains invalid JSON format.")
     
-    return {"packing_list": packing_list}
+    # built here so the list isn't walked by FastAPI's encoder before being encoded
+    return json_response({"packing_list": packing_list}, response)
 
 @router.get("/lists/{trip_id}")
-async def get_packing_lists(trip_id: str, current_user: str = Depends(get_current_user)):
-    """Fetches all packing lists for a trip."""
-    query = f'''
-        SELECT list_id FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` WHERE trip_id = '{trip_id}'
-    '''
-    results = client.query(query).to_dataframe()
-    if results.empty:
+async def get_packing_lists(
+    trip_id: str,
+    current_user: str = Depends(get_current_user),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    async_db: AsyncDatabase = Depends(get_async_db),
+):
+    """Fetches a page of the packing lists for a trip, ordered by list id."""
+    returned = parse_fields(fields, PACKING_LIST_FIELDS, always=["list_id"], default=["list_id"])
+
+    after_list_id = decode_cursor(cursor, 1)[0] if cursor else None
+
+    # only lists of trips owned by the current user are listed
+    # one extra row tells us whether there is a next page
+    rows = await async_db.list_packing_lists(trip_id, current_user, returned, limit + 1, after_list_id)
+    if not rows and not cursor:
         raise HTTPException(status_code=404, detail="No packing lists found for this trip")
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]["list_id"]])
     
-    return {"packing_lists": results.to_dict(orient="records")}
+    return {
+        "packing_lists": [{column: row[column] for column in returned} for row in rows],
+        "next_cursor": next_cursor
+    }
 
-@router.get("/progress/{packing_list_id}")
-async def get_packing_progress(packing_list_id: str, current_user: str = Depends(get_current_user)):
-    try: 
-        # First get the trip_id associated with this packing list
-        trip_query = f"""
-            SELECT t.trip_id, t.user_id 
-            FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` p
-            JOIN `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}` t ON p.trip_id = t.trip_id
-            WHERE p.list_id = @list_id
-        """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("list_id", "STRING", packing_list_id),
-            ]
-        )
-        trip_results = client.query(trip_query, job_config=job_config).result()
-        
-        if trip_results.total_rows == 0:
-            raise HTTPException(status_code=404, detail="Packing list not found")
-        
-        trip_data = [row for row in trip_results][0]
-        
-        # Verify the trip belongs to the current user
-        if trip_data["user_id"] != current_user:
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        # Get the packing list
-        query = f'''
-            SELECT packing_list FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` WHERE list_id = '{packing_list_id}'
-        '''
-        results = client.query(query).to_dataframe()
-        if results.empty:
-            raise HTTPException(status_code=404, detail="list not found")
-        
-        row = results.iloc[0].to_dict()
-        packing_list_str = row.get("packing_list", "[]")
+# declared before /progress/{packing_list_id}, which would otherwise take "all" as a list id
+@router.get("/progress/all")
+async def get_all_packing_progress(current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
+    """Fetches the average progress for all packing lists across all trips for the user."""
+    try:
+        # write back pending item edits first so the counters include them
+        await packing_buffer.flush_user(current_user)
 
-        try:
-            packing_list = json.loads(packing_list_str)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=500, detail="Packing list contains invalid JSON format.")
-        
-        # Calculate the progress
-        total_items = packing_list.get("total_items")
-        packed_items = 0
-        for category in packing_list["categories"]:
-            for item in category["items"]:
-                if item.get("packed") == True:
-                    packed_items += 1
-        
-        progress = {
-            "total_items": total_items,
-            "packed_items": packed_items,
-            "progress": round(packed_items / total_items * 100, 2)
-        }
+        # averages the per-list progress, lists without items are skipped
+        # in json mode every list's items are counted from its JSON in the warehouse, only the average comes back
+        row = await async_db.get_user_packing_progress(current_user, from_json=PACKING_PROGRESS_MODE == "json")
+
+        # If no valid lists, return 0%
+        if row["list_count"] == 0:
+            return {"average_progress": 0}
+
+        return {"average_progress": round(row["average_progress"], 2)}
         
-        return progress
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    
-@router.get("/progress/{trip_id}")
-async def get_trip_packing_progress(trip_id: str, current_user: str = Depends(get_current_user)):
+        # Log the error but return a default instead of raising an exception
+        print(f"Error calculating overall packing progress: {str(e)}")
+        return {"average_progress": 0}
+
+@router.get("/progress/trip/{trip_id}")
+async def get_trip_packing_progress(trip_id: str, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     """Fetches the combined packing progress for all packing lists in a trip."""
     try:
-        # First verify the trip belongs to the user
-        trip_query = f"""
-            SELECT 1
-            FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-            WHERE trip_id = @trip_id AND user_id = @user_id
-        """
-        trip_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-                bigquery.ScalarQueryParameter("user_id", "STRING", current_user)
-            ]
-        )
-        trip_job = client.query(trip_query, trip_config)
-        trip_result = trip_job.result()
+        # write back pending item edits first so the counters include them
+        await packing_buffer.flush_user(current_user)
+
+        # sums the stored counters of every list in the trip
+        row = await async_db.get_trip_packing_totals(trip_id, current_user)
         
-        if trip_result.total_rows == 0:
+        if row is None:
             raise HTTPException(status_code=404, detail="Trip not found or access denied")
         
-        print(f"Trip verified for user {current_user}")
-        
-        # Get all packing lists for this trip
-        lists_query = f"""
-            SELECT list_id, packing_list
-            FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}`
-            WHERE trip_id = @trip_id
-        """
-        lists_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id)
-            ]
-        )
-        lists_job = client.query(lists_query, lists_config)
-        lists_results = lists_job.result()
-        
-        # Convert to list to check if empty and to iterate multiple times
-        lists_data = list(lists_results)
-        
-        print(f"Found {len(lists_data)} packing lists for trip {trip_id}")
-        
-        # If no packing lists for this trip, return 0% progress
-        if len(lists_data) == 0:
-            return {
-                "trip_id": trip_id,
-                "total_items": 0,
-                "packed_items": 0,
-                "progress": 0,
-                "lists_count": 0
-            }
-        
-        # Aggregate data from all packing lists
-        total_items = 0
-        packed_items = 0
-        valid_lists = 0
-        parsed_lists = []
-        
-        for row in lists_data:
-            list_id = row.list_id
-            packing_list_str = row.packing_list
-            
-            if not packing_list_str:
-                print(f"Skipping empty packing list {list_id}")
-                continue
-                
-            try:
-                print(f"Parsing packing list {list_id}")
-                packing_list = json.loads(packing_list_str)
-                parsed_lists.append({"list_id": list_id, "data": packing_list})
-                
-                # Skip invalid packing lists
-                if not isinstance(packing_list, dict):
-                    print(f"Packing list {list_id} is not a dictionary")
-                    continue
-                    
-                if "categories" not in packing_list:
-                    print(f"Packing list {list_id} has no categories")
-                    continue
-                
-                if not isinstance(packing_list["categories"], list):
-                    print(f"Categories in packing list {list_id} is not a list")
-                    continue
-                
-                # Count items from all categories
-                list_items = 0
-                list_packed = 0
-                
-                for category_idx, category in enumerate(packing_list.get("categories", [])):
-                    if not isinstance(category, dict):
-                        print(f"Category {category_idx} in list {list_id} is not a dictionary")
-                        continue
-                        
-                    if "items" not in category:
-                        print(f"Category {category_idx} in list {list_id} has no items")
-                        continue
-                        
-                    if not isinstance(category["items"], list):
-                        print(f"Items in category {category_idx} of list {list_id} is not a list")
-                        continue
-                    
-                    for item_idx, item in enumerate(category.get("items", [])):
-                        if not isinstance(item, dict):
-                            print(f"Item {item_idx} in category {category_idx} of list {list_id} is not a dictionary")
-                            continue
-                            
-                        list_items += 1
-                        if item.get("packed") == True:
-                            list_packed += 1
-                
-                print(f"List {list_id}: {list_items} items, {list_packed} packed")
-                
-                # Only count this list if it has items
-                if list_items > 0:
-                    total_items += list_items
-                    packed_items += list_packed
-                    valid_lists += 1
-                
-            except json.JSONDecodeError as e:
-                print(f"Invalid JSON in packing list {list_id}: {str(e)}")
-                continue
-            except Exception as e:
-                print(f"Error processing packing list {list_id}: {str(e)}")
-                continue
-        
-        print(f"Total: {total_items} items, {packed_items} packed, {valid_lists} valid lists")
-        
-        # Calculate overall progress
-        progress = 0
-        if total_items > 0:
-            progress = round((packed_items / total_items) * 100, 2)
-        
-        result = {
+        return {
             "trip_id": trip_id,
-            "total_items": total_items,
-            "packed_items": packed_items,
-            "progress": progress,
-            "lists_count": valid_lists
+            "total_items": row["total_items"],
+            "packed_items": row["packed_items"],
+            "progress": progress_percent(row["packed_items"], row["total_items"]),
+            "lists_count": row["lists_count"]
         }
         
-        print(f"Final result: {result}")
-        return result
-        
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error calculating trip packing progress: {str(e)}")
-        import traceback
-        traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error calculating progress: {str(e)}")
 
-@router.get("/progress/all")
-async def get_all_packing_progress(current_user: str = Depends(get_current_user)):
-    """Fetches the average progress for all packing lists across all trips for the user."""
-    try:
-        # Query all packing lists for the user
-        query = f"""
-            SELECT p.packing_list 
-            FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` p
-            JOIN `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}` t ON p.trip_id = t.trip_id
-            WHERE t.user_id = @user_id
-        """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("user_id", "STRING", current_user),
-            ]
-        )
-        results = client.query(query, job_config=job_config).result()
-
-        # If no results, return 0% progress
-        if results.total_rows == 0:
-            return {"average_progress": 0}
-
-        # Calculate progress for each packing list
-        total_progress = 0
-        list_count = 0
-
-        for row in results:
-            packing_list_str = row.packing_list
-            if not packing_list_str:
-                continue
-                
-            try:
-                packing_list = json.loads(packing_list_str)
-                
-                # Skip invalid packing lists
-                if not isinstance(packing_list, dict) or "categories" not in packing_list:
-                    continue
-                
-                # Get total items - either from the property or count manually
-                if "total_items" in packing_list and isinstance(packing_list["total_items"], (int, float)) and packing_list["total_items"] > 0:
-                    total_items = packing_list["total_items"]
-                else:
-                    # Count total items manually
-                    total_items = sum(
-                        len(category.get("items", []))
-                        for category in packing_list.get("categories", [])
-                        if isinstance(category, dict)
-                    )
-                
-                # Skip if no items
-                if total_items == 0:
-                    continue
-                
-                # Count packed items
-                packed_items = 0
-                for category in packing_list.get("categories", []):
-                    if not isinstance(category, dict) or "items" not in category:
-                        continue
-                    
-                    for item in category.get("items", []):
-                        if isinstance(item, dict) and item.get("packed") == True:
-                            packed_items += 1
-                
-                # Calculate progress for this list
-                list_progress = (packed_items / total_items) * 100
-                total_progress += list_progress
-                list_count += 1
-                
-            except json.JSONDecodeError:
-                # Skip invalid JSON
-                continue
-            except Exception as e:
-                # Log error but continue processing
-                print(f"Error processing packing list: {str(e)}")
-                continue
-
-        # If no valid lists processed, return 0%
-        if list_count == 0:
-            return {"average_progress": 0}
+@router.get("/progress/{packing_list_id}")
+async def get_packing_progress(packing_list_id: str, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
+    try: 
+        # lists with item edits that haven't been written back yet are counted from the buffer
+        buffered = packing_buffer.get(packing_list_id)
+        if buffered is not None:
+            if buffered.user_id != current_user:
+                raise HTTPException(status_code=403, detail="Access denied")
+            total_items, packed_items = count_packing_items(buffered.packing_list)
+            return {
+                "total_items": total_items,
+                "packed_items": packed_items,
+                "progress": progress_percent(packed_items, total_items)
+            }
 
-        # Calculate average progress
-        average_progress = round(total_progress / list_count, 2)
-        return {"average_progress": average_progress}
+        # read the stored counters together with the owner of the list, 404 for an unknown list and 403 for someone else's
+        row = await async_db.get_packing_counters(packing_list_id, current_user)
         
+        total_items = row["total_items"] or 0
+        packed_items = row["packed_items"] or 0
+        
+        progress = {
+            "total_items": total_items,
+            "packed_items": packed_items,
+            "progress": progress_percent(packed_items, total_items)
+        }
+        
+        return progress
+    except HTTPException:
+        raise
     except Exception as e:
-        # Log the error but return a default instead of raising an exception
-        print(f"Error calculating overall packing progress: {str(e)}")
-        return {"average_progress": 0}
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{packing_list_id}")
-async def delete_packing_list(packing_list_id: str, current_user: str = Depends(get_current_user)):
+async def delete_packing_list(packing_list_id: str, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     try:
-        # verify the packing list belongs to the current user
-        trip_query = f"""
-            SELECT t.trip_id, t.user_id 
-            FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` p
-            JOIN `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}` t ON p.trip_id = t.trip_id
-            WHERE p.list_id = @list_id
-        """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("list_id", "STRING", packing_list_id),
-                bigquery.ScalarQueryParameter("user_id", "STRING", current_user),
-            ]
-        )
-        list_results = client.query(trip_query, job_config=job_config).result()
-        if list_results.total_rows == 0:
-            raise HTTPException(status_code=404, detail="Packing list not found")
-        
-        # delete the packing list
-        list_query = f"""
-            DELETE FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` 
-            WHERE list_id = '{packing_list_id}'
-        """
-        list_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("list_id", "STRING", packing_list_id),
-            ]
-        )
-        client.query(list_query, list_config).result()
+        # buffered item edits are dropped and new ones held off until the delete is done,
+        # so nothing is written back after it
+        async with packing_buffer.replacing(packing_list_id):
+            # delete the packing list, only the user's own (404 for an unknown list, 403 for someone else's)
+            await async_db.delete_packing_list(packing_list_id, current_user)
+
+        await progress_events.publish(current_user, "list_deleted", list_id=packing_list_id)
 
         return {"message": "Packing list deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 
 @router.put("/{packing_list_id}")
-async def update_packing_list(packing_list_id: str, update_data: PackingListUpdate, current_user: str = Depends(get_current_user)):
+async def update_packing_list(packing_list_id: str, update_data: PackingListUpdate, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     try:
-        # First verify the packing list belongs to the current user
-        trip_query = f"""
-            SELECT t.trip_id, t.user_id 
-            FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` p
-            JOIN `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}` t ON p.trip_id = t.trip_id
-            WHERE p.list_id = @list_id
-        """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("list_id", "STRING", packing_list_id),
-            ]
-        )
-        trip_results = client.query(trip_query, job_config=job_config).result()
-        
-        if trip_results.total_rows == 0:
-            raise HTTPException(status_code=404, detail="Packing list not found")
-        
-        trip_data = [row for row in trip_results][0]
-        
-        # Verify the trip belongs to the current user
-        if trip_data["user_id"] != current_user:
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        # Serialize the packing list to a JSON string
-        packing_list_json = json.dumps(update_data.packing_list)
-        
-        # Update the packing list in the database
-        update_query = f"""
-            UPDATE `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}`
-            SET packing_list = @packing_list
-            WHERE list_id = @list_id
-        """
-        update_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("packing_list", "STRING", packing_list_json),
-                bigquery.ScalarQueryParameter("list_id", "STRING", packing_list_id),
-            ]
-        )
-        client.query(update_query, update_config).result()
+        # the full list supersedes any buffered item edits, item edits arriving during the write
+        # wait for it and apply to the new list
+        async with packing_buffer.replacing(packing_list_id):
+            # Update the packing list in the database, only the user's own (404 for an unknown list, 403 for someone else's)
+            total_items, packed_items = await async_db.run(write_packing_list, packing_list_id, update_data.packing_list, current_user)
+
+        await progress_events.publish(current_user, "list_updated", **list_progress(packing_list_id, total_items, packed_items))
         
         return {
             "message": "Packing list updated successfully",
             "list_id": packing_list_id
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update packing list: {str(e)}")
+
+@router.patch("/{packing_list_id}/items")
+async def patch_packing_list_items(packing_list_id: str, patch: PackingItemsPatch, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
+    """Applies a batch of item-level edits without sending the whole list.
+
+    Edits are applied to the copy held in the packing buffer and written back once the
+    user stops editing for PACKING_FLUSH_DEBOUNCE_SECONDS.
+    """
+    try:
+        async def load():
+            # the current version together with its owner, 404 for an unknown list and 403 for someone else's
+            row = await async_db.get_packing_list(packing_list_id, current_user)
+            try:
+                return get_parsed_packing_list(packing_list_id, row["packing_list"]), row["trip_id"]
+            except PackingListFormatError:
+                raise HTTPException(status_code=500, detail="Packing list contains invalid JSON format.")
+
+        # a PUT or DELETE of the list in flight is waited for, the edits apply to what it wrote
+        buffered = await packing_buffer.hold_loaded(packing_list_id, current_user, load)
+
+        if buffered.user_id != current_user:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+        try:
+            buffered = packing_buffer.apply(packing_list_id, [operation.dict() for operation in patch.operations])
+        except PackingOperationError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        total_items, packed_items = count_packing_items(buffered.packing_list)
+        # pushed as soon as the edit is applied, not when the buffer writes it back
+        progress = list_progress(packing_list_id, total_items, packed_items)
+        await progress_events.publish(current_user, "list_updated", **progress)
+        return {**progress, "version": buffered.version}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to update packing list items: {str(e)}")
+
+# a packing list's counts as sent in progress events
+def list_progress(list_id: str, total_items: int, packed_items: int, **fields):
+    return {
+        "list_id": list_id,
+        **fields,
+        "total_items": total_items,
+        "packed_items": packed_items,
+        "progress": progress_percent(packed_items, total_items),
+    }
+
+# pushes the user's packing progress as it changes (server-sent events), instead of polling the progress endpoints
+# the stream opens with a "snapshot" of every list's counts, then sends list_created, list_updated,
+# list_deleted and trips_deleted events, and a new snapshot whenever events were missed
+# (two path segments, a single one would be taken by GET /{packing_list_id})
+@router.get("/events/progress")
+async def packing_progress_events(current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
+    # subscribe before reading, so a change made in between arrives as an event after the snapshot
+    subscription = progress_events.subscribe(current_user)
+    try:
+        snapshot = await read_progress_snapshot(async_db, current_user)
+    except BaseException:
+        progress_events.unsubscribe(subscription)
+        raise
+
+    return StreamingResponse(
+        stream_progress_events(subscription, snapshot, async_db),
+        media_type="text/event-stream",
+        # nginx would otherwise hold the events back in its buffer
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# every list's counts for the user, the state the events apply to
+async def read_progress_snapshot(async_db: AsyncDatabase, user_id: str):
+    # edits still waiting in the packing list buffer would be missing from the counters
+    await packing_buffer.flush_user(user_id)
+    rows = await async_db.list_user_packing_counters(user_id)
+    lists = [list_progress(row["list_id"], row["total_items"] or 0, row["packed_items"] or 0, trip_id=row["trip_id"]) for row in rows]
+    return {"event": "snapshot", "data": {"lists": lists}}
+
+async def stream_progress_events(subscription: Subscription, snapshot, async_db: AsyncDatabase):
+    try:
+        yield format_event(snapshot)
+        while True:
+            # parked here until something is published, or the keep-alive is due
+            event = await subscription.get(PROGRESS_EVENTS_KEEPALIVE_SECONDS)
+            if event is None:
+                yield b": keep-alive\n\n"
+            elif event is CLOSED:
+                return
+            elif event is RESYNC:
+                yield format_event(await read_progress_snapshot(async_db, subscription.user_id))
+            else:
+                yield format_event(event)
+    finally:
+        progress_events.unsubscribe(subscription)
@@ -1,122 +1,47 @@
 from fastapi import APIRouter, HTTPException, Depends
-from google.cloud import bigquery
-import json
 from collections import Counter
-import os
-from dotenv import load_dotenv
 from app.api.auth import get_current_user
+from app.core.database import AsyncDatabase, get_async_db
+from app.services.packing_list_cache import PackingListFormatError, get_parsed_packing_list
 from typing import List, Dict, Any
 
-load_dotenv()
-
-TRIP_DATASET_ID = os.getenv("TRIP_DATASET_ID")
-TRIP_TABLE_ID = os.getenv("TRIP_TABLE_ID")
-TRIP_WEATHER_TABLE_ID = os.getenv("TRIP_WEATHER_TABLE_ID")
-PACKING_TABLE_ID = os.getenv("PACKING_TABLE_ID")
-
 router = APIRouter()
 
-client = bigquery.Client(project="capstone-sophiallamas")
-
-def get_packing_list_trip_info(list_id: str, user_id: str):
+async def get_packing_list_trip_info(async_db: AsyncDatabase, list_id: str, user_id: str):
     """Get trip information associated with a specific packing list."""
-    query = f"""
-        SELECT p.packing_list, t.trip_id, t.trip_purpose, t.country, t.city,
-               w.min_temp, w.max_temp, w.description
-        FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}` p
-        JOIN `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}` t ON p.trip_id = t.trip_id
-        JOIN `{TRIP_DATASET_ID}.{TRIP_WEATHER_TABLE_ID}` w ON t.trip_id = w.trip_id
-        WHERE p.list_id = @list_id AND t.user_id = @user_id
-    """
+    trip_info = await async_db.get_packing_list_trip_info(list_id, user_id)
     
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("list_id", "STRING", list_id),
-            bigquery.ScalarQueryParameter("user_id", "STRING", user_id)
-        ]
-    )
-    
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-    
-    if results.total_rows == 0:
+    if trip_info is None:
         raise HTTPException(status_code=404, detail="Packing list or associated trip not found")
     
-    return next(results)
+    return trip_info
 
-def find_similar_trips(trip_info, similarity_threshold: float = 0.6) -> List[str]:
+async def find_similar_trips(async_db: AsyncDatabase, trip_info, similarity_threshold: float = 0.6) -> List[str]:
     """
     Find similar trips based on destination, weather conditions, and trip purpose.
     
     Parameters:
+    - async_db: The database to query
     - trip_info: The trip information associated with the packing list
     - similarity_threshold: Minimum similarity score (0-1) to consider trips as similar
     
     Returns:
     - List of similar trip IDs
     """
-    # Find trips with similar characteristics
-    similar_trips_query = f"""
-        WITH trip_details AS (
-            SELECT t.trip_id,
-                   CASE 
-                       WHEN t.trip_purpose = @trip_purpose THEN 0.2 ELSE 0 
-                   END +
-                   CASE 
-                       WHEN t.country = @country THEN 0.1 ELSE 0 
-                   END +
-                   CASE 
-                       WHEN t.city = @city THEN 0.1 ELSE 0 
-                   END +
-                   CASE 
-                       WHEN ABS(w.min_temp - @min_temp) < 5 THEN 0.2 ELSE 0 
-                   END +
-                   CASE 
-                       WHEN ABS(w.max_temp - @max_temp) < 5 THEN 0.2 ELSE 0 
-                   END +
-                   CASE 
-                       WHEN w.description LIKE @description_pattern THEN 0.2 ELSE 0 
-                   END AS similarity_score
-            FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}` t
-            JOIN `{TRIP_DATASET_ID}.{TRIP_WEATHER_TABLE_ID}` w ON t.trip_id = w.trip_id
-            WHERE t.trip_id != @trip_id  -- Exclude the current trip
-        )
-        SELECT trip_id 
-        FROM trip_details
-        WHERE similarity_score >= @similarity_threshold
-        ORDER BY similarity_score DESC
-        LIMIT 50
-    """
-    
     # Create pattern for partial matching of weather description
-    description_words = trip_info.description.split()
+    description_words = trip_info["description"].split()
     description_pattern = '%' + '%'.join(description_words) + '%' if description_words else '%'
     
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("trip_id", "STRING", trip_info.trip_id),
-            bigquery.ScalarQueryParameter("trip_purpose", "STRING", trip_info.trip_purpose),
-            bigquery.ScalarQueryParameter("country", "STRING", trip_info.country),
-            bigquery.ScalarQueryParameter("city", "STRING", trip_info.city),
-            bigquery.ScalarQueryParameter("min_temp", "FLOAT64", trip_info.min_temp),
-            bigquery.ScalarQueryParameter("max_temp", "FLOAT64", trip_info.max_temp),
-            bigquery.ScalarQueryParameter("description_pattern", "STRING", description_pattern),
-            bigquery.ScalarQueryParameter("similarity_threshold", "FLOAT64", similarity_threshold)
-        ]
-    )
-    
-    query_job = client.query(similar_trips_query, job_config=job_config)
-    results = query_job.result()
-    
-    similar_trip_ids = [row.trip_id for row in results]
+    # Find trips with similar characteristics
+    similar_trip_ids = await async_db.find_similar_trips(trip_info, description_pattern, similarity_threshold)
     return similar_trip_ids
 
-def extract_items_from_packing_list(packing_list_str: str) -> set:
+def extract_items_from_packing_list(list_id: str, packing_list_str: str) -> set:
     """Extract a set of item names from a packing list string."""
     items = set()
     
     try:
-        packing_list = json.loads(packing_list_str)
+        packing_list = get_parsed_packing_list(list_id, packing_list_str)
         if not packing_list or "categories" not in packing_list:
             return items
         
@@ -127,13 +52,13 @@ def extract_items_from_packing_list(packing_list_str: str) -> set:
                 if item_name:
                     items.add(item_name)
         
-    except json.JSONDecodeError:
+    except PackingListFormatError:
         # Return empty set for invalid JSON
         pass
     
     return items
 
-def get_all_packing_lists_for_similar_trips(similar_trip_ids: List[str]) -> Dict[str, set]:
+async def get_all_packing_lists_for_similar_trips(async_db: AsyncDatabase, similar_trip_ids: List[str]) -> Dict[str, set]:
     """
     Get all packing lists for the given trip IDs.
     
@@ -142,29 +67,17 @@ def get_all_packing_lists_for_similar_trips(similar_trip_ids: List[str]) -> Dict
     if not similar_trip_ids:
         return {}
     
-    # Format the trip IDs for the SQL IN clause
-    trip_ids_str = "', '".join(similar_trip_ids)
-    
-    query = f"""
-        SELECT trip_id, packing_list
-        FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}`
-        WHERE trip_id IN ('{trip_ids_str}')
-    """
-    
-    query_job = client.query(query)
-    results = query_job.result()
-    
     trip_items = {}
-    for row in results:
+    for row in await async_db.get_packing_lists_for_trips(similar_trip_ids):
         # Extract items from this packing list
-        items = extract_items_from_packing_list(row.packing_list)
+        items = extract_items_from_packing_list(row["list_id"], row["packing_list"])
         
         # Add to our trip_items dictionary
-        if row.trip_id in trip_items:
+        if row["trip_id"] in trip_items:
             # If we've seen this trip before, combine the items
-            trip_items[row.trip_id].update(items)
+            trip_items[row["trip_id"]].update(items)
         else:
-            trip_items[row.trip_id] = items
+            trip_items[row["trip_id"]] = items
     
     return trip_items
 
@@ -257,7 +170,7 @@ def categorize_recommendations(recommendations: List[Dict[str, Any]]) -> Dict[st
     return {category: items for category, items in categorized.items() if items}
 
 @router.get("/{packing_list_id}", response_model=dict)
-async def get_packing_recommendations_for_list(packing_list_id: str, similarity_threshold: float = 0.7, current_user: str = Depends(get_current_user)):
+async def get_packing_recommendations_for_list(packing_list_id: str, similarity_threshold: float = 0.7, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     """
     Get packing recommendations based on similar trips for a specific packing list.
     
@@ -270,13 +183,13 @@ async def get_packing_recommendations_for_list(packing_list_id: str, similarity_
     """
     try:
         # Get trip information for this packing list
-        trip_info = get_packing_list_trip_info(packing_list_id, current_user)
+        trip_info = await get_packing_list_trip_info(async_db, packing_list_id, current_user)
         
         # Get user's current packing list items
-        user_items = extract_items_from_packing_list(trip_info.packing_list)
+        user_items = extract_items_from_packing_list(trip_info["list_id"], trip_info["packing_list"])
         
         # Find similar trips
-        similar_trip_ids = find_similar_trips(trip_info, similarity_threshold)
+        similar_trip_ids = await find_similar_trips(async_db, trip_info, similarity_threshold)
         
         if not similar_trip_ids:
             return {
@@ -286,7 +199,7 @@ async def get_packing_recommendations_for_list(packing_list_id: str, similarity_
             }
         
         # Get all packing lists for similar trips
-        similar_trip_items = get_all_packing_lists_for_similar_trips(similar_trip_ids)
+        similar_trip_items = await get_all_packing_lists_for_similar_trips(async_db, similar_trip_ids)
         
         if not similar_trip_items:
             return {
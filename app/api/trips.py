@@ -1,27 +1,28 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query, Request, Response
 from pydantic import BaseModel
-from typing import Literal
-from google.cloud import bigquery
+from typing import List, Literal, Optional
+from app.services.historical_weather import AGGREGATE_FIELDS, RECORD_FIELDS
 from app.services.weather_predictor import WeatherPredictor
 from app.api.auth import get_current_user
+from app.api.packing import packing_buffer
+from app.core.database import AsyncDatabase, get_async_db
+from app.core.etags import content_etag, etag, not_modified
+from app.core.idempotency import run_idempotent
+from app.core.pagination import parse_fields
+from app.core.progress_events import progress_events
+from app.core.responses import RawJSON, StreamingJSONResponse
+import asyncio
 import uuid
 import os 
 import json
-from dotenv import load_dotenv
-
-load_dotenv()
 
 router = APIRouter()
 
-# initialize BigQuery client
-client = bigquery.Client(project="capstone-sophiallamas")
 # get environment variables
-TRIP_DATASET_ID = os.getenv("TRIP_DATASET_ID")
-TRIP_TABLE_ID = os.getenv("TRIP_TABLE_ID")
-TRIP_WEATHER_TABLE_ID = os.getenv("TRIP_WEATHER_TABLE_ID")
 WEATHERSTACK_API_KEY = os.getenv("WEATHERSTACK_API_KEY")
-HISTORICAL_WEATHER_TABLE = os.getenv("HISTORICAL_WEATHER_TABLE")
-PACKING_TABLE_ID = os.getenv("PACKING_TABLE_ID")
+
+# most trips a single bulk delete request may name
+MAX_BULK_DELETE_TRIPS = 100
 
 # create a Pydantic model for the trip data
 class Trip(BaseModel):
@@ -32,18 +33,29 @@ class Trip(BaseModel):
     luggage_type: Literal["hand", "carry on", "checked"]
     trip_purpose: Literal["business", "vacation"]
 
+# trips to delete in one request
+class TripBulkDelete(BaseModel):
+    trip_ids: List[str]
+
 # create a trip
 # inserts trip data into the trip information table and the trip weather table
 # calls the WeatherPredictor class to predict the weather for the trip
 @router.post("/")
-async def create_trip(trip: Trip, current_user: str = Depends(get_current_user)):
+async def create_trip(trip: Trip, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db),
+                      idempotency_key: Optional[str] = Header(None)):
+    # a retry sent with the same Idempotency-Key gets the first request's response instead of a second trip
+    return await run_idempotent(f"{current_user}:create_trip", idempotency_key, trip.dict(),
+                                lambda: insert_new_trip(trip, current_user, async_db))
+
+# predicts the weather of a new trip and inserts the trip with it
+async def insert_new_trip(trip: Trip, current_user: str, async_db: AsyncDatabase):
     try:
         # creates trip object from the request data
         trip_data = trip.dict()
         trip_data["user_id"] = current_user  # gets user id from JWT token
         trip_data["trip_id"] = str(uuid.uuid4())  # generate a unique trip ID
 
-        trip_info_rows = [{
+        trip_info_row = {
             "user_id": trip_data["user_id"],
             "trip_id": trip_data["trip_id"],
             "start_date": trip_data["start_date"],
@@ -52,7 +64,7 @@ async def create_trip(trip: Trip, current_user: str = Depends(get_current_user))
             "trip_purpose": trip_data["trip_purpose"],
             "city": trip_data["city"],
             "country": trip_data["country"]
-        }]
+        }
 
         # call predictor class to predict weather for a trip
         # want to make sure the prediction is successful before inserting data
@@ -61,296 +73,182 @@ async def create_trip(trip: Trip, current_user: str = Depends(get_current_user))
         # making the prediction (dictionary) for the trip with the parameters city, start_date, end_date 
         # try to make prediction, catches any errors when making prediction before trying to insert data
         try:
-            prediction = predictor.predict_trip_weather(trip_data["city"], trip_data["start_date"], trip_data["end_date"])
+            # the prediction calls the weather API, keep it off the event loop
+            prediction = await asyncio.to_thread(predictor.predict_trip_weather, trip_data["city"], trip_data["start_date"], trip_data["end_date"])
             if not isinstance(prediction, dict):
                 raise HTTPException(status_code=500, detail=f"Failed to predict weather: {prediction}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to predict weather: {str(e)}")
 
-        # once prediction is successful, insert the trip data into the trip information table
-        info_errors = client.insert_rows_json(f"{TRIP_DATASET_ID}.{TRIP_TABLE_ID}", trip_info_rows)
-        if info_errors:
-            raise HTTPException(status_code=500, detail=str(info_errors))
-
         # insert the predicted weather data into the trip weather table (so we don't have to call api every time)
-        trip_weather_rows = [{
+        trip_weather_row = {
             "trip_id": trip_data["trip_id"],
             "min_temp": prediction["predicted_min_temp"],
             "max_temp": prediction["predicted_max_temp"],
             "uv": prediction["predicted_uv_index"],
             "description": prediction["predicted_description"],
             "confidence": prediction["confidence_score"] 
-        }]
-
-        weather_errors = client.insert_rows_json(f"{TRIP_DATASET_ID}.{TRIP_WEATHER_TABLE_ID}", trip_weather_rows)
-        if weather_errors:
-            raise HTTPException(status_code=500, detail=str(weather_errors))
-        
-        historical_data_rows = [{
-            "trip_id": trip_data["trip_id"], 
-            "historical_stats": json.dumps(prediction["historical_data"], indent=2)  # contains the array of historical records
-        }]
-
-        historical_errors = client.insert_rows_json(f"{TRIP_DATASET_ID}.{HISTORICAL_WEATHER_TABLE}", historical_data_rows)
-        if historical_errors:
-            raise HTTPException(status_code=500, detail=str(historical_errors))
+        }
+
+        # once prediction is successful, insert the trip, its predicted weather and the
+        # historical records (stored compact, sent to clients as stored); the three tables
+        # are independent so the writes go out together instead of one round-trip after another
+        await asyncio.gather(
+            async_db.insert_trip(trip_info_row),
+            async_db.insert_trip_weather(trip_weather_row),
+            async_db.insert_historical_weather(trip_data["trip_id"], json.dumps(prediction["historical_data"], separators=(",", ":"))),
+        )
 
         # final message to return if everything is successful
         return {"message": "Trip created successfully", "trip_id": trip_data["trip_id"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{trip_id}")
-async def get_trip(trip_id: str, current_user: str = Depends(get_current_user)):
-    query = f"""
-        SELECT trip_id, city, country, start_date, end_date, luggage_type, trip_purpose, user_id
-        FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-        WHERE trip_id = @trip_id AND user_id = @user_id
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-            bigquery.ScalarQueryParameter("user_id", "STRING", current_user)
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-
-    if results.total_rows == 0:
-        raise HTTPException(status_code=404, detail="Trip not found")
-
-    trip_data = [row for row in results][0]
-
-    return trip_data
+async def get_trip(trip_id: str, request: Request, response: Response, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
+    # raises 404 for an unknown trip and 403 for someone else's
+    trip = await async_db.get_trip(trip_id, current_user)
+
+    # the version is bumped by every update, 304 when the client already has this one
+    unchanged = not_modified(request, response, etag("trip", trip_id, trip.pop("version")))
+    if unchanged is not None:
+        return unchanged
+    return trip
 
 @router.get("/weather/{trip_id}")
-async def get_trip_weather(trip_id: str, current_user: str = Depends(get_current_user)):
-    # First verify that the trip belongs to the user
-    trip_query = f"""
-        SELECT 1
-        FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-        WHERE trip_id = @trip_id AND user_id = @user_id
-    """
-    trip_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-            bigquery.ScalarQueryParameter("user_id", "STRING", current_user)
-        ]
-    )
-    trip_job = client.query(trip_query, trip_config)
-    if trip_job.result().total_rows == 0:
-        raise HTTPException(status_code=404, detail="Trip not found")
-
-    # If trip belongs to user, get weather data
-    query = f"""
-        SELECT *
-        FROM `{TRIP_DATASET_ID}.{TRIP_WEATHER_TABLE_ID}`
-        WHERE trip_id = @trip_id
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id)
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-
-    if results.total_rows == 0:
+async def get_trip_weather(trip_id: str, request: Request, response: Response, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
+    # the weather is read together with the trip's owner, 404 for an unknown trip and 403 for someone else's
+    trip_weather_data = await async_db.get_trip_weather(trip_id, current_user)
+
+    if trip_weather_data is None:
         raise HTTPException(status_code=404, detail="Trip weather not found")
 
-    trip_weather_data = [row for row in results][0]
+    # weather rows have no version, the handful of columns are hashed instead
+    unchanged = not_modified(request, response, content_etag("trip_weather", trip_weather_data))
+    if unchanged is not None:
+        return unchanged
     return trip_weather_data
 
+# without parameters the full records are returned
+# fields= picks record fields, aggregate= averages them per year or per trip day, years= keeps the most recent years
 @router.get("/weather/historical/{trip_id}")
-async def get_historical_weather(trip_id: str, current_user: str = Depends(get_current_user)):
-    # verify that the trip belongs to the user
-    trip_query = f"""
-        SELECT 1
-        FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-        WHERE trip_id = @trip_id AND user_id = @user_id
-    """
-    trip_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-            bigquery.ScalarQueryParameter("user_id", "STRING", current_user)
-        ]
-    )
-    trip_job = client.query(trip_query, trip_config)
-    if trip_job.result().total_rows == 0:
-        raise HTTPException(status_code=404, detail="Trip not found")
-
-    # get historical weather data
-    query = f"""
-        SELECT *
-        FROM `{TRIP_DATASET_ID}.{HISTORICAL_WEATHER_TABLE}`
-        WHERE trip_id = @trip_id
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id)
-        ]
-    )
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-
-    if results.total_rows == 0:
+async def get_historical_weather(
+    trip_id: str,
+    fields: Optional[str] = None,
+    aggregate: Optional[Literal["year", "day"]] = None,
+    years: Optional[int] = Query(None, ge=1, le=100),
+    current_user: str = Depends(get_current_user),
+    async_db: AsyncDatabase = Depends(get_async_db),
+):
+    if fields or aggregate or years:
+        return await get_historical_weather_view(async_db, trip_id, current_user, fields, aggregate, years)
+
+    # get historical weather data together with the trip's owner, 404 for an unknown trip and 403 for someone else's
+    data = await async_db.get_historical_weather(trip_id, current_user)
+
+    if data is None:
+        raise HTTPException(status_code=404, detail="Historical weather data not found")
+
+    # the largest response we have, the stored JSON is streamed as it is instead of parsed and encoded again
+    return StreamingJSONResponse({"trip_id": data["trip_id"], "historical_data": RawJSON(data["historical_stats"])})
+
+# the reduced historical weather, computed by the database from the stored JSON
+async def get_historical_weather_view(async_db: AsyncDatabase, trip_id: str, user_id: str, fields: Optional[str],
+                                      aggregate: Optional[str], years: Optional[int]):
+    if aggregate:
+        # aggregated rows carry their key (year or day) and count, the fields are the averaged values
+        selected = parse_fields(fields, AGGREGATE_FIELDS, default=["min_temp", "max_temp"])
+    else:
+        selected = parse_fields(fields, RECORD_FIELDS, always=["date"])
+
+    # 404 for an unknown trip and 403 for someone else's
+    rows = await async_db.get_historical_weather_view(trip_id, user_id, selected, aggregate, years)
+    if rows is None:
         raise HTTPException(status_code=404, detail="Historical weather data not found")
 
-    data = [row for row in results][0]
-    historical_data = json.loads(data.historical_stats)
+    if "descriptions" in selected:
+        # the database returns each record's descriptions as JSON text
+        for row in rows:
+            row["descriptions"] = json.loads(row["descriptions"]) if row["descriptions"] is not None else []
 
-    return {"trip_id": data.trip_id, "historical_data": historical_data}
+    return {"trip_id": trip_id, "aggregate": aggregate, "historical_data": rows}
 
 @router.delete("/delete/{trip_id}")
-async def delete_trip(trip_id: str, current_user: str = Depends(get_current_user)):
+async def delete_trip(trip_id: str, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     try:
-        # First verify that the trip belongs to the user
-        trip_query = f"""
-            SELECT 1
-            FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-            WHERE trip_id = @trip_id AND user_id = @user_id
-        """
-        trip_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-                bigquery.ScalarQueryParameter("user_id", "STRING", current_user)
-            ]
-        )
-        trip_job = client.query(trip_query, trip_config)
-        if trip_job.result().total_rows == 0:
-            raise HTTPException(status_code=404, detail="Trip not found or you don't have permission to delete it")
-        
-        # 1. Delete packing lists associated with the trip
-        packing_query = f"""
-            DELETE FROM `{TRIP_DATASET_ID}.{PACKING_TABLE_ID}`
-            WHERE trip_id = @trip_id
-        """
-        packing_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-            ]
-        )
-        client.query(packing_query, packing_config).result()
-        
-        # 2. Delete weather data associated with the trip
-        weather_query = f"""
-            DELETE FROM `{TRIP_DATASET_ID}.{TRIP_WEATHER_TABLE_ID}`
-            WHERE trip_id = @trip_id
-        """
-        weather_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-            ]
-        )
-        client.query(weather_query, weather_config).result()
-
-        # 3. Delete historical weather data associated with the trip
-        historical_query = f"""
-            DELETE FROM `{TRIP_DATASET_ID}.{HISTORICAL_WEATHER_TABLE}`
-            WHERE trip_id = @trip_id
-        """
-        historical_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-            ]
-        )
-        client.query(historical_query, historical_config).result()
-        
-        # 4. Finally delete the trip itself
-        trip_delete_query = f"""
-            DELETE FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-            WHERE trip_id = @trip_id AND user_id = @user_id
-        """
-        trip_delete_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-                bigquery.ScalarQueryParameter("user_id", "STRING", current_user),
-            ]
-        )
-        client.query(trip_delete_query, trip_delete_config).result()
+        # marks the trip deleted, its packing lists and weather go with it and are purged later
+        # ownership is checked by the same statement, 404 for an unknown trip and 403 for someone else's
+        await async_db.delete_trip(trip_id, current_user)
+        # item edits still buffered for the trip's lists would only be written to deleted rows
+        packing_buffer.discard_trips([trip_id])
+        # the user's open tabs drop the trip's packing lists
+        await progress_events.publish(current_user, "trips_deleted", trip_ids=[trip_id])
         
         return {"message": "Trip and all associated data deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# delete several trips at once
+# trips that don't exist or aren't the user's are reported back instead of failing the whole request
+@router.post("/delete")
+async def delete_trips(request: TripBulkDelete, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
+    trip_ids = list(dict.fromkeys(request.trip_ids))
+    if not trip_ids:
+        raise HTTPException(status_code=400, detail="No trip ids given")
+    if len(trip_ids) > MAX_BULK_DELETE_TRIPS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_DELETE_TRIPS} trips can be deleted at once")
+
+    try:
+        # a single statement marks all of them deleted, their data is purged later
+        deleted = await async_db.delete_trips(trip_ids, current_user)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if deleted:
+        packing_buffer.discard_trips(deleted)
+        await progress_events.publish(current_user, "trips_deleted", trip_ids=deleted)
+
+    deleted_ids = set(deleted)
+    return {
+        "message": f"{len(deleted)} trips deleted successfully",
+        "deleted": deleted,
+        "not_found": [trip_id for trip_id in trip_ids if trip_id not in deleted_ids],
+    }
+
 @router.put("/update/{trip_id}")
-async def update_trip(trip_id: str, trip: Trip, current_user: str = Depends(get_current_user)):
+async def update_trip(trip_id: str, trip: Trip, current_user: str = Depends(get_current_user), async_db: AsyncDatabase = Depends(get_async_db)):
     try:
         trip_data = trip.dict()
         
-        # First verify that the trip belongs to the user
-        trip_query = f"""
-            SELECT 1
-            FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-            WHERE trip_id = @trip_id AND user_id = @user_id
-        """
-        trip_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-                bigquery.ScalarQueryParameter("user_id", "STRING", current_user)
-            ]
-        )
-        trip_job = client.query(trip_query, trip_config)
-        if trip_job.result().total_rows == 0:
-            raise HTTPException(status_code=404, detail="Trip not found")
-
-        # Update trip information
-        query = f"""
-        UPDATE `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`
-        SET city = @city,
-            country = @country,
-            start_date = @start_date,
-            end_date = @end_date,
-            luggage_type = @luggage_type,
-            trip_purpose = @trip_purpose
-        WHERE trip_id = @trip_id AND user_id = @user_id
-        """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("city", "STRING", trip_data["city"]),
-                bigquery.ScalarQueryParameter("country", "STRING", trip_data["country"]),
-                bigquery.ScalarQueryParameter("start_date", "STRING", trip_data["start_date"]),
-                bigquery.ScalarQueryParameter("end_date", "STRING", trip_data["end_date"]),
-                bigquery.ScalarQueryParameter("luggage_type", "STRING", trip_data["luggage_type"]),
-                bigquery.ScalarQueryParameter("trip_purpose", "STRING", trip_data["trip_purpose"]),
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-                bigquery.ScalarQueryParameter("user_id", "STRING", current_user),
-            ]
-        )
-        client.query(query, job_config=job_config).result()
+        # Update trip information, only the user's own trip is written (404 for an unknown trip, 403 for someone else's)
+        await async_db.update_trip(trip_id, current_user, trip_data)
 
         # Get new weather predictions
         predictor = WeatherPredictor(WEATHERSTACK_API_KEY)
         try:
-            prediction = predictor.predict_trip_weather(trip_data["city"], trip_data["start_date"], trip_data["end_date"])
+            # the prediction calls the weather API, keep it off the event loop
+            prediction = await asyncio.to_thread(predictor.predict_trip_weather, trip_data["city"], trip_data["start_date"], trip_data["end_date"])
             if not isinstance(prediction, dict):
                 raise HTTPException(status_code=500, detail=f"Failed to predict weather: {prediction}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to predict weather: {str(e)}")
 
         # Update weather data
-        weather_query = f"""
-        UPDATE `{TRIP_DATASET_ID}.{TRIP_WEATHER_TABLE_ID}`
-        SET min_temp = @min_temp,
-            max_temp = @max_temp,
-            uv = @uv,
-            description = @description,
-            confidence = @confidence
-        WHERE trip_id = @trip_id
-        """
-        weather_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("min_temp", "FLOAT64", prediction["predicted_min_temp"]),
-                bigquery.ScalarQueryParameter("max_temp", "FLOAT64", prediction["predicted_max_temp"]),
-                bigquery.ScalarQueryParameter("uv", "FLOAT64", prediction["predicted_uv_index"]),
-                bigquery.ScalarQueryParameter("description", "STRING", prediction["predicted_description"]),
-                bigquery.ScalarQueryParameter("confidence", "FLOAT64", prediction["confidence_score"]),
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id)
-            ]
-        )
-        client.query(weather_query, weather_config).result()
+        await async_db.update_trip_weather(trip_id, {
+            "min_temp": prediction["predicted_min_temp"],
+            "max_temp": prediction["predicted_max_temp"],
+            "uv": prediction["predicted_uv_index"],
+            "description": prediction["predicted_description"],
+            "confidence": prediction["confidence_score"]
+        })
 
         return {"message": "Trip and weather data updated successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,5 +1,5 @@
 from .config import config
-from .database import get_collection
+from .database import db
 #from .security import verify_token "verify_token"
 
-__all__ = ["config", "get_collection"]
+__all__ = ["config", "db"]
@@ -0,0 +1,110 @@
+"""Shared clients for the external services the API talks to.
+
+Each client is built once per process, the first time something asks for it, instead of
+at import time in every module that uses it. Importing the app is therefore cheap and
+needs no credentials, and the heavy SDK imports only happen when a client is actually
+used. Clients are closed by the app's lifespan shutdown.
+
+Routers take clients as FastAPI dependencies (`Depends(get_gemini_client)`), so tests can
+swap them with `app.dependency_overrides`; services call the same getters directly.
+"""
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import config
+
+BIGQUERY_PROJECT = os.getenv("BIGQUERY_PROJECT", "capstone-sophiallamas")
+# only used by the redis backends of the query cache, idempotency keys, token revocations and progress events
+QUERY_CACHE_REDIS_URL = os.getenv("QUERY_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._closers: Dict[str, Optional[Callable[[Any], None]]] = {}
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], None]] = None):
+        """Declare how to build (and optionally close) a client. Nothing is built yet."""
+        self._factories[name] = factory
+        self._closers[name] = close
+
+    def get(self, name: str) -> Any:
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._clients[name] = self._factories[name]()
+        return client
+
+    def set(self, name: str, client: Any):
+        """Use an already built client, e.g. a fake one in tests."""
+        with self._lock:
+            self._clients[name] = client
+
+    def is_initialized(self, name: str) -> bool:
+        return name in self._clients
+
+    def close_all(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            close = self._closers.get(name)
+            if close is None:
+                continue
+            try:
+                close(client)
+            except Exception as e:
+                print(f"Error closing {name} client: {str(e)}")
+
+
+def _create_bigquery_client():
+    from google.cloud import bigquery
+    return bigquery.Client(project=BIGQUERY_PROJECT)
+
+
+def _create_bigquery_storage_client():
+    # optional dependency (google-cloud-bigquery-storage, with pyarrow), raises ImportError without it
+    from google.cloud import bigquery_storage
+    return bigquery_storage.BigQueryReadClient()
+
+
+def _create_gemini_client():
+    from google import genai
+    return genai.Client(api_key=config.GEMINI_API_KEY)
+
+
+def _create_redis_client():
+    # optional dependency, only needed by the redis backends
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("The redis backends (QUERY_CACHE_BACKEND, IDEMPOTENCY_BACKEND, TOKEN_REVOCATION_BACKEND, "
+                           "PROGRESS_EVENTS_BROKER) need the redis package (pip install redis)")
+    return redis.Redis.from_url(QUERY_CACHE_REDIS_URL, socket_timeout=1)
+
+
+clients = ClientRegistry()
+clients.register("bigquery", _create_bigquery_client, close=lambda client: client.close())
+clients.register("bigquery_storage", _create_bigquery_storage_client)
+clients.register("gemini", _create_gemini_client)
+clients.register("redis", _create_redis_client, close=lambda client: client.close())
+
+
+def get_bigquery_client():
+    return clients.get("bigquery")
+
+
+def get_bigquery_storage_client():
+    return clients.get("bigquery_storage")
+
+
+def get_gemini_client():
+    return clients.get("gemini")
+
+
+def get_redis_client():
+    return clients.get("redis")
@@ -1,7 +1,9 @@
 import os
 from dotenv import load_dotenv
 
-# Load environment variables from .env
+# Load environment variables from .env, once for the whole app
+# app/core/__init__.py imports this module, so importing anything from app.core loads it
+# before the importing module reads its settings
 load_dotenv()
 
 class Config:
@@ -0,0 +1,234 @@
+"""Per-user dashboard snapshots, kept up to date by the writes instead of rebuilt.
+
+The dashboard shows a user's name, their trips and each trip's packing progress. A
+snapshot holds all of it for one user, so a dashboard load is a lookup here. It is built
+on a miss from three reads run at the same time. After that, the Database write methods
+patch it in place: a new, edited or deleted trip, a new, edited or deleted packing list,
+a new name. Nothing is read again until the snapshot expires.
+
+Snapshots live in this process, bounded by DASHBOARD_SNAPSHOT_MAX_USERS and expiring after
+DASHBOARD_SNAPSHOT_TTL_SECONDS. They are off unless that is set: writes served by another
+worker are only seen once the snapshot expires, so only turn them on with a single worker
+or sticky sessions, and keep the TTL short (e.g. 30 seconds) otherwise. A write that lands while
+a snapshot is being built may be missing from what was read, so that build is used for
+its own request but not stored.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from app.core.metrics import metrics
+
+# longest a snapshot is kept, 0 (the default) builds the dashboard on every load
+DASHBOARD_SNAPSHOT_TTL_SECONDS = float(os.getenv("DASHBOARD_SNAPSHOT_TTL_SECONDS", "0"))
+# snapshots kept per process, the least recently loaded go first
+DASHBOARD_SNAPSHOT_MAX_USERS = int(os.getenv("DASHBOARD_SNAPSHOT_MAX_USERS", "10000"))
+
+Row = Dict[str, Any]
+
+
+class _Snapshot:
+    __slots__ = ("name", "trips", "lists", "expires_at", "version")
+
+    def __init__(self, name: str, trips: Dict[str, Row], lists: Dict[str, List[Any]], expires_at: float):
+        self.name = name
+        # trip_id -> trip columns
+        self.trips = trips
+        # list_id -> [trip_id, total_items, packed_items]
+        self.lists = lists
+        self.expires_at = expires_at
+        # replaced on every change while stored, None for a snapshot that isn't
+        self.version: Optional[str] = None
+
+
+class SnapshotBuild:
+    """A snapshot being read from storage, see DashboardSnapshots.begin."""
+
+    __slots__ = ("user_id", "stale")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.stale = False
+
+
+class DashboardSnapshots:
+    def __init__(self, order_by: Sequence[str], max_users: int = DASHBOARD_SNAPSHOT_MAX_USERS,
+                 ttl_seconds: float = DASHBOARD_SNAPSHOT_TTL_SECONDS):
+        # the trips of a dashboard are listed in this key order
+        self.order_by = list(order_by)
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._snapshots: "OrderedDict[str, _Snapshot]" = OrderedDict()
+        # which stored snapshot a trip or list is in, for writes that only know the trip or list
+        self._trip_users: Dict[str, str] = {}
+        self._list_users: Dict[str, str] = {}
+        self._builds: List[SnapshotBuild] = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether built snapshots are stored, without them a dashboard only needs the page it shows."""
+        return self.ttl_seconds > 0
+
+    def get(self, user_id: str) -> Optional[Row]:
+        """The user's dashboard (name, trips with their packing totals and the snapshot's version), None if there is no snapshot."""
+        with self._lock:
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is not None and snapshot.expires_at <= time.monotonic():
+                self._drop(user_id)
+                snapshot = None
+            if snapshot is None:
+                metrics.increment("dashboard_snapshot.misses")
+                return None
+            self._snapshots.move_to_end(user_id)
+            metrics.increment("dashboard_snapshot.hits")
+            return self._view(snapshot)
+
+    def begin(self, user_id: str) -> SnapshotBuild:
+        """Start building a snapshot, before its reads are issued."""
+        build = SnapshotBuild(user_id)
+        with self._lock:
+            self._builds.append(build)
+        return build
+
+    def finish(self, build: SnapshotBuild, name: str, trips: Iterable[Row], lists: Iterable[Row]) -> Row:
+        """Store what a build read, unless a write raced it, and return the dashboard."""
+        snapshot = _Snapshot(name, {trip["trip_id"]: dict(trip) for trip in trips},
+                             {row["list_id"]: [row["trip_id"], row["total_items"], row["packed_items"]] for row in lists},
+                             time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            self._builds.remove(build)
+            if build.stale:
+                metrics.increment("dashboard_snapshot.stale_builds")
+            elif self.enabled:
+                self._store(build.user_id, snapshot)
+            return self._view(snapshot)
+
+    def abandon(self, build: SnapshotBuild):
+        with self._lock:
+            self._builds.remove(build)
+
+    # incremental updates, called by the Database write methods once the write succeeded
+
+    def name_changed(self, user_id: str, name: str):
+        with self._lock:
+            self._touch(user_id)
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is not None:
+                snapshot.name = name
+
+    def trip_written(self, trip: Row):
+        """A new trip, or an existing one with every column."""
+        with self._lock:
+            user_id = trip["user_id"]
+            self._touch(user_id)
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is not None:
+                snapshot.trips[trip["trip_id"]] = dict(trip)
+                self._trip_users[trip["trip_id"]] = user_id
+
+    def trip_updated(self, user_id: str, trip_id: str, fields: Row):
+        with self._lock:
+            self._touch(user_id)
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is not None and trip_id in snapshot.trips:
+                snapshot.trips[trip_id].update(fields)
+
+    def trips_deleted(self, user_id: str, trip_ids: Iterable[str]):
+        """Trips deleted, together with their packing lists."""
+        trip_ids = set(trip_ids)
+        with self._lock:
+            self._touch(user_id)
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is None:
+                return
+            for trip_id in trip_ids:
+                snapshot.trips.pop(trip_id, None)
+                self._trip_users.pop(trip_id, None)
+            for list_id in [list_id for list_id, entry in snapshot.lists.items() if entry[0] in trip_ids]:
+                del snapshot.lists[list_id]
+                self._list_users.pop(list_id, None)
+
+    def list_written(self, packing_list: Row):
+        """A new packing list."""
+        with self._lock:
+            user_id = self._trip_users.get(packing_list["trip_id"])
+            self._touch(user_id)
+            if user_id is None:
+                return
+            snapshot = self._snapshots[user_id]
+            snapshot.lists[packing_list["list_id"]] = [packing_list["trip_id"], packing_list.get("total_items"),
+                                                       packing_list.get("packed_items")]
+            self._list_users[packing_list["list_id"]] = user_id
+
+    def list_updated(self, list_id: str, total_items: int, packed_items: int):
+        with self._lock:
+            user_id = self._list_users.get(list_id)
+            self._touch(user_id)
+            if user_id is not None:
+                entry = self._snapshots[user_id].lists[list_id]
+                entry[1], entry[2] = total_items, packed_items
+
+    def list_deleted(self, list_id: str):
+        with self._lock:
+            user_id = self._list_users.pop(list_id, None)
+            self._touch(user_id)
+            if user_id is not None:
+                del self._snapshots[user_id].lists[list_id]
+
+    def clear(self):
+        """Forget every snapshot, for bulk writes that aren't worth patching in."""
+        with self._lock:
+            self._snapshots.clear()
+            self._trip_users.clear()
+            self._list_users.clear()
+            for build in self._builds:
+                build.stale = True
+
+    def _touch(self, user_id: Optional[str]):
+        # builds in flight may have read before this write, a write whose user isn't known stales them all
+        for build in self._builds:
+            if user_id is None or build.user_id == user_id:
+                build.stale = True
+        # the user's dashboard changes, and with it its ETag
+        snapshot = self._snapshots.get(user_id)
+        if snapshot is not None:
+            snapshot.version = uuid.uuid4().hex
+
+    def _store(self, user_id: str, snapshot: _Snapshot):
+        if user_id in self._snapshots:
+            self._drop(user_id)
+        snapshot.version = uuid.uuid4().hex
+        self._snapshots[user_id] = snapshot
+        for trip_id in snapshot.trips:
+            self._trip_users[trip_id] = user_id
+        for list_id in snapshot.lists:
+            self._list_users[list_id] = user_id
+        while len(self._snapshots) > self.max_users:
+            self._drop(next(iter(self._snapshots)))
+
+    def _drop(self, user_id: str):
+        snapshot = self._snapshots.pop(user_id)
+        for trip_id in snapshot.trips:
+            self._trip_users.pop(trip_id, None)
+        for list_id in snapshot.lists:
+            self._list_users.pop(list_id, None)
+
+    def _view(self, snapshot: _Snapshot) -> Row:
+        totals: Dict[str, List[int]] = {}
+        for trip_id, total_items, packed_items in snapshot.lists.values():
+            trip_totals = totals.setdefault(trip_id, [0, 0, 0])
+            # same rules as Database.get_trip_packing_totals: only lists with items are counted
+            if total_items:
+                trip_totals[0] += 1
+                trip_totals[1] += total_items
+                trip_totals[2] += packed_items or 0
+
+        trips = []
+        for trip in sorted(snapshot.trips.values(), key=lambda trip: [trip.get(column) or "" for column in self.order_by]):
+            lists_count, total_items, packed_items = totals.get(trip["trip_id"], (0, 0, 0))
+            trips.append({**trip, "lists_count": lists_count, "total_items": total_items, "packed_items": packed_items})
+        return {"name": snapshot.name, "trips": trips, "version": snapshot.version}
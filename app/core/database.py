@@ -0,0 +1,1204 @@
+"""Data access for the API.
+
+Routers and services don't build warehouse clients or SQL themselves, they call the typed
+methods of `db` (users, trips, weather, historical weather and packing lists). That gives
+one place to instrument, cache and batch storage access.
+
+The statements run on one of two backends, picked with DATABASE_BACKEND:
+
+- "bigquery" (the default): the production warehouse, tables are resolved from the
+  *_DATASET_ID / *_TABLE_ID environment variables
+- "sqlite": an embedded database file (DATABASE_PATH) opened on first use, for running
+  the whole API and load tests on a laptop without credentials
+
+Statements are written once in the SQL both engines understand, with @name parameters.
+The few that can't be shared (the registration and trip purge transactions, the JSON
+progress aggregation, the counter backfill) branch on `backend.dialect`.
+
+Methods taking the requesting user's id check ownership in the same statement as the work
+itself: reads fetch the owner alongside the data, writes are restricted to the user's rows
+and only look the owner up when nothing was written. Either way they raise NotFound or
+Forbidden, which answer 404 and 403 when they reach FastAPI.
+
+Trips and packing lists carry a version that their update methods bump in the same
+statement, the routers derive ETags from it.
+
+Deleting a trip only stamps its deleted_at column, every read treats a stamped trip (and
+everything hanging off it) as gone. purge_deleted_trips removes them for good in a few
+set-based statements, run periodically by app.services.purge_deleted_trips.
+
+Reads that are repeated on every page load (profile, trips, weather, single packing lists)
+go through the query cache (app.core.query_cache), tagged with the user, trip or list
+they depend on. The write methods invalidate those tags after the write succeeds, so every
+write path, including the packing list buffer, keeps the cache correct.
+
+Inserts are written behind by the insert buffer (app.core.insert_buffer) when it is
+enabled. Reads whose tags match queued rows flush it first, so they always see them.
+
+The write methods also patch the per-user dashboard snapshots (app.core.dashboard_snapshot)
+with what they changed, so the dashboard doesn't have to be read again after a write.
+
+`db` methods block until the statement finishes. Async handlers use `async_db` instead,
+which runs the same methods in a bounded thread pool with a timeout and cancels the
+warehouse jobs of calls that are abandoned.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from app.core.clients import get_bigquery_client, get_bigquery_storage_client
+from app.core.dashboard_snapshot import DashboardSnapshots
+from app.core.insert_buffer import InsertBuffer, create_insert_buffer
+from app.core.metrics import metrics
+from app.core.pagination import keyset_predicate, param_name
+from app.core.query_cache import QueryCache, create_query_cache, list_tag, trip_tag, user_tag
+from app.core.schema import migrate_bigquery, migrate_sqlite
+from app.services.historical_weather import AGGREGATE_FIELDS, RECORD_FIELDS, historical_weather_query
+from app.services.packing_progress import user_progress_json_query
+
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "bigquery")
+# file used by the sqlite backend, ":memory:" keeps everything in process
+DATABASE_PATH = os.getenv("DATABASE_PATH", "packwise.db")
+# statements running at once for async callers, more wait their turn
+DATABASE_MAX_CONCURRENCY = int(os.getenv("DATABASE_MAX_CONCURRENCY", "16"))
+# default limit for an async call, including the time spent waiting for a slot
+DATABASE_QUERY_TIMEOUT_SECONDS = float(os.getenv("DATABASE_QUERY_TIMEOUT_SECONDS", "30"))
+# rows per batch of the local backend's bulk reads, BigQuery sizes its own pages and record batches
+DATABASE_SCAN_BATCH_ROWS = int(os.getenv("DATABASE_SCAN_BATCH_ROWS", "1000"))
+
+USER_DATASET_ID = os.getenv("USER_DATASET_ID")
+USERNAME_TABLE_ID = os.getenv("USERNAME_TABLE_ID")
+USER_INFO_TABLE_ID = os.getenv("USER_INFO_TABLE_ID")
+TRIP_DATASET_ID = os.getenv("TRIP_DATASET_ID")
+TRIP_TABLE_ID = os.getenv("TRIP_TABLE_ID")
+TRIP_WEATHER_TABLE_ID = os.getenv("TRIP_WEATHER_TABLE_ID")
+HISTORICAL_WEATHER_TABLE = os.getenv("HISTORICAL_WEATHER_TABLE")
+PACKING_TABLE_ID = os.getenv("PACKING_TABLE_ID")
+
+# a result row, column name -> value
+Row = Dict[str, Any]
+
+# columns of user_trips that can be read and updated through the trip methods
+TRIP_COLUMNS = ["trip_id", "user_id", "city", "country", "start_date", "end_date", "luggage_type", "trip_purpose"]
+# the stable key trip listings are ordered and paginated by
+TRIP_KEY = ["start_date", "trip_id"]
+USER_INFO_COLUMNS = ["name", "age", "gender"]
+TRIP_WEATHER_COLUMNS = ["min_temp", "max_temp", "uv", "description", "confidence"]
+PACKING_LIST_COLUMNS = ["list_id", "trip_id", "packing_list", "total_items", "packed_items"]
+
+
+class DatabaseError(Exception):
+    """Raised when a statement or an insert fails."""
+
+
+class UsernameTaken(DatabaseError):
+    """Raised by create_user when the username is already registered."""
+
+
+class QueryCancelled(DatabaseError):
+    """Raised inside a call whose caller gave up on it, before it starts another statement."""
+
+
+class NotFound(HTTPException):
+    """Raised by the user-scoped methods when the row doesn't exist, answers 404."""
+
+    def __init__(self, detail: str = "Not found"):
+        super().__init__(status_code=404, detail=detail)
+
+
+class Forbidden(HTTPException):
+    """Raised by the user-scoped methods when the row belongs to another user, answers 403."""
+
+    def __init__(self, detail: str = "Access denied"):
+        super().__init__(status_code=403, detail=detail)
+
+
+class QueryScope:
+    """The statements run for one async call, so they can be cancelled together."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._jobs = []
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.cancelled:
+            raise QueryCancelled()
+
+    def add_job(self, job):
+        with self._lock:
+            cancelled = self.cancelled
+            if not cancelled:
+                self._jobs.append(job)
+        if cancelled:
+            _cancel_job(job)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            jobs, self._jobs = self._jobs, []
+        for job in jobs:
+            _cancel_job(job)
+
+
+def _cancel_job(job):
+    try:
+        job.cancel()
+    except Exception as e:
+        # the job may have finished in the meantime, which is fine
+        print(f"Error cancelling query job {getattr(job, 'job_id', '')}: {str(e)}")
+
+
+# scope of the async call the current worker thread is running, if any
+_thread_scope = threading.local()
+
+
+def current_scope() -> Optional[QueryScope]:
+    return getattr(_thread_scope, "scope", None)
+
+
+class Tables:
+    """Fully qualified names of the tables, as the backend's SQL expects them."""
+
+    def __init__(self, users: str, users_info: str, trips: str, trip_weather: str,
+                 historical_weather: str, packing_lists: str):
+        self.users = users
+        self.users_info = users_info
+        self.trips = trips
+        self.trip_weather = trip_weather
+        self.historical_weather = historical_weather
+        self.packing_lists = packing_lists
+
+
+class BigQueryBackend:
+    dialect = "bigquery"
+
+    def __init__(self):
+        self.tables = Tables(
+            users=f"`{USER_DATASET_ID}.{USERNAME_TABLE_ID}`",
+            users_info=f"`{USER_DATASET_ID}.{USER_INFO_TABLE_ID}`",
+            trips=f"`{TRIP_DATASET_ID}.{TRIP_TABLE_ID}`",
+            trip_weather=f"`{TRIP_DATASET_ID}.{TRIP_WEATHER_TABLE_ID}`",
+            historical_weather=f"`{TRIP_DATASET_ID}.{HISTORICAL_WEATHER_TABLE}`",
+            packing_lists=f"`{TRIP_DATASET_ID}.{PACKING_TABLE_ID}`",
+        )
+        # streaming inserts take the table id without backticks
+        self._table_ids = {name: table.strip("`") for name, table in vars(self.tables).items()}
+
+    @property
+    def client(self):
+        # the shared client, built on the first statement rather than at import
+        return get_bigquery_client()
+
+    def _parameter(self, name: str, value: Any):
+        from google.cloud import bigquery
+        if isinstance(value, (list, tuple)):
+            # a list of dicts becomes an array of structs, e.g. for UPDATE ... FROM UNNEST(@rows)
+            if value and isinstance(value[0], dict):
+                return bigquery.ArrayQueryParameter(name, "STRUCT", [
+                    bigquery.StructQueryParameter(None, *[self._parameter(field, field_value) for field, field_value in item.items()])
+                    for item in value
+                ])
+            element_type = _bigquery_type(value[0]) if value else "STRING"
+            return bigquery.ArrayQueryParameter(name, element_type, list(value))
+        return bigquery.ScalarQueryParameter(name, _bigquery_type(value), value)
+
+    def _job_config(self, params: Optional[Dict[str, Any]], **options):
+        from google.cloud import bigquery
+        return bigquery.QueryJobConfig(
+            query_parameters=[self._parameter(name, value) for name, value in (params or {}).items()],
+            **options,
+        )
+
+    def _run(self, sql: str, params: Optional[Dict[str, Any]]):
+        job_config = self._job_config(params)
+        scope = current_scope()
+        if scope is not None:
+            scope.check()
+        job = self.client.query(sql, job_config=job_config)
+        if scope is not None:
+            # abandoned calls cancel their job instead of letting it run (and bill) to completion
+            scope.add_job(job)
+        return job.result()
+
+    def query(self, sql: str, params: Optional[Dict[str, Any]] = None) -> List[Row]:
+        return [dict(row.items()) for row in self._run(sql, params)]
+
+    def query_batches(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Iterator[List[Row]]:
+        """The rows of a large result, a batch at a time.
+
+        With the optional google-cloud-bigquery-storage package the result is streamed as
+        Arrow record batches over the Storage Read API, in parallel and without JSON
+        encoding. Without it the REST result pages are read one after the other.
+        """
+        rows = self._run(sql, params)
+        storage_client = self._storage_client()
+        if storage_client is None:
+            for page in rows.pages:
+                yield [dict(row.items()) for row in page]
+            return
+        for batch in rows.to_arrow_iterable(bqstorage_client=storage_client):
+            yield batch.to_pylist()
+
+    def _storage_client(self):
+        try:
+            return get_bigquery_storage_client()
+        except ImportError:
+            return None
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> int:
+        """Run a statement, returning how many rows it changed."""
+        return self._run(sql, params).num_dml_affected_rows or 0
+
+    def execute_many(self, sql: str, params_list: Sequence[Dict[str, Any]]):
+        for params in params_list:
+            self._run(sql, params)
+
+    def insert_rows(self, table: str, rows: List[Row], row_ids: Optional[List[str]] = None):
+        # with row_ids, rows that were already streamed under the same id are dropped by BigQuery
+        errors = self.client.insert_rows_json(self._table_ids[table], rows, row_ids=row_ids)
+        if errors:
+            raise DatabaseError(str(errors))
+
+    def close(self):
+        # the client belongs to the registry, which closes it
+        pass
+
+
+def _bigquery_type(value: Any) -> str:
+    # bool has to be checked before int, it is a subclass
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, int):
+        return "INT64"
+    if isinstance(value, float):
+        return "FLOAT64"
+    return "STRING"
+
+
+class SQLiteBackend:
+    dialect = "sqlite"
+
+    def __init__(self, path: str = DATABASE_PATH):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self.lock = threading.RLock()
+        self.tables = Tables(
+            users="users",
+            users_info="users_info",
+            trips="user_trips",
+            trip_weather="trip_weather",
+            historical_weather="trip_historical_weather",
+            packing_lists="packing_lists",
+        )
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # one connection shared by every thread, statements are serialized by the lock
+        # opened (and the schema created) on the first statement rather than at import
+        if self._connection is None:
+            with self.lock:
+                if self._connection is None:
+                    connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                    connection.row_factory = sqlite3.Row
+                    # the tables declared in app.core.schema, including columns added since the file was created
+                    migrate_sqlite(connection, self.tables)
+                    self._connection = connection
+        return self._connection
+
+    def query(self, sql: str, params: Optional[Dict[str, Any]] = None) -> List[Row]:
+        _check_scope()
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params or {})]
+
+    def query_batches(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Iterator[List[Row]]:
+        # read in full first, a cursor left open between batches would see the caller's own writes
+        rows = self.query(sql, params)
+        for start in range(0, len(rows), DATABASE_SCAN_BATCH_ROWS):
+            yield rows[start:start + DATABASE_SCAN_BATCH_ROWS]
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> int:
+        """Run a statement, returning how many rows it changed."""
+        _check_scope()
+        with self.lock:
+            return self.connection.execute(sql, params or {}).rowcount
+
+    def execute_many(self, sql: str, params_list: Sequence[Dict[str, Any]]):
+        with self.lock, self.transaction():
+            self.connection.executemany(sql, params_list)
+
+    def insert_rows(self, table: str, rows: List[Row], row_ids: Optional[List[str]] = None):
+        if not rows:
+            return
+        columns = list(rows[0])
+        # with row_ids the insert is being retried or replayed, a row already written keeps its key
+        ignore = " OR IGNORE" if row_ids is not None else ""
+        sql = f"""
+            INSERT{ignore} INTO {getattr(self.tables, table)} ({", ".join(columns)})
+            VALUES ({", ".join(f"@{column}" for column in columns)})
+        """
+        try:
+            self.execute_many(sql, rows)
+        except sqlite3.Error as e:
+            raise DatabaseError(str(e))
+
+    def transaction(self):
+        return _SQLiteTransaction(self)
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _check_scope():
+    # local statements are short, an abandoned call just doesn't start new ones
+    scope = current_scope()
+    if scope is not None:
+        scope.check()
+
+
+class _SQLiteTransaction:
+    def __init__(self, backend: SQLiteBackend):
+        self.backend = backend
+
+    def __enter__(self):
+        self.backend.lock.acquire()
+        self.backend.connection.execute("BEGIN")
+        return self.backend
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.backend.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.backend.lock.release()
+        return False
+
+
+# registers a user and their profile in one transaction, failing if the username is taken
+BIGQUERY_REGISTER_SCRIPT = """
+    BEGIN
+        BEGIN TRANSACTION;
+        IF EXISTS (SELECT 1 FROM {users} WHERE username = @username) THEN
+            RAISE USING MESSAGE = 'Username already exists';
+        END IF;
+        INSERT INTO {users} (id, username, password)
+        VALUES (@user_id, @username, @password);
+        INSERT INTO {users_info} (user_id, name, age, gender)
+        VALUES (@user_id, @name, @age, @gender);
+        COMMIT TRANSACTION;
+    EXCEPTION WHEN ERROR THEN
+        ROLLBACK TRANSACTION;
+        RAISE USING MESSAGE = @@error.message;
+    END;
+"""
+
+
+# removes every deleted trip and everything hanging off it in one transaction, returns how many trips
+# the transaction reads a single snapshot, so all four statements see the same deleted trips
+BIGQUERY_PURGE_TRIPS_SCRIPT = """
+    DECLARE purged INT64 DEFAULT 0;
+    BEGIN
+        BEGIN TRANSACTION;
+        SET purged = (SELECT COUNT(*) FROM {trips} WHERE deleted_at IS NOT NULL);
+        DELETE FROM {packing_lists} WHERE trip_id IN (SELECT trip_id FROM {trips} WHERE deleted_at IS NOT NULL);
+        DELETE FROM {trip_weather} WHERE trip_id IN (SELECT trip_id FROM {trips} WHERE deleted_at IS NOT NULL);
+        DELETE FROM {historical_weather} WHERE trip_id IN (SELECT trip_id FROM {trips} WHERE deleted_at IS NOT NULL);
+        DELETE FROM {trips} WHERE deleted_at IS NOT NULL;
+        COMMIT TRANSACTION;
+    EXCEPTION WHEN ERROR THEN
+        ROLLBACK TRANSACTION;
+        RAISE USING MESSAGE = @@error.message;
+    END;
+    SELECT purged;
+"""
+
+
+class Database:
+    """Typed data access on top of a backend. Every method is a single round-trip unless noted."""
+
+    def __init__(self, backend, cache: Optional[QueryCache] = None, dashboards: Optional[DashboardSnapshots] = None):
+        self.backend = backend
+        self.tables: Tables = backend.tables
+        self.cache = cache
+        # without snapshots dashboards are still built from it, just not kept
+        self.dashboards = dashboards or DashboardSnapshots(TRIP_KEY, ttl_seconds=0)
+        self.insert_buffer: Optional[InsertBuffer] = None
+
+    def close(self):
+        self.backend.close()
+
+    def migrate_schema(self) -> List[str]:
+        """Bring the tables in line with app.core.schema, returning what was changed or needs doing.
+
+        Local files are migrated when they are opened, so only BigQuery has anything to do here.
+        """
+        if self.backend.dialect == "bigquery":
+            return migrate_bigquery(self.backend)
+        # opening the file migrates it
+        self.backend.connection
+        return []
+
+    # every statement goes through here, which is where timing and error counts are kept
+    def _query(self, name: str, sql: str, params: Optional[Dict[str, Any]] = None) -> List[Row]:
+        return self._instrumented(name, self.backend.query, sql, params)
+
+    def _execute(self, name: str, sql: str, params: Optional[Dict[str, Any]] = None) -> int:
+        return self._instrumented(name, self.backend.execute, sql, params)
+
+    def _insert(self, name: str, table: str, rows: List[Row]):
+        """Insert rows now, or queue them when the insert buffer is on."""
+        tags = sorted({tag for row in rows for tag in _row_tags(table, row)})
+        if self.insert_buffer is not None:
+            self.insert_buffer.add(table, rows, tags)
+            return
+        self._instrumented(name, self.backend.insert_rows, table, rows)
+        self._invalidate(*tags)
+
+    def write_rows(self, table: str, rows: List[Row], row_ids: List[str]):
+        """Insert a batch of rows taken from the insert buffer."""
+        self._instrumented(f"insert_batch_{table}", self.backend.insert_rows, table, rows, row_ids)
+        self._invalidate(*{tag for row in rows for tag in _row_tags(table, row)})
+
+    def _flush_pending(self, tags: Iterable[str] = (), tables: Iterable[str] = ()):
+        """Write queued inserts that a read is about to depend on."""
+        if self.insert_buffer is not None:
+            self.insert_buffer.flush_pending(tags, tables)
+
+    def _instrumented(self, name: str, fn, *args):
+        started_at = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception:
+            metrics.increment(f"database.errors.{name}")
+            raise
+        finally:
+            metrics.increment(f"database.calls.{name}")
+            metrics.observe(f"database.seconds.{name}", time.perf_counter() - started_at)
+
+    def _scan(self, name: str, sql: str, params: Optional[Dict[str, Any]] = None) -> Iterator[Row]:
+        """The rows of a bulk read, streamed batch by batch instead of built into one list.
+
+        The time recorded includes whatever the caller does between rows.
+        """
+        started_at = time.perf_counter()
+        rows = 0
+        try:
+            for batch in self.backend.query_batches(sql, params):
+                rows += len(batch)
+                yield from batch
+        except Exception:
+            metrics.increment(f"database.errors.{name}")
+            raise
+        finally:
+            metrics.increment(f"database.calls.{name}")
+            metrics.increment(f"database.rows.{name}", rows)
+            metrics.observe(f"database.seconds.{name}", time.perf_counter() - started_at)
+
+    def _first(self, name: str, sql: str, params: Optional[Dict[str, Any]] = None,
+               tags: Optional[List[str]] = None) -> Optional[Row]:
+        rows = self._cached_query(name, sql, params, tags) if tags else self._query(name, sql, params)
+        return rows[0] if rows else None
+
+    # query cache
+
+    def _cached_query(self, name: str, sql: str, params: Optional[Dict[str, Any]], tags: List[str]) -> List[Row]:
+        """A query served from the query cache while none of its tags has been invalidated."""
+        self._flush_pending(tags)
+        if self.cache is None:
+            return self._query(name, sql, params)
+        return self.cache.get_or_load(name, sql, params, tags, lambda: self._query(name, sql, params))
+
+    def _invalidate(self, *tags: str):
+        if self.cache is not None:
+            self.cache.invalidate(*tags)
+
+    # ownership checks, folded into the statement that does the work
+
+    def _owned_first(self, name: str, resource: str, columns: Sequence[str], source: str, key: str,
+                     params: Dict[str, Any], user_id: str, tags: Optional[List[str]] = None) -> Row:
+        """Read one row together with its owner and check the owner is user_id.
+
+        `source` is the FROM clause with the trips table aliased `t`, so the owner comes
+        back with the data instead of from a lookup before it. Raises NotFound when `key`
+        matches nothing or the trip was deleted and Forbidden when the row is another
+        user's. With tags the read is cached, the owner is checked on every call either way.
+        """
+        row = self._first(name, f"""
+            SELECT t.user_id AS owner_id, {", ".join(columns)}
+            FROM {source}
+            WHERE {key} AND t.deleted_at IS NULL
+        """, params, tags)
+        _check_owner(row, user_id, resource)
+        del row["owner_id"]
+        return row
+
+    def _owned_execute(self, name: str, resource: str, sql: str, owner_sql: str, params: Dict[str, Any], user_id: str,
+                       tags: Sequence[str] = ()):
+        """Run a write that is already restricted to user_id's rows.
+
+        Changing a row means the user owns it, so the usual case is a single statement.
+        Only when nothing changed is the owner read with `owner_sql` (selecting owner_id),
+        to raise NotFound or Forbidden. Queued inserts with the tags are written first.
+        """
+        self._flush_pending(tags)
+        if self._execute(name, sql, params):
+            return
+        _check_owner(self._first(name, owner_sql, params), user_id, resource)
+
+    # users
+
+    def get_user(self, user_id: str) -> Optional[Row]:
+        """id and username of a user."""
+        return self._first("get_user", f"SELECT id, username FROM {self.tables.users} WHERE id = @user_id",
+                           {"user_id": user_id})
+
+    def get_user_credentials(self, username: str) -> Optional[Row]:
+        """id, username and password hash of a user, for login."""
+        return self._first("get_user_credentials",
+                           f"SELECT id, username, password FROM {self.tables.users} WHERE username = @username",
+                           {"username": username})
+
+    def list_usernames(self) -> List[str]:
+        return [row["username"] for row in self._query("list_usernames", f"SELECT username FROM {self.tables.users}")]
+
+    def create_user(self, user_id: str, username: str, password: str, name: str, age: int, gender: Optional[str]):
+        """Insert a user and their profile atomically. Raises UsernameTaken if the username exists."""
+        params = {"user_id": user_id, "username": username, "password": password,
+                  "name": name, "age": age, "gender": gender}
+
+        if self.backend.dialect == "bigquery":
+            script = BIGQUERY_REGISTER_SCRIPT.format(users=self.tables.users, users_info=self.tables.users_info)
+            try:
+                self._execute("create_user", script, params)
+            except Exception as e:
+                if _script_raised(e, "Username already exists"):
+                    raise UsernameTaken(username)
+                raise
+            return
+
+        with self.backend.transaction():
+            if self._first("create_user", f"SELECT 1 AS taken FROM {self.tables.users} WHERE username = @username", params):
+                raise UsernameTaken(username)
+            self._execute("create_user", f"""
+                INSERT INTO {self.tables.users} (id, username, password)
+                VALUES (@user_id, @username, @password)
+            """, params)
+            self._execute("create_user", f"""
+                INSERT INTO {self.tables.users_info} (user_id, name, age, gender)
+                VALUES (@user_id, @name, @age, @gender)
+            """, params)
+
+    def update_password(self, user_id: str, password: str):
+        self._execute("update_password", f"UPDATE {self.tables.users} SET password = @password WHERE id = @user_id",
+                      {"password": password, "user_id": user_id})
+
+    def get_user_info(self, user_id: str) -> Optional[Row]:
+        """name, age and gender of a user."""
+        return self._first("get_user_info", f"""
+            SELECT {", ".join(USER_INFO_COLUMNS)}
+            FROM {self.tables.users_info}
+            WHERE user_id = @user_id
+        """, {"user_id": user_id}, tags=[user_tag(user_id)])
+
+    def update_user_info(self, user_id: str, fields: Dict[str, Any]):
+        """Update the given profile columns (name, age, gender)."""
+        self._execute("update_user_info", f"""
+            UPDATE {self.tables.users_info}
+            SET {_assignments(fields, USER_INFO_COLUMNS)}
+            WHERE user_id = @user_id
+        """, {**fields, "user_id": user_id})
+        self._invalidate(user_tag(user_id))
+        if "name" in fields:
+            self.dashboards.name_changed(user_id, fields["name"])
+
+    # trips
+
+    def insert_trip(self, trip: Row):
+        self._insert("insert_trip", "trips", [trip])
+        self.dashboards.trip_written({column: trip.get(column) for column in TRIP_COLUMNS})
+
+    def get_trip(self, trip_id: str, user_id: Optional[str] = None) -> Optional[Row]:
+        """A trip, None if it doesn't exist. With user_id, raises NotFound or Forbidden instead and adds its version."""
+        if user_id is not None:
+            columns = [f"t.{column}" for column in TRIP_COLUMNS] + ["IFNULL(t.version, 0) AS version"]
+            return self._owned_first("get_trip", "Trip", columns,
+                                     f"{self.tables.trips} t", "t.trip_id = @trip_id",
+                                     {"trip_id": trip_id}, user_id, tags=[trip_tag(trip_id), user_tag(user_id)])
+        return self._first("get_trip", f"""
+            SELECT {", ".join(TRIP_COLUMNS)}
+            FROM {self.tables.trips}
+            WHERE trip_id = @trip_id AND deleted_at IS NULL
+        """, {"trip_id": trip_id}, tags=[trip_tag(trip_id)])
+
+    def trip_exists(self, trip_id: str, user_id: str) -> bool:
+        """Whether the trip exists and belongs to the user."""
+        self._flush_pending([trip_tag(trip_id)])
+        return self._first("trip_exists", f"""
+            SELECT 1 AS found
+            FROM {self.tables.trips}
+            WHERE trip_id = @trip_id AND user_id = @user_id AND deleted_at IS NULL
+        """, {"trip_id": trip_id, "user_id": user_id}) is not None
+
+    def list_trips(self, user_id: str, columns: Sequence[str], limit: int, after: Optional[Sequence[Any]] = None) -> List[Row]:
+        """Up to `limit` of the user's trips ordered by TRIP_KEY, starting after the key values in `after`."""
+        _check_columns(columns, TRIP_COLUMNS)
+        params = {"user_id": user_id, "limit": limit}
+        keyset = ""
+        if after is not None:
+            keyset = f"AND {keyset_predicate(TRIP_KEY)}"
+            params.update({f"after_{param_name(column)}": value for column, value in zip(TRIP_KEY, after)})
+        return self._cached_query("list_trips", f"""
+            SELECT {", ".join(columns)}
+            FROM {self.tables.trips}
+            WHERE user_id = @user_id AND deleted_at IS NULL {keyset}
+            ORDER BY {", ".join(TRIP_KEY)}
+            LIMIT @limit
+        """, params, [user_tag(user_id)])
+
+    def update_trip(self, trip_id: str, user_id: str, fields: Dict[str, Any]):
+        """Update the given trip columns. Raises NotFound or Forbidden."""
+        self._owned_execute("update_trip", "Trip", f"""
+            UPDATE {self.tables.trips}
+            SET {_assignments(fields, TRIP_COLUMNS)},
+                version = IFNULL(version, 0) + 1
+            WHERE trip_id = @trip_id AND user_id = @user_id AND deleted_at IS NULL
+        """, self._trip_owner_sql(), {**fields, "trip_id": trip_id, "user_id": user_id}, user_id, [trip_tag(trip_id)])
+        self._invalidate(trip_tag(trip_id), user_tag(user_id))
+        self.dashboards.trip_updated(user_id, trip_id, fields)
+
+    def delete_trip(self, trip_id: str, user_id: str):
+        """Delete a trip, and with it its packing lists, weather and historical weather.
+
+        The trip is only marked deleted, a single UPDATE, and is purged later by
+        purge_deleted_trips. Raises NotFound or Forbidden.
+        """
+        self._owned_execute("delete_trip", "Trip", f"""
+            UPDATE {self.tables.trips}
+            SET deleted_at = CURRENT_TIMESTAMP
+            WHERE trip_id = @trip_id AND user_id = @user_id AND deleted_at IS NULL
+        """, self._trip_owner_sql(), {"trip_id": trip_id, "user_id": user_id}, user_id, [trip_tag(trip_id)])
+        # the trip's packing lists were cached under the user's tag, their ids aren't known here
+        self._invalidate(trip_tag(trip_id), user_tag(user_id))
+        self.dashboards.trips_deleted(user_id, [trip_id])
+
+    def delete_trips(self, trip_ids: Sequence[str], user_id: str) -> List[str]:
+        """Delete several of the user's trips like delete_trip, returning the ids that were deleted.
+
+        Ids that don't exist, were already deleted or belong to someone else are skipped.
+        """
+        if not trip_ids:
+            return []
+        self._flush_pending([trip_tag(trip_id) for trip_id in trip_ids])
+        # one placeholder per id, both engines accept that (unlike array parameters)
+        params = {f"trip_id_{i}": trip_id for i, trip_id in enumerate(trip_ids)}
+        owned = f"""
+            trip_id IN ({", ".join(f"@{name}" for name in params)})
+            AND user_id = @user_id AND deleted_at IS NULL
+        """
+        params["user_id"] = user_id
+
+        # on BigQuery a trip deleted in between is simply stamped again, a harmless race
+        with self.backend.transaction() if self.backend.dialect == "sqlite" else nullcontext():
+            deleted = [row["trip_id"] for row in self._query("delete_trips",
+                                                             f"SELECT trip_id FROM {self.tables.trips} WHERE {owned}", params)]
+            if deleted:
+                self._execute("delete_trips", f"UPDATE {self.tables.trips} SET deleted_at = CURRENT_TIMESTAMP WHERE {owned}",
+                              params)
+
+        self._invalidate(user_tag(user_id), *(trip_tag(trip_id) for trip_id in deleted))
+        self.dashboards.trips_deleted(user_id, deleted)
+        return deleted
+
+    def purge_deleted_trips(self) -> int:
+        """Remove deleted trips and everything that belongs to them, returning how many trips.
+
+        One statement per table for all deleted trips together, in a single transaction.
+        """
+        # rows still queued for a deleted trip would be written after the purge and never removed
+        self._flush_pending(tables=["trips", "trip_weather", "historical_weather", "packing_lists"])
+
+        if self.backend.dialect == "bigquery":
+            script = BIGQUERY_PURGE_TRIPS_SCRIPT.format(**vars(self.tables))
+            return self._query("purge_deleted_trips", script)[0]["purged"]
+
+        deleted = f"SELECT trip_id FROM {self.tables.trips} WHERE deleted_at IS NOT NULL"
+        with self.backend.transaction():
+            for table in (self.tables.packing_lists, self.tables.trip_weather, self.tables.historical_weather):
+                self._execute("purge_deleted_trips", f"DELETE FROM {table} WHERE trip_id IN ({deleted})")
+            return self._execute("purge_deleted_trips", f"DELETE FROM {self.tables.trips} WHERE deleted_at IS NOT NULL")
+
+    def _trip_owner_sql(self) -> str:
+        return f"SELECT user_id AS owner_id FROM {self.tables.trips} WHERE trip_id = @trip_id AND deleted_at IS NULL"
+
+    # weather
+
+    def insert_trip_weather(self, weather: Row):
+        self._insert("insert_trip_weather", "trip_weather", [weather])
+
+    def get_trip_weather(self, trip_id: str, user_id: Optional[str] = None) -> Optional[Row]:
+        """The predicted weather of a trip, None if there is none.
+
+        With user_id, raises NotFound or Forbidden for the trip itself.
+        """
+        if user_id is not None:
+            # the trip drives the join so a trip without weather still tells us its owner
+            row = self._owned_first("get_trip_weather", "Trip",
+                                    ["w.trip_id", *(f"w.{column}" for column in TRIP_WEATHER_COLUMNS)],
+                                    f"{self.tables.trips} t LEFT JOIN {self.tables.trip_weather} w ON w.trip_id = t.trip_id",
+                                    "t.trip_id = @trip_id", {"trip_id": trip_id}, user_id,
+                                    tags=[trip_tag(trip_id), user_tag(user_id)])
+            return row if row["trip_id"] is not None else None
+        return self._first("get_trip_weather", f"""
+            SELECT trip_id, {", ".join(TRIP_WEATHER_COLUMNS)}
+            FROM {self.tables.trip_weather}
+            WHERE trip_id = @trip_id
+        """, {"trip_id": trip_id}, tags=[trip_tag(trip_id)])
+
+    def update_trip_weather(self, trip_id: str, fields: Dict[str, Any]):
+        self._flush_pending([trip_tag(trip_id)])
+        self._execute("update_trip_weather", f"""
+            UPDATE {self.tables.trip_weather}
+            SET {_assignments(fields, TRIP_WEATHER_COLUMNS)}
+            WHERE trip_id = @trip_id
+        """, {**fields, "trip_id": trip_id})
+        self._invalidate(trip_tag(trip_id))
+
+    def insert_historical_weather(self, trip_id: str, historical_stats: str):
+        self._insert("insert_historical_weather", "historical_weather",
+                     [{"trip_id": trip_id, "historical_stats": historical_stats}])
+
+    def get_historical_weather(self, trip_id: str, user_id: str) -> Optional[Row]:
+        """trip_id and the historical_stats JSON of a trip, None if there are none. Raises NotFound or Forbidden."""
+        row = self._owned_first("get_historical_weather", "Trip", ["h.trip_id", "h.historical_stats"],
+                                f"{self.tables.trips} t LEFT JOIN {self.tables.historical_weather} h ON h.trip_id = t.trip_id",
+                                "t.trip_id = @trip_id", {"trip_id": trip_id}, user_id,
+                                tags=[trip_tag(trip_id), user_tag(user_id)])
+        return row if row["trip_id"] is not None else None
+
+    def get_historical_weather_view(self, trip_id: str, user_id: str, fields: Sequence[str],
+                                    aggregate: Optional[str] = None, years: Optional[int] = None) -> Optional[List[Row]]:
+        """Only the given fields of a trip's historical weather records, or per year/day averages of them.
+
+        Computed from the stored JSON in the database, see app.services.historical_weather.
+        None if the trip has no historical weather. Raises NotFound or Forbidden.
+        """
+        _check_columns(fields, AGGREGATE_FIELDS if aggregate else RECORD_FIELDS)
+        self._flush_pending([trip_tag(trip_id)])
+        sql = historical_weather_query(self.tables.historical_weather, self.tables.trips, fields, aggregate, years,
+                                       self.backend.dialect)
+        params = {"trip_id": trip_id, "user_id": user_id}
+        if years is not None:
+            params["years"] = years
+        rows = self._cached_query("get_historical_weather_view", sql, params, [trip_tag(trip_id), user_tag(user_id)])
+        if rows:
+            return rows
+        # nothing came back: someone else's trip, no historical weather or an empty array,
+        # told apart without reading the stored JSON
+        row = self._owned_first("get_historical_weather_view", "Trip", ["h.trip_id"],
+                                f"{self.tables.trips} t LEFT JOIN {self.tables.historical_weather} h ON h.trip_id = t.trip_id",
+                                "t.trip_id = @trip_id", {"trip_id": trip_id}, user_id,
+                                tags=[trip_tag(trip_id), user_tag(user_id)])
+        return [] if row["trip_id"] is not None else None
+
+    # packing lists
+
+    def insert_packing_list(self, packing_list: Row):
+        self._insert("insert_packing_list", "packing_lists", [packing_list])
+        self.dashboards.list_written(packing_list)
+
+    def get_packing_list(self, list_id: str, user_id: str) -> Row:
+        """The packing_list JSON of a list, its trip_id and its version. Raises NotFound or Forbidden."""
+        return self._owned_first("get_packing_list", "Packing list", ["p.packing_list", "p.trip_id", "IFNULL(p.version, 0) AS version"],
+                                 self._packing_list_source(), "p.list_id = @list_id", {"list_id": list_id}, user_id,
+                                 tags=[list_tag(list_id), user_tag(user_id)])
+
+    def get_packing_list_version(self, list_id: str, user_id: str) -> Row:
+        """Only the version of a list, to revalidate a client's copy without reading the JSON. Raises NotFound or Forbidden."""
+        return self._owned_first("get_packing_list_version", "Packing list", ["IFNULL(p.version, 0) AS version"],
+                                 self._packing_list_source(), "p.list_id = @list_id", {"list_id": list_id}, user_id,
+                                 tags=[list_tag(list_id), user_tag(user_id)])
+
+    def get_packing_counters(self, list_id: str, user_id: str) -> Row:
+        """total_items and packed_items of a list. Raises NotFound or Forbidden."""
+        return self._owned_first("get_packing_counters", "Packing list", ["p.total_items", "p.packed_items"],
+                                 self._packing_list_source(), "p.list_id = @list_id", {"list_id": list_id}, user_id,
+                                 tags=[list_tag(list_id), user_tag(user_id)])
+
+    def list_packing_lists(self, trip_id: str, user_id: str, columns: Sequence[str], limit: int,
+                           after_list_id: Optional[str] = None) -> List[Row]:
+        """Up to `limit` packing lists of a trip owned by the user, ordered by list_id."""
+        _check_columns(columns, PACKING_LIST_COLUMNS)
+        self._flush_pending([trip_tag(trip_id)])
+        params = {"trip_id": trip_id, "user_id": user_id, "limit": limit}
+        keyset = ""
+        if after_list_id is not None:
+            keyset = f"AND {keyset_predicate(['p.list_id'])}"
+            params["after_list_id"] = after_list_id
+        return self._query("list_packing_lists", f"""
+            SELECT {", ".join(f"p.{column}" for column in columns)}
+            FROM {self.tables.packing_lists} p
+            JOIN {self.tables.trips} t ON p.trip_id = t.trip_id
+            WHERE p.trip_id = @trip_id AND t.user_id = @user_id AND t.deleted_at IS NULL {keyset}
+            ORDER BY p.list_id
+            LIMIT @limit
+        """, params)
+
+    def get_trip_packing_totals(self, trip_id: str, user_id: str) -> Optional[Row]:
+        """lists_count, total_items and packed_items summed over a trip's lists, None if the trip isn't the user's."""
+        self._flush_pending([trip_tag(trip_id)])
+        # the trip is the driving table so a trip without lists still returns a row
+        return self._first("get_trip_packing_totals", f"""
+            SELECT SUM(CASE WHEN p.total_items > 0 THEN 1 ELSE 0 END) AS lists_count,
+                   IFNULL(SUM(p.total_items), 0) AS total_items,
+                   IFNULL(SUM(p.packed_items), 0) AS packed_items
+            FROM {self.tables.trips} t
+            LEFT JOIN {self.tables.packing_lists} p ON p.trip_id = t.trip_id
+            WHERE t.trip_id = @trip_id AND t.user_id = @user_id AND t.deleted_at IS NULL
+            GROUP BY t.trip_id
+        """, {"trip_id": trip_id, "user_id": user_id})
+
+    def list_trips_packing_totals(self, trip_ids: Sequence[str], user_id: str) -> List[Row]:
+        """get_trip_packing_totals for several of the user's trips at once, with each row's trip_id."""
+        if not trip_ids:
+            return []
+        self._flush_pending([trip_tag(trip_id) for trip_id in trip_ids])
+        # one placeholder per id, both engines accept that (unlike array parameters)
+        params = {f"trip_id_{i}": trip_id for i, trip_id in enumerate(trip_ids)}
+        placeholders = ", ".join(f"@{name}" for name in params)
+        params["user_id"] = user_id
+        return self._query("list_trips_packing_totals", f"""
+            SELECT t.trip_id,
+                   SUM(CASE WHEN p.total_items > 0 THEN 1 ELSE 0 END) AS lists_count,
+                   IFNULL(SUM(p.total_items), 0) AS total_items,
+                   IFNULL(SUM(p.packed_items), 0) AS packed_items
+            FROM {self.tables.trips} t
+            LEFT JOIN {self.tables.packing_lists} p ON p.trip_id = t.trip_id
+            WHERE t.trip_id IN ({placeholders}) AND t.user_id = @user_id AND t.deleted_at IS NULL
+            GROUP BY t.trip_id
+        """, params)
+
+    def get_user_packing_progress(self, user_id: str, from_json: bool = False) -> Row:
+        """list_count and average_progress over the user's lists that have items.
+
+        With from_json the items are counted from the packing list JSON inside the
+        database instead of read from the stored counters.
+        """
+        # queued lists aren't tagged with their user, any of them may be one of theirs
+        self._flush_pending(tables=["packing_lists"])
+        if from_json:
+            sql = user_progress_json_query(self.tables.packing_lists, self.tables.trips, self.backend.dialect)
+        else:
+            sql = f"""
+                SELECT COUNT(*) AS list_count,
+                       AVG(100.0 * p.packed_items / p.total_items) AS average_progress
+                FROM {self.tables.packing_lists} p
+                JOIN {self.tables.trips} t ON p.trip_id = t.trip_id
+                WHERE t.user_id = @user_id AND t.deleted_at IS NULL AND p.total_items > 0
+            """
+        return self._query("get_user_packing_progress", sql, {"user_id": user_id})[0]
+
+    def update_packing_list(self, list_id: str, packing_list: str, total_items: int, packed_items: int,
+                            user_id: Optional[str] = None):
+        """Write a list's JSON and its counters in the same statement so they never disagree.
+
+        With user_id only the user's list is written, raises NotFound or Forbidden otherwise.
+        """
+        params = {"packing_list": packing_list, "total_items": total_items, "packed_items": packed_items, "list_id": list_id}
+        sql = f"""
+            UPDATE {self.tables.packing_lists}
+            SET packing_list = @packing_list,
+                total_items = @total_items,
+                packed_items = @packed_items,
+                version = IFNULL(version, 0) + 1
+            WHERE list_id = @list_id
+        """
+        if user_id is None:
+            self._flush_pending([list_tag(list_id)])
+            self._execute("update_packing_list", sql, params)
+        else:
+            self._owned_execute("update_packing_list", "Packing list", sql + self._owned_by_user_sql(),
+                                self._packing_list_owner_sql(), {**params, "user_id": user_id}, user_id, [list_tag(list_id)])
+        self._invalidate(list_tag(list_id))
+        self.dashboards.list_updated(list_id, total_items, packed_items)
+
+    def delete_packing_list(self, list_id: str, user_id: str):
+        """Delete one of the user's lists. Raises NotFound or Forbidden."""
+        self._owned_execute("delete_packing_list", "Packing list", f"""
+            DELETE FROM {self.tables.packing_lists}
+            WHERE list_id = @list_id {self._owned_by_user_sql()}
+        """, self._packing_list_owner_sql(), {"list_id": list_id, "user_id": user_id}, user_id, [list_tag(list_id)])
+        self._invalidate(list_tag(list_id))
+        self.dashboards.list_deleted(list_id)
+
+    def _packing_list_source(self) -> str:
+        return f"{self.tables.packing_lists} p JOIN {self.tables.trips} t ON p.trip_id = t.trip_id"
+
+    def _packing_list_owner_sql(self) -> str:
+        return f"""
+            SELECT t.user_id AS owner_id
+            FROM {self._packing_list_source()}
+            WHERE p.list_id = @list_id AND t.deleted_at IS NULL
+        """
+
+    def _owned_by_user_sql(self) -> str:
+        # restricts a packing list write to lists on the user's trips
+        return f"AND trip_id IN (SELECT trip_id FROM {self.tables.trips} WHERE user_id = @user_id AND deleted_at IS NULL)"
+
+    # dashboard snapshots (app.core.dashboard_snapshot), these are read together to build one
+
+    def list_all_trips(self, user_id: str) -> List[Row]:
+        """Every trip of the user with all TRIP_COLUMNS, ordered by TRIP_KEY."""
+        # not through the query cache, the snapshot built from it is the cache
+        self._flush_pending([user_tag(user_id)])
+        return self._query("list_all_trips", f"""
+            SELECT {", ".join(TRIP_COLUMNS)}
+            FROM {self.tables.trips}
+            WHERE user_id = @user_id AND deleted_at IS NULL
+            ORDER BY {", ".join(TRIP_KEY)}
+        """, {"user_id": user_id})
+
+    def list_user_packing_counters(self, user_id: str) -> List[Row]:
+        """list_id, trip_id, total_items and packed_items of every list on the user's trips."""
+        # queued lists aren't tagged with their user, any of them may be one of theirs
+        self._flush_pending(tables=["packing_lists"])
+        return self._query("list_user_packing_counters", f"""
+            SELECT p.list_id, p.trip_id, p.total_items, p.packed_items
+            FROM {self._packing_list_source()}
+            WHERE t.user_id = @user_id AND t.deleted_at IS NULL
+        """, {"user_id": user_id})
+
+    # recommendations
+
+    def get_packing_list_trip_info(self, list_id: str, user_id: str) -> Optional[Row]:
+        """A user's packing list with the trip and weather details the recommender compares on."""
+        self._flush_pending([list_tag(list_id)])
+        return self._first("get_packing_list_trip_info", f"""
+            SELECT p.list_id, p.packing_list, t.trip_id, t.trip_purpose, t.country, t.city,
+                   w.min_temp, w.max_temp, w.description
+            FROM {self.tables.packing_lists} p
+            JOIN {self.tables.trips} t ON p.trip_id = t.trip_id
+            JOIN {self.tables.trip_weather} w ON t.trip_id = w.trip_id
+            WHERE p.list_id = @list_id AND t.user_id = @user_id AND t.deleted_at IS NULL
+        """, {"list_id": list_id, "user_id": user_id})
+
+    def find_similar_trips(self, trip_info: Row, description_pattern: str, similarity_threshold: float,
+                           limit: int = 50) -> List[str]:
+        """Ids of other trips scoring at least similarity_threshold against trip_info, best first."""
+        rows = self._query("find_similar_trips", f"""
+            WITH trip_details AS (
+                SELECT t.trip_id,
+                       CASE
+                           WHEN t.trip_purpose = @trip_purpose THEN 0.2 ELSE 0
+                       END +
+                       CASE
+                           WHEN t.country = @country THEN 0.1 ELSE 0
+                       END +
+                       CASE
+                           WHEN t.city = @city THEN 0.1 ELSE 0
+                       END +
+                       CASE
+                           WHEN ABS(w.min_temp - @min_temp) < 5 THEN 0.2 ELSE 0
+                       END +
+                       CASE
+                           WHEN ABS(w.max_temp - @max_temp) < 5 THEN 0.2 ELSE 0
+                       END +
+                       CASE
+                           WHEN w.description LIKE @description_pattern THEN 0.2 ELSE 0
+                       END AS similarity_score
+                FROM {self.tables.trips} t
+                JOIN {self.tables.trip_weather} w ON t.trip_id = w.trip_id
+                WHERE t.trip_id != @trip_id  -- Exclude the current trip
+                  AND t.deleted_at IS NULL
+            )
+            SELECT trip_id
+            FROM trip_details
+            WHERE similarity_score >= @similarity_threshold
+            ORDER BY similarity_score DESC
+            LIMIT @limit
+        """, {
+            "trip_id": trip_info["trip_id"],
+            "trip_purpose": trip_info["trip_purpose"],
+            "country": trip_info["country"],
+            "city": trip_info["city"],
+            "min_temp": trip_info["min_temp"],
+            "max_temp": trip_info["max_temp"],
+            "description_pattern": description_pattern,
+            "similarity_threshold": float(similarity_threshold),
+            "limit": limit,
+        })
+        return [row["trip_id"] for row in rows]
+
+    def get_packing_lists_for_trips(self, trip_ids: Sequence[str]) -> List[Row]:
+        """list_id, trip_id and packing_list of every list of the given trips."""
+        if not trip_ids:
+            return []
+        # one placeholder per id, both engines accept that (unlike array parameters)
+        params = {f"trip_id_{i}": trip_id for i, trip_id in enumerate(trip_ids)}
+        # the lists are the largest values we read, so they come through the bulk reader
+        return list(self._scan("get_packing_lists_for_trips", f"""
+            SELECT list_id, trip_id, packing_list
+            FROM {self.tables.packing_lists}
+            WHERE trip_id IN ({", ".join(f"@{name}" for name in params)})
+        """, params))
+
+    # packing counter backfill (app.services.backfill_packing_counters)
+
+    def list_packing_lists_without_counters(self) -> Iterator[Row]:
+        """list_id and packing_list of every list without counters, streamed."""
+        return self._scan("list_packing_lists_without_counters", f"""
+            SELECT list_id, packing_list
+            FROM {self.tables.packing_lists}
+            WHERE total_items IS NULL
+        """)
+
+    def write_packing_counters(self, counts: Iterable[Tuple[str, int, int]]):
+        """Write a batch of (list_id, total_items, packed_items), skipping lists that already have counters."""
+        rows = [{"list_id": list_id, "total_items": total_items, "packed_items": packed_items}
+                for list_id, total_items, packed_items in counts]
+        if self.backend.dialect == "bigquery":
+            # one statement for the whole batch keeps us well under the DML quota
+            self._execute("write_packing_counters", f"""
+                UPDATE {self.tables.packing_lists} p
+                SET total_items = c.total_items,
+                    packed_items = c.packed_items
+                FROM UNNEST(@counts) c
+                WHERE p.list_id = c.list_id AND p.total_items IS NULL
+            """, {"counts": rows})
+        else:
+            self._instrumented("write_packing_counters", self.backend.execute_many, f"""
+                UPDATE {self.tables.packing_lists}
+                SET total_items = @total_items,
+                    packed_items = @packed_items
+                WHERE list_id = @list_id AND total_items IS NULL
+            """, rows)
+        self._invalidate(*(list_tag(row["list_id"]) for row in rows))
+        # a backfill touches lists of every user, cheaper to rebuild the snapshots than to patch them
+        self.dashboards.clear()
+
+
+def _row_tags(table: str, row: Row) -> List[str]:
+    """The cache tags an inserted row belongs to, also how reads find it in the insert buffer."""
+    if table == "trips":
+        return [user_tag(row["user_id"]), trip_tag(row["trip_id"])]
+    if table == "packing_lists":
+        return [list_tag(row["list_id"]), trip_tag(row["trip_id"])]
+    return [trip_tag(row["trip_id"])]
+
+
+def _check_owner(row: Optional[Row], user_id: str, resource: str):
+    """Raise NotFound if there's no row, Forbidden if its owner_id isn't user_id."""
+    if row is None:
+        raise NotFound(f"{resource} not found")
+    if row["owner_id"] != user_id:
+        raise Forbidden()
+
+
+def _script_raised(e: Exception, message: str) -> bool:
+    """Whether a failed BigQuery script stopped at `RAISE USING MESSAGE = message`."""
+    # check the job errors rather than str(e), which also contains the script text
+    return any(message in error.get("message", "") for error in getattr(e, "errors", None) or [])
+
+
+def _check_columns(columns: Iterable[str], allowed: Sequence[str]):
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+
+def _assignments(fields: Dict[str, Any], allowed: Sequence[str]) -> str:
+    """SET clause for the given columns, e.g. "city = @city, country = @country"."""
+    _check_columns(fields, allowed)
+    return ", ".join(f"{column} = @{column}" for column in fields)
+
+
+class AsyncDatabase:
+    """Awaitable versions of the Database methods, for async handlers.
+
+    `await async_db.get_trip(trip_id, user_id)` runs db.get_trip in a pool of
+    DATABASE_MAX_CONCURRENCY threads, so a slow statement never blocks the event loop.
+    Every call accepts a `timeout=` keyword overriding DATABASE_QUERY_TIMEOUT_SECONDS;
+    a call that times out answers 504. When a call is abandoned, on timeout or because
+    the request was cancelled after its client disconnected, its warehouse jobs are
+    cancelled too.
+    """
+
+    def __init__(self, database: Database, max_concurrency: int = DATABASE_MAX_CONCURRENCY,
+                 timeout_seconds: float = DATABASE_QUERY_TIMEOUT_SECONDS):
+        self.database = database
+        self.timeout_seconds = timeout_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="database")
+        # only touched from the event loop thread
+        self._pending = 0
+
+    def __getattr__(self, name: str):
+        method = getattr(self.database, name)
+
+        async def call(*args, timeout: Optional[float] = None, **kwargs):
+            return await self.run(method, *args, timeout=timeout, **kwargs)
+
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+    async def run(self, fn, *args, timeout: Optional[float] = None, **kwargs):
+        """Run any blocking function that uses `db` the same way, e.g. several calls that belong together."""
+        scope = QueryScope()
+        queued_at = time.perf_counter()
+
+        def scoped():
+            metrics.observe("database.queue_wait_seconds", time.perf_counter() - queued_at)
+            scope.check()
+            _thread_scope.scope = scope
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _thread_scope.scope = None
+
+        self._pending += 1
+        metrics.set_gauge("database.pending", self._pending)
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, scoped)
+            return await asyncio.wait_for(future, self.timeout_seconds if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            scope.cancel()
+            metrics.increment("database.timeouts")
+            raise HTTPException(status_code=504, detail="The database took too long to respond")
+        except asyncio.CancelledError:
+            # the request was cancelled, most likely its client went away
+            scope.cancel()
+            metrics.increment("database.cancelled")
+            raise
+        finally:
+            self._pending -= 1
+            metrics.set_gauge("database.pending", self._pending)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_backend(name: str = DATABASE_BACKEND):
+    if name == "bigquery":
+        return BigQueryBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unknown DATABASE_BACKEND: {name}")
+
+
+# both are cheap to create, the backend connects on its first statement
+db = Database(create_backend(), create_query_cache(), DashboardSnapshots(TRIP_KEY))
+db.insert_buffer = create_insert_buffer(db.write_rows)
+async_db = AsyncDatabase(db)
+
+
+def get_async_db() -> AsyncDatabase:
+    """Dependency giving routers the database, override it in tests to swap the backend."""
+    return async_db
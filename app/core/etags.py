@@ -0,0 +1,54 @@
+"""ETags and conditional GETs for the resources clients poll.
+
+A resource's ETag is a hash of what identifies its current state: the version its row
+carries (trips and packing lists, bumped by every update), a token of the in-memory copy
+serving it (dashboard snapshots, lists held by the packing list buffer), or failing both
+the content itself. Routers compute it before building the response, so a request whose
+If-None-Match still matches answers 304 without serializing anything:
+
+    tag = etag("trip", trip_id, trip.pop("version"))
+    unchanged = not_modified(request, response, tag)
+    if unchanged is not None:
+        return unchanged
+    return trip
+"""
+import hashlib
+import json
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+from app.core.metrics import metrics
+
+# responses are per user and change whenever they are written, clients may keep them but must revalidate
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag(*parts: Any) -> str:
+    """Strong ETag of a resource's identifying parts, e.g. ("trip", trip_id, version)."""
+    data = json.dumps(parts, separators=(",", ":"), default=str).encode("utf-8")
+    return f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+
+def content_etag(kind: str, data: Any) -> str:
+    """ETag of a small resource without a version, from its content."""
+    return etag(kind, json.dumps(data, sort_keys=True, default=str))
+
+
+def matches(if_none_match: Optional[str], tag: str) -> bool:
+    """Whether an If-None-Match header matches the ETag, with the weak comparison RFC 9110 asks for."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+
+def not_modified(request: Request, response: Response, tag: str) -> Optional[Response]:
+    """Set the ETag on the response, and return a 304 to answer with instead when the client's copy is current."""
+    headers = {"ETag": tag, "Cache-Control": CACHE_CONTROL}
+    if matches(request.headers.get("if-none-match"), tag):
+        metrics.increment("http.not_modified")
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,227 @@
+"""Idempotency-Key support for the slow POSTs clients retry.
+
+Creating a trip calls the weather API and generating a packing list calls Gemini, so
+clients time out and retry them. A request sent with an `Idempotency-Key` header is run
+once per key and user. The key is claimed before the handler runs, and the response is
+stored for IDEMPOTENCY_TTL_SECONDS once it has run:
+
+- a retry of a completed request gets the stored response back (with an
+  `Idempotent-Replayed: true` header) without calling anything upstream
+- a duplicate arriving while the first is still running waits for it, up to
+  IDEMPOTENCY_WAIT_SECONDS before answering 409
+- the same key sent with a different request body answers 422
+
+The handler keeps running when the client that sent it goes away, so the retry it is
+about to make finds the response. Failures are not stored: the claim is released and a
+retry runs the request again. A claim left behind by a worker that died expires after
+IDEMPOTENCY_LOCK_SECONDS.
+
+Two backends, picked with IDEMPOTENCY_BACKEND like the query cache's:
+
+- "memory" (the default): per worker process, so a retry served by another worker runs
+  the request again.
+- "redis": shared by every worker through the redis client (QUERY_CACHE_REDIS_URL).
+- "none" ignores the header.
+
+Backend failures never fail a request, it just runs without the guarantee.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from fastapi import HTTPException
+
+from app.core.cache import TTLCache
+from app.core.clients import get_redis_client
+from app.core.metrics import metrics
+from app.core.responses import FastJSONResponse, dumps
+
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+# how long a completed response is replayed
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+# keys remembered per process by the memory backend, the least recently used go first
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "5000"))
+# how long a duplicate waits for the request it repeats before a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+# a claim whose request never finished (its worker died) is given up after this long
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "300"))
+
+# longest key accepted
+MAX_KEY_LENGTH = 255
+# how often a waiting duplicate checks on the request it repeats
+POLL_SECONDS = 0.1
+
+Record = Dict[str, Any]
+
+
+class MemoryIdempotencyBackend:
+    """Records in a bounded, expiring LRU of this process."""
+
+    def __init__(self, max_keys: int, ttl_seconds: float):
+        self._records = TTLCache(max_keys, ttl_seconds)
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, record: Record, ttl_seconds: float) -> Optional[Record]:
+        """Store the record unless the key has one, which is returned instead."""
+        with self._lock:
+            existing = self._records.get(key)
+            if existing is not None:
+                return existing
+            self._records.set(key, record, ttl_seconds)
+            return None
+
+    def set(self, key: str, record: Record, ttl_seconds: float):
+        self._records.set(key, record, ttl_seconds)
+
+    def release(self, key: str, token: str):
+        """Drop the key's claim, unless it has since been taken by another request."""
+        with self._lock:
+            existing = self._records.get(key)
+            if existing is not None and existing["token"] == token:
+                self._records.delete(key)
+
+
+class RedisIdempotencyBackend:
+    """Records in redis, shared by every worker."""
+
+    prefix = "packwise:idempotency:"
+
+    @property
+    def client(self):
+        return get_redis_client()
+
+    def claim(self, key: str, record: Record, ttl_seconds: float) -> Optional[Record]:
+        while True:
+            if self.client.set(self.prefix + key, json.dumps(record), ex=max(1, math.ceil(ttl_seconds)), nx=True):
+                return None
+            raw = self.client.get(self.prefix + key)
+            # gone between the two calls, claim it again
+            if raw is not None:
+                return json.loads(raw)
+
+    def set(self, key: str, record: Record, ttl_seconds: float):
+        self.client.set(self.prefix + key, dumps(record), ex=max(1, math.ceil(ttl_seconds)))
+
+    def release(self, key: str, token: str):
+        raw = self.client.get(self.prefix + key)
+        if raw is not None and json.loads(raw)["token"] == token:
+            self.client.delete(self.prefix + key)
+
+
+class IdempotencyStore:
+    def __init__(self, backend, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS,
+                 wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS, lock_seconds: float = IDEMPOTENCY_LOCK_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.lock_seconds = lock_seconds
+        # requests still running after their client left, referenced so they aren't collected
+        self._running: Set[asyncio.Task] = set()
+
+    async def run(self, scope: str, key: Optional[str], request: Any, handler: Callable[[], Awaitable[Any]]) -> Any:
+        """Run handler once for the key within scope (the user and route), see the module docstring.
+
+        `request` is what identifies the request besides the key (body, path parameters), a
+        key reused with a different one is refused. handler must return a JSON-encodable body.
+        """
+        if key is None:
+            return await handler()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+
+        record_key = _hash(scope, key)
+        fingerprint = _hash(request)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+        while True:
+            try:
+                existing = await asyncio.to_thread(self.backend.claim, record_key,
+                                                   {"token": token, "fingerprint": fingerprint, "done": False},
+                                                   self.lock_seconds)
+            except Exception as e:
+                self._error("claim", e)
+                return await handler()
+
+            if existing is None:
+                break
+            if existing["fingerprint"] != fingerprint:
+                metrics.increment("idempotency.mismatches")
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            if existing["done"]:
+                metrics.increment("idempotency.replays")
+                return FastJSONResponse(existing["body"], headers={"Idempotent-Replayed": "true"})
+            if time.monotonic() >= deadline:
+                metrics.increment("idempotency.conflicts")
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            if not waited:
+                waited = True
+                metrics.increment("idempotency.waits")
+            # the first request is running, it either stores its response or releases the key
+            await asyncio.sleep(POLL_SECONDS)
+
+        # finishes and stores its response even if this request is cancelled by its client leaving
+        task = asyncio.create_task(self._complete(record_key, token, fingerprint, handler))
+        self._running.add(task)
+        task.add_done_callback(self._finished)
+        return await asyncio.shield(task)
+
+    async def _complete(self, record_key: str, token: str, fingerprint: str, handler: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            body = await handler()
+        except BaseException:
+            # not stored, a retry runs the request again
+            try:
+                await asyncio.to_thread(self.backend.release, record_key, token)
+            except Exception as e:
+                self._error("release", e)
+            raise
+
+        try:
+            await asyncio.to_thread(self.backend.set, record_key,
+                                    {"token": token, "fingerprint": fingerprint, "done": True, "body": body},
+                                    self.ttl_seconds)
+        except Exception as e:
+            self._error("store", e)
+        return body
+
+    def _finished(self, task: asyncio.Task):
+        self._running.discard(task)
+        # its caller may be gone, retrieve the exception so it isn't reported as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    def _error(self, operation: str, e: Exception):
+        metrics.increment("idempotency.errors")
+        print(f"Idempotency {operation} failed: {str(e)}")
+
+
+def _hash(*parts: Any) -> str:
+    data = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=20).hexdigest()
+
+
+def create_idempotency_store(name: str = IDEMPOTENCY_BACKEND) -> Optional[IdempotencyStore]:
+    if name == "none":
+        return None
+    if name == "memory":
+        return IdempotencyStore(MemoryIdempotencyBackend(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL_SECONDS))
+    if name == "redis":
+        return IdempotencyStore(RedisIdempotencyBackend())
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {name}")
+
+
+idempotency = create_idempotency_store()
+
+
+async def run_idempotent(scope: str, key: Optional[str], request: Any, handler: Callable[[], Awaitable[Any]]) -> Any:
+    """IdempotencyStore.run with the configured store, or just the handler when it's turned off."""
+    if idempotency is None:
+        return await handler()
+    return await idempotency.run(scope, key, request, handler)
@@ -0,0 +1,419 @@
+"""Write-behind buffer for inserted rows.
+
+Creating a trip inserts into three tables and generating a packing list into a fourth,
+each a separate streaming-insert round-trip. With the buffer, Database.insert_* methods
+only queue the rows (and append them to the write-ahead log), and a background thread
+writes each table's queued rows in one call once INSERT_BUFFER_MAX_ROWS rows are waiting
+or the oldest has waited INSERT_BUFFER_MAX_DELAY_SECONDS. Requests no longer wait for the
+warehouse, and under bulk traffic many rows share one call.
+
+Reads don't see queued rows, so Database reads that depend on an entity with queued rows
+(matched by the same tags as the query cache) flush the buffer first: a client reading
+the trip it just created pays for the write then, everyone else never does.
+
+The buffer is off unless INSERT_BUFFER_ENABLED=true. Queued rows are only visible to
+the process that queued them, so with several workers or instances a client whose next
+request lands on another one doesn't find the trip it just created until the flush; turn
+it on only with sticky sessions, or where that delay is acceptable.
+
+Durability: with INSERT_BUFFER_WAL_DIR set, rows are appended to a log file before the
+insert returns. Each process logs into its own subdirectory, locked for as long as the
+process runs, and a starting process takes over the logs of processes that are gone
+(their lock is free) and replays them; logs of running processes are left alone. Every row
+carries an insert id, so a replayed row that had already been written isn't written twice
+(BigQuery deduplicates streaming inserts on it, SQLite ignores the existing key). Without
+the log, rows queued when the process dies are lost. The buffer is flushed on shutdown.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from app.core.metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows, logs of other processes are never taken over
+    fcntl = None
+
+INSERT_BUFFER_ENABLED = os.getenv("INSERT_BUFFER_ENABLED", "false").lower() == "true"
+# a table is written once this many rows are queued for it...
+INSERT_BUFFER_MAX_ROWS = int(os.getenv("INSERT_BUFFER_MAX_ROWS", "500"))
+# ...or once its oldest row has waited this long
+INSERT_BUFFER_MAX_DELAY_SECONDS = float(os.getenv("INSERT_BUFFER_MAX_DELAY_SECONDS", "1"))
+# past this many queued rows (e.g. the warehouse is down) inserts write synchronously instead of queueing more
+INSERT_BUFFER_MAX_QUEUED = int(os.getenv("INSERT_BUFFER_MAX_QUEUED", "10000"))
+# rows that failed this many flushes are moved to a failed-*.jsonl file in the log directory (or dropped without one)
+INSERT_BUFFER_MAX_ATTEMPTS = int(os.getenv("INSERT_BUFFER_MAX_ATTEMPTS", "5"))
+# empty disables the write-ahead log, every process logs into its own subdirectory of it
+INSERT_BUFFER_WAL_DIR = os.getenv("INSERT_BUFFER_WAL_DIR", "insert-wal")
+# fsync every append, survives an OS crash as well as a process crash at the cost of a disk flush per insert
+INSERT_BUFFER_WAL_FSYNC = os.getenv("INSERT_BUFFER_WAL_FSYNC", "false").lower() == "true"
+
+# longest wait between retries while the warehouse keeps failing
+MAX_RETRY_DELAY_SECONDS = 30.0
+
+
+class _QueuedRow:
+    __slots__ = ("row_id", "row", "tags", "attempts")
+
+    def __init__(self, row_id: str, row: Dict[str, Any], tags: Sequence[str], attempts: int = 0):
+        self.row_id = row_id
+        self.row = row
+        self.tags = tags
+        self.attempts = attempts
+
+
+class WriteAheadLog:
+    """Queued rows as JSON lines, in segments that are deleted once their rows are written.
+
+    A new segment is started every time the buffer takes its queues for a flush, so every
+    closed segment only holds rows that were taken by a flush already. Closed segments are
+    deleted after a flush writes everything it took.
+
+    The segments live in a subdirectory of the log directory that belongs to this process
+    and is locked while it runs. Several workers can share the log directory: each one only
+    takes over the subdirectories whose lock is free, i.e. whose process has exited.
+    """
+
+    def __init__(self, directory: str, fsync: bool = False):
+        self.root = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self.directory = os.path.join(directory, f"wal-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(self.directory)
+        self._lock_file = open(os.path.join(self.directory, "lock"), "w")
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # segments taken over from exited processes, read by replay() and deleted like closed ones
+        self._closed: List[str] = sorted(self._adopt_orphaned())
+        self._file = None
+        self._open_segment()
+
+    def _adopt_orphaned(self) -> List[str]:
+        """Move the segments of exited processes into this process's directory."""
+        if fcntl is None:
+            return []
+        adopted = []
+        for name in os.listdir(self.root):
+            other = os.path.join(self.root, name)
+            if not name.startswith("wal-") or other == self.directory or not os.path.isdir(other):
+                continue
+            try:
+                lock_file = open(os.path.join(other, "lock"), "a")
+            except FileNotFoundError:
+                # being cleaned up by the process that just took it over
+                continue
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # its process is still running
+                lock_file.close()
+                continue
+            try:
+                for segment in os.listdir(other):
+                    if segment.startswith("segment-") and segment.endswith(".jsonl"):
+                        path = os.path.join(self.directory, segment)
+                        os.rename(os.path.join(other, segment), path)
+                        adopted.append(path)
+                shutil.rmtree(other, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+            finally:
+                lock_file.close()
+        return adopted
+
+    def _open_segment(self):
+        # time first so segments sort in the order they were written
+        name = f"segment-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.jsonl"
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, "a", encoding="utf-8")
+
+    def replay(self) -> List[Dict[str, Any]]:
+        """The entries of the segments a previous process left behind."""
+        entries = []
+        for path in self._closed:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # the last line of a crashed process may be cut short, it was never acknowledged
+                        continue
+        return entries
+
+    def append(self, table: str, rows: Iterable[_QueuedRow]):
+        for queued in rows:
+            self._file.write(json.dumps({"table": table, "id": queued.row_id, "row": queued.row, "tags": list(queued.tags)},
+                                        separators=(",", ":"), default=str) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def rotate(self):
+        self._file.close()
+        self._closed.append(self._path)
+        self._open_segment()
+
+    def delete_closed(self):
+        for path in self._closed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._closed = []
+
+    def close(self):
+        """Close the current segment, removing it if everything it holds was written.
+
+        The directory is removed once it holds no segments, otherwise the next process to
+        start takes them over.
+        """
+        self._file.close()
+        if os.path.getsize(self._path) == 0:
+            os.remove(self._path)
+        else:
+            self._closed.append(self._path)
+        if not self._closed:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self._lock_file.close()
+
+
+class InsertBuffer:
+    def __init__(self, write: Callable[[str, List[Dict[str, Any]], List[str]], None],
+                 max_rows: int = INSERT_BUFFER_MAX_ROWS, max_delay_seconds: float = INSERT_BUFFER_MAX_DELAY_SECONDS,
+                 max_queued: int = INSERT_BUFFER_MAX_QUEUED, max_attempts: int = INSERT_BUFFER_MAX_ATTEMPTS,
+                 wal_dir: Optional[str] = INSERT_BUFFER_WAL_DIR, wal_fsync: bool = INSERT_BUFFER_WAL_FSYNC):
+        # write(table, rows, row_ids) is the blocking storage call, it runs on the flushing thread
+        self.write = write
+        self.max_rows = max_rows
+        self.max_delay_seconds = max_delay_seconds
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.wal_dir = wal_dir
+        self.wal_fsync = wal_fsync
+        self._queues: Dict[str, List[_QueuedRow]] = {}
+        self._queued = 0
+        # counts rows that are queued or being written, so reads wait for both
+        self._tag_counts: Dict[str, int] = {}
+        self._writing_tables: set = set()
+        self._oldest_at: Optional[float] = None
+        self._wal: Optional[WriteAheadLog] = None
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        # one flush at a time, whether from the background thread or a read that needs the rows
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Replay a previous process's log and start the background thread. Called on startup, or by the first insert."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            if self.wal_dir:
+                self._wal = WriteAheadLog(self.wal_dir, self.wal_fsync)
+                replayed = self._wal.replay()
+                for entry in replayed:
+                    self._enqueue(entry["table"], [_QueuedRow(entry["id"], entry["row"], entry.get("tags", []))])
+                if replayed:
+                    print(f"Replaying {len(replayed)} buffered inserts from {self.wal_dir}")
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="insert-buffer", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def add(self, table: str, rows: List[Dict[str, Any]], tags: Sequence[str] = ()):
+        """Queue rows for a table. Returns once they are in the log (if there is one)."""
+        if self._thread is None:
+            self.start()
+        queued = [_QueuedRow(uuid.uuid4().hex, row, list(tags)) for row in rows]
+        with self._lock:
+            if self._wal is not None:
+                self._wal.append(table, queued)
+            self._enqueue(table, queued)
+            full = len(self._queues[table]) >= self.max_rows
+            backlog = self._queued > self.max_queued
+        metrics.increment("insert_buffer.rows_queued", len(queued))
+        if backlog:
+            # the warehouse isn't keeping up, make inserts wait for it instead of growing the queue
+            metrics.increment("insert_buffer.backpressure")
+            self.flush()
+        elif full:
+            self._wake.set()
+
+    def has_pending(self, tags: Iterable[str] = (), tables: Iterable[str] = ()) -> bool:
+        """Whether rows with one of the tags, or for one of the tables, are queued or being written."""
+        return (any(self._tag_counts.get(tag) for tag in tags)
+                or any(self._queues.get(table) or table in self._writing_tables for table in tables))
+
+    def flush_pending(self, tags: Iterable[str] = (), tables: Iterable[str] = ()):
+        """Write the queued rows now if any of them carries one of the tags or is for one of the tables.
+
+        Waits for a flush that is already writing them. After a failed write the rows are left
+        to the background retry until the backoff is over, the read goes ahead without them
+        instead of retrying the write inline.
+        """
+        if not self.has_pending(tags, tables):
+            return
+        if self._retry_at > time.monotonic():
+            metrics.increment("insert_buffer.read_flushes_skipped")
+            return
+        metrics.increment("insert_buffer.read_flushes")
+        self.flush()
+
+    def flush(self) -> bool:
+        """Write everything queued so far. Returns whether all of it was written."""
+        with self._flush_lock:
+            with self._lock:
+                batches, self._queues = self._queues, {}
+                self._queued = 0
+                self._oldest_at = None
+                self._writing_tables = set(batches)
+                if self._wal is not None:
+                    self._wal.rotate()
+            self._update_gauges()
+            if not batches:
+                # nothing was queued, so nothing in the closed segments is still waiting to be written
+                with self._lock:
+                    if self._wal is not None:
+                        self._wal.delete_closed()
+                return True
+
+            started_at = time.perf_counter()
+            failed: Dict[str, List[_QueuedRow]] = {}
+            for table, queued in batches.items():
+                try:
+                    self.write(table, [item.row for item in queued], [item.row_id for item in queued])
+                    metrics.increment("insert_buffer.rows_flushed", len(queued))
+                    metrics.observe("insert_buffer.batch_rows", len(queued))
+                except Exception as e:
+                    metrics.increment("insert_buffer.flush_errors")
+                    print(f"Error flushing {len(queued)} buffered rows into {table}: {str(e)}")
+                    retry = self._count_attempt(table, queued)
+                    if retry:
+                        failed[table] = retry
+            metrics.observe("insert_buffer.flush_seconds", time.perf_counter() - started_at)
+
+            with self._lock:
+                retried = {id(item) for queued in failed.values() for item in queued}
+                for queued in batches.values():
+                    for item in queued:
+                        if id(item) not in retried:
+                            self._untag(item)
+                self._writing_tables = set()
+                if failed:
+                    # back in front of anything queued meanwhile, their log segments are kept until they are written
+                    for table, queued in failed.items():
+                        self._enqueue(table, queued, front=True, tagged=True)
+                    self._retry_delay = min(max(self._retry_delay * 2, self.max_delay_seconds), MAX_RETRY_DELAY_SECONDS)
+                    self._retry_at = time.monotonic() + self._retry_delay
+                else:
+                    self._retry_delay = 0.0
+                    self._retry_at = 0.0
+                    if self._wal is not None:
+                        self._wal.delete_closed()
+            self._update_gauges()
+            return not failed
+
+    def close(self):
+        """Stop the background thread and write everything still queued, called on shutdown."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        if thread is None:
+            return
+        self._wake.set()
+        thread.join()
+        if not self.flush():
+            print("Some buffered inserts could not be written, they stay in the log for the next start")
+        with self._lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
+
+    def _enqueue(self, table: str, queued: List[_QueuedRow], front: bool = False, tagged: bool = False):
+        # callers hold the lock, tagged rows are ones coming back from a failed flush and already counted
+        rows = self._queues.setdefault(table, [])
+        if front:
+            rows[:0] = queued
+        else:
+            rows.extend(queued)
+        self._queued += len(queued)
+        if not tagged:
+            for item in queued:
+                for tag in item.tags:
+                    self._tag_counts[tag] = self._tag_counts.get(tag, 0) + 1
+        if self._oldest_at is None:
+            self._oldest_at = time.monotonic()
+        metrics.set_gauge("insert_buffer.queue_depth", self._queued)
+
+    def _untag(self, item: _QueuedRow):
+        for tag in item.tags:
+            count = self._tag_counts.get(tag, 0) - 1
+            if count > 0:
+                self._tag_counts[tag] = count
+            else:
+                self._tag_counts.pop(tag, None)
+
+    def _count_attempt(self, table: str, queued: List[_QueuedRow]) -> List[_QueuedRow]:
+        """Bump the attempts of rows that failed to write, returning those to retry."""
+        retry, given_up = [], []
+        for item in queued:
+            item.attempts += 1
+            (given_up if item.attempts >= self.max_attempts else retry).append(item)
+        if given_up:
+            metrics.increment("insert_buffer.rows_failed", len(given_up))
+            if self.wal_dir:
+                path = os.path.join(self.wal_dir, f"failed-{table}.jsonl")
+                with open(path, "a", encoding="utf-8") as f:
+                    for item in given_up:
+                        f.write(json.dumps({"table": table, "id": item.row_id, "row": item.row}, default=str) + "\n")
+                print(f"Gave up on {len(given_up)} rows for {table}, they were saved to {path}")
+            else:
+                print(f"Gave up on {len(given_up)} rows for {table}")
+        return retry
+
+    def _update_gauges(self):
+        metrics.set_gauge("insert_buffer.queue_depth", self._queued)
+        for table, rows in list(self._queues.items()):
+            metrics.set_gauge(f"insert_buffer.queue_depth.{table}", len(rows))
+
+    def _due_in(self) -> float:
+        """Seconds until the next flush is due, 0 when it is due now."""
+        with self._lock:
+            now = time.monotonic()
+            if self._oldest_at is None:
+                # nothing queued, just check back later
+                return self.max_delay_seconds
+            if any(len(rows) >= self.max_rows for rows in self._queues.values()):
+                due_in = 0.0
+            else:
+                due_in = self.max_delay_seconds - (now - self._oldest_at)
+            # after a failed flush, wait out the backoff
+            return max(0.0, due_in, self._retry_at - now)
+
+    def _run(self):
+        while not self._stopping:
+            delay = self._due_in()
+            if delay > 0:
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                # never let the thread die, the rows stay queued
+                print(f"Error in the insert buffer: {str(e)}")
+                time.sleep(self.max_delay_seconds)
+
+
+def create_insert_buffer(write: Callable[[str, List[Dict[str, Any]], List[str]], None]) -> Optional[InsertBuffer]:
+    if not INSERT_BUFFER_ENABLED:
+        return None
+    return InsertBuffer(write)
@@ -0,0 +1,61 @@
+"""Minimal in-process metrics: counters, gauges and latency histograms.
+
+Values are per worker process and exposed as JSON on GET /metrics.
+"""
+import threading
+from collections import deque
+from typing import Any, Deque, Dict
+
+# number of recent observations kept per histogram for the percentiles
+HISTOGRAM_SAMPLES = 1000
+
+
+class Metrics:
+    def __init__(self):
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            samples = self._histograms.get(name)
+            if samples is None:
+                samples = self._histograms[name] = deque(maxlen=HISTOGRAM_SAMPLES)
+            samples.append(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            histograms = {}
+            for name, samples in self._histograms.items():
+                ordered = sorted(samples)
+                histograms[name] = {
+                    "count": len(ordered),
+                    "p50": _percentile(ordered, 50),
+                    "p90": _percentile(ordered, 90),
+                    "p99": _percentile(ordered, 99),
+                    "max": ordered[-1] if ordered else None,
+                }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": histograms,
+            }
+
+
+def _percentile(ordered, percent: float):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+metrics = Metrics()
@@ -0,0 +1,146 @@
+"""ASGI middleware shared by the API."""
+import asyncio
+import os
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+
+from app.core.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # optional, responses are gzipped without it
+    brotli = None
+
+# responses smaller than this are sent uncompressed, it isn't worth the CPU
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+# gzip level and brotli quality, moderate settings compress almost as well at a fraction of the CPU
+GZIP_COMPRESS_LEVEL = int(os.getenv("GZIP_COMPRESS_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+
+class CancelOnDisconnectMiddleware:
+    """Cancels a request's handler when its client disconnects before the response is sent.
+
+    Without this, a request whose client gave up (a closed tab, a mobile client timing out)
+    keeps its handler and warehouse jobs running to completion. The request body is read up
+    front, bodies here are small JSON and form payloads, so the connection can be watched
+    for the disconnect while the handler runs. Cancelling the handler cancels the database
+    calls it is awaiting, see AsyncDatabase.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        body = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message)
+            if not message.get("more_body", False):
+                break
+
+        disconnected = asyncio.Event()
+        response_complete = False
+
+        async def replay_receive():
+            if body:
+                return body.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def tracking_send(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, replay_receive, tracking_send))
+
+        async def watch():
+            # the body has been read, the only message left is the disconnect
+            message = await receive()
+            if message["type"] != "http.disconnect":
+                return
+            disconnected.set()
+            # once the response is out the handler is only running background tasks, leave those be
+            if not response_complete and not handler.done():
+                metrics.increment("requests.cancelled_on_disconnect")
+                handler.cancel()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected.is_set():
+                raise
+        finally:
+            watcher.cancel()
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int):
+        super().__init__(app, minimum_size)
+        self.quality = quality
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        data = self._compressor.process(body)
+        # flush what each chunk of a streamed body produced so the client gets it right away
+        return data + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """Content codings of an Accept-Encoding header with their q-values, e.g. {"br": 1.0, "gzip": 0.5}."""
+    encodings = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            encodings[coding.strip().lower()] = quality
+    return encodings
+
+
+class CompressionMiddleware:
+    """Compresses response bodies of at least COMPRESSION_MINIMUM_SIZE bytes.
+
+    The encoding is negotiated from Accept-Encoding: brotli when the client takes it and the
+    optional `brotli` package is installed, gzip otherwise. Streamed bodies are compressed
+    chunk by chunk. Responses that already have a Content-Encoding, and media that is
+    compressed already, are passed through.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encodings = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        wildcard = encodings.get("*", 0)
+        if brotli is not None and encodings.get("br", wildcard) > 0:
+            responder = BrotliResponder(self.app, self.minimum_size, BROTLI_QUALITY)
+        elif encodings.get("gzip", wildcard) > 0:
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=GZIP_COMPRESS_LEVEL)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
@@ -0,0 +1,70 @@
+"""Keyset pagination and field projection helpers shared by the listing endpoints.
+
+Listings are ordered by a stable key (e.g. start_date, trip_id) and the next page starts
+strictly after the last key returned, so pages never skip or repeat rows and the
+warehouse never has to count past an OFFSET. The key is handed to clients as an opaque
+continuation token.
+"""
+import base64
+import json
+from typing import List, Optional, Sequence
+
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Turn the key of the last row on a page into an opaque continuation token."""
+    data = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, key_size: int) -> List:
+    """Read a continuation token back into key values, rejecting anything we didn't issue."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != key_size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def keyset_predicate(key_columns: Sequence[str]) -> str:
+    """SQL condition selecting rows strictly after @after_<column> in key order.
+
+    For (start_date, trip_id) this is
+    (start_date > @after_start_date OR (start_date = @after_start_date AND trip_id > @after_trip_id))
+    """
+    clauses = []
+    for i, column in enumerate(key_columns):
+        equal = [f"{prior} = @after_{param_name(prior)}" for prior in key_columns[:i]]
+        clauses.append(" AND ".join(equal + [f"{column} > @after_{param_name(column)}"]))
+    return "(" + " OR ".join(f"({clause})" for clause in clauses) + ")"
+
+
+def param_name(column: str) -> str:
+    """Parameter name for a key column, dropping any table alias (p.list_id -> list_id)."""
+    return column.split(".")[-1]
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str], always: Sequence[str] = (),
+                 default: Optional[Sequence[str]] = None) -> List[str]:
+    """Parse a comma separated fields= projection against the columns a listing exposes.
+
+    No projection means the listing's default columns (every allowed column unless given).
+    Columns in `always` (the row id) are always returned.
+    """
+    if not fields:
+        return list(default if default is not None else allowed)
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    selected = [field for field in always if field not in requested]
+    return selected + requested
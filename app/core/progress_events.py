@@ -0,0 +1,200 @@
+"""Packing progress pushed to the user's open tabs as it changes.
+
+Instead of polling the progress endpoints, a tab subscribes to its user's events
+(GET /packing/events/progress, server-sent events). The packing write paths publish a
+small event for every change: a list created, its item counts changed, a list or a whole
+trip deleted. The event goes to every subscription of that user, so an edit made in one
+tab shows up in the others right away. A subscription waiting for events costs a parked
+coroutine and nothing else: nothing is read or parsed until something is published.
+
+Two brokers, picked with PROGRESS_EVENTS_BROKER:
+
+- "local" (the default): events only reach the subscribers of the process that made the
+  write, enough with a single worker.
+- "redis": events are published on a redis channel per user (through the redis client,
+  QUERY_CACHE_REDIS_URL) and every worker hands them to its own subscribers.
+
+A subscriber that falls PROGRESS_EVENTS_QUEUE_SIZE events behind loses them and gets a
+RESYNC instead, on which its stream reads and sends every list's counts again.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Set
+
+from app.core.clients import get_redis_client
+from app.core.metrics import metrics
+
+# "local" delivers within the process, "redis" to the subscribers of every worker
+PROGRESS_EVENTS_BROKER = os.getenv("PROGRESS_EVENTS_BROKER", "local")
+# events a subscriber can fall behind by before they are replaced by a resync
+PROGRESS_EVENTS_QUEUE_SIZE = int(os.getenv("PROGRESS_EVENTS_QUEUE_SIZE", "100"))
+
+Event = Dict[str, Any]
+
+# told to a subscriber that missed events
+RESYNC: Event = {"event": "resync"}
+# ends a subscription, the process is shutting down
+CLOSED: Event = {"event": "closed"}
+
+
+class Subscription:
+    """One subscriber's queue of events, read on the event loop it subscribed from."""
+
+    def __init__(self, user_id: str, max_queued: int):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(max_queued)
+
+    async def get(self, timeout: float) -> Optional[Event]:
+        """The next event, None when none came within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def put(self, event: Event):
+        # runs on the subscription's loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # the subscriber isn't keeping up, what it missed is replaced by a resync
+            metrics.increment("progress_events.overflows")
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class LocalBroker:
+    def __init__(self, max_queued: int = PROGRESS_EVENTS_QUEUE_SIZE):
+        self.max_queued = max_queued
+        # user_id -> the user's subscriptions in this process
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def subscribe(self, user_id: str) -> Subscription:
+        """Subscribe to the user's events, from the event loop that will read them."""
+        subscription = Subscription(user_id, self.max_queued)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            self._count()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+            self._count()
+
+    async def publish(self, user_id: str, event: str, **data: Any):
+        """Send an event to every subscription of the user, e.g. publish(user_id, "list_deleted", list_id=list_id)."""
+        metrics.increment("progress_events.published")
+        self.deliver(user_id, {"event": event, "data": data})
+
+    def deliver(self, user_id: str, event: Event):
+        # thread-safe, each subscription's queue is filled on its own loop
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # its loop is already closed
+                pass
+
+    def close(self):
+        """End every subscription of this process."""
+        with self._lock:
+            subscriptions = [subscription for user in self._subscriptions.values() for subscription in user]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, CLOSED)
+            except RuntimeError:
+                pass
+
+    def _count(self):
+        metrics.set_gauge("progress_events.subscribers", sum(len(user) for user in self._subscriptions.values()))
+
+
+class RedisBroker(LocalBroker):
+    """Publishes on redis, a listener thread per worker delivers to the local subscriptions."""
+
+    channel_prefix = "packwise:progress:"
+
+    def __init__(self, max_queued: int = PROGRESS_EVENTS_QUEUE_SIZE):
+        super().__init__(max_queued)
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="progress-events", daemon=True)
+            self._thread.start()
+
+    async def publish(self, user_id: str, event: str, **data: Any):
+        metrics.increment("progress_events.published")
+        try:
+            message = json.dumps({"event": event, "data": data}, default=str)
+            await asyncio.to_thread(get_redis_client().publish, self.channel_prefix + user_id, message)
+        except Exception as e:
+            # the write went through, the user's tabs catch up on their next resync or page load
+            metrics.increment("progress_events.errors")
+            print(f"Error publishing progress event: {str(e)}")
+
+    def close(self):
+        self._stopped.set()
+        super().close()
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            pubsub = None
+            try:
+                pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.channel_prefix + "*")
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode("utf-8")
+                    self.deliver(channel[len(self.channel_prefix):], json.loads(message["data"]))
+            except Exception as e:
+                metrics.increment("progress_events.errors")
+                print(f"Error listening for progress events: {str(e)}")
+                # events published while disconnected are lost, tell every subscriber to read again
+                with self._lock:
+                    user_ids = list(self._subscriptions)
+                for user_id in user_ids:
+                    self.deliver(user_id, RESYNC)
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+
+def format_event(event: Event) -> bytes:
+    """An event as a server-sent event."""
+    return f"event: {event['event']}\ndata: {json.dumps(event.get('data', {}), default=str)}\n\n".encode("utf-8")
+
+
+def create_progress_broker(name: str = PROGRESS_EVENTS_BROKER) -> LocalBroker:
+    if name == "local":
+        return LocalBroker()
+    if name == "redis":
+        return RedisBroker()
+    raise ValueError(f"Unknown PROGRESS_EVENTS_BROKER: {name}")
+
+
+progress_events = create_progress_broker()
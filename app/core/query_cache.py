@@ -0,0 +1,195 @@
+"""Read-through cache of query results, invalidated by entity tags.
+
+Database read methods that opt in pass the tags of the entities their rows depend on
+(the requesting user, a trip, a packing list) and are served from here while none of
+those entities has been written. Entries are keyed on the statement, its parameters and
+the current version of each tag; a write replaces the versions of the tags it touches, so
+every entry that depended on them becomes unreachable at once and simply ages out. A read
+racing a write can only ever store its result under the old versions, never serve it
+after the write.
+
+Two backends, picked with QUERY_CACHE_BACKEND:
+
+- "redis": shared by every worker through the redis client (QUERY_CACHE_REDIS_URL), so a
+  write invalidates everywhere. Needs the optional `redis` package.
+- "memory": a bounded LRU per worker process. Writes made by other workers are only seen
+  once their entries expire, after QUERY_CACHE_TTL_SECONDS at most, so use it with a
+  single worker or sticky sessions, or set a TTL of a few seconds.
+- "none" (the default) turns the cache off.
+
+Cache failures never fail a request, the statement just runs against the database.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.core.cache import TTLCache
+from app.core.clients import get_redis_client
+from app.core.metrics import metrics
+from app.core.responses import dumps
+
+QUERY_CACHE_BACKEND = os.getenv("QUERY_CACHE_BACKEND", "none")
+# how long a result is served at most, also bounds how stale other workers can be with the memory backend
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "300"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "10000"))
+
+Rows = List[Dict[str, Any]]
+
+
+def user_tag(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def trip_tag(trip_id: str) -> str:
+    return f"trip:{trip_id}"
+
+
+def list_tag(list_id: str) -> str:
+    return f"list:{list_id}"
+
+
+def _new_version() -> str:
+    # random rather than counted, so a version that was evicted or expired can never come back
+    return uuid.uuid4().hex
+
+
+class MemoryCacheBackend:
+    """Entries and tag versions in bounded, expiring LRUs of this process."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._entries = TTLCache(max_entries, ttl_seconds)
+        # an entry never outlives the version it was stored under, losing a version only invalidates early
+        self._versions = TTLCache(max_entries, ttl_seconds)
+
+    def tag_versions(self, tags: List[str]) -> List[str]:
+        versions = []
+        for tag in tags:
+            version = self._versions.get(tag)
+            if version is None:
+                version = _new_version()
+                self._versions.set(tag, version)
+            versions.append(version)
+        return versions
+
+    def get(self, key: str) -> Optional[Rows]:
+        rows = self._entries.get(key)
+        # callers own the rows they get back, hand out copies
+        return None if rows is None else [dict(row) for row in rows]
+
+    def set(self, key: str, rows: Rows, ttl_seconds: float):
+        self._entries.set(key, tuple(dict(row) for row in rows), ttl_seconds)
+
+    def bump(self, tags: Iterable[str]):
+        for tag in tags:
+            self._versions.set(tag, _new_version())
+
+
+class RedisCacheBackend:
+    """Entries and tag versions in redis, shared by every worker."""
+
+    prefix = "packwise:query_cache:"
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def client(self):
+        return get_redis_client()
+
+    def _expiry(self, ttl_seconds: float) -> int:
+        return max(1, math.ceil(ttl_seconds))
+
+    def tag_versions(self, tags: List[str]) -> List[str]:
+        keys = [f"{self.prefix}tag:{tag}" for tag in tags]
+        versions = self.client.mget(keys) if keys else []
+        for i, version in enumerate(versions):
+            if version is None:
+                # another worker may be creating the same version, whichever is stored first wins
+                self.client.set(keys[i], _new_version(), ex=self._expiry(self.ttl_seconds), nx=True)
+                versions[i] = self.client.get(keys[i])
+        return [version.decode() if isinstance(version, bytes) else version for version in versions]
+
+    def get(self, key: str) -> Optional[Rows]:
+        raw = self.client.get(f"{self.prefix}entry:{key}")
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key: str, rows: Rows, ttl_seconds: float):
+        # the response encoder, so dates and decimals are stored as strings like they are sent
+        self.client.set(f"{self.prefix}entry:{key}", dumps(rows), ex=self._expiry(ttl_seconds))
+
+    def bump(self, tags: Iterable[str]):
+        pipeline = self.client.pipeline()
+        for tag in tags:
+            pipeline.set(f"{self.prefix}tag:{tag}", _new_version(), ex=self._expiry(self.ttl_seconds))
+        pipeline.execute()
+
+
+class QueryCache:
+    def __init__(self, backend, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        # name -> [hits, misses], for the per-query hit rate
+        self._counts: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, name: str, sql: str, params: Optional[Dict[str, Any]], tags: List[str],
+                    load: Callable[[], Rows]) -> Rows:
+        """Serve the rows of a statement from the cache, running `load` to fill it on a miss."""
+        try:
+            key = _key(sql, params, self.backend.tag_versions(tags))
+            rows = self.backend.get(key)
+        except Exception as e:
+            self._error("read", e)
+            return load()
+
+        if rows is not None:
+            self._count(name, hit=True)
+            return rows
+
+        self._count(name, hit=False)
+        rows = load()
+        try:
+            self.backend.set(key, rows, self.ttl_seconds)
+        except Exception as e:
+            self._error("write", e)
+        return rows
+
+    def invalidate(self, *tags: str):
+        """Make every entry that depends on one of the tags unreachable, call after the write succeeded."""
+        try:
+            self.backend.bump(tags)
+            metrics.increment("query_cache.invalidations", len(tags))
+        except Exception as e:
+            # the entries still expire after the TTL
+            self._error("invalidate", e)
+
+    def _count(self, name: str, hit: bool):
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+            hit_rate = counts[0] / (counts[0] + counts[1])
+        metrics.increment(f"query_cache.{'hits' if hit else 'misses'}.{name}")
+        metrics.set_gauge(f"query_cache.hit_rate.{name}", round(hit_rate, 4))
+
+    def _error(self, operation: str, e: Exception):
+        metrics.increment("query_cache.errors")
+        print(f"Query cache {operation} failed: {str(e)}")
+
+
+def _key(sql: str, params: Optional[Dict[str, Any]], versions: List[str]) -> str:
+    data = json.dumps([sql, sorted((params or {}).items()), versions], separators=(",", ":"), default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=20).hexdigest()
+
+
+def create_query_cache(name: str = QUERY_CACHE_BACKEND) -> Optional[QueryCache]:
+    if name == "none":
+        return None
+    if name == "memory":
+        return QueryCache(MemoryCacheBackend(QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS))
+    if name == "redis":
+        return QueryCache(RedisCacheBackend(QUERY_CACHE_TTL_SECONDS))
+    raise ValueError(f"Unknown QUERY_CACHE_BACKEND: {name}")
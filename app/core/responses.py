@@ -0,0 +1,102 @@
+"""JSON response classes for the API.
+
+FastJSONResponse is the app's default response class: bodies are encoded by orjson when
+it is installed, several times faster than the standard library on the nested dicts and
+lists packing lists are made of. Handlers returning large payloads build one themselves
+(json_response) to also skip FastAPI's jsonable_encoder walk over the payload.
+
+StreamingJSONResponse is for the largest bodies. It sends the JSON in chunks of about
+JSON_STREAM_CHUNK_BYTES while encoding it, so the response never sits in memory twice and
+compression starts on the first chunk. JSON that is already stored as text (RawJSON,
+e.g. historical weather) is sent as it is, without being parsed and encoded again.
+
+Compression is applied on top of either by CompressionMiddleware (app.core.middleware).
+"""
+import json
+import os
+from typing import Any, Iterator, Optional
+
+from fastapi import Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library codec
+    orjson = None
+
+# bytes per chunk of a streamed JSON body
+JSON_STREAM_CHUNK_BYTES = int(os.getenv("JSON_STREAM_CHUNK_BYTES", str(64 * 1024)))
+# levels of dicts and lists iter_json walks, anything deeper is encoded in one go
+STREAMED_LEVELS = 2
+
+
+def dumps(content: Any) -> bytes:
+    """Compact JSON of content with the fastest codec available, values it doesn't know become strings."""
+    if orjson is not None:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_response(content: Any, response: Optional[Response] = None) -> FastJSONResponse:
+    """A response for content, keeping the headers a handler set on its injected `response`."""
+    return FastJSONResponse(content, headers=dict(response.headers) if response is not None else None)
+
+
+class RawJSON:
+    """JSON text to be sent as it is inside a streamed body, e.g. a column holding JSON."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def iter_json(content: Any, chunk_bytes: int = JSON_STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Encode content as JSON in chunks of about chunk_bytes.
+
+    The top two levels of dicts and lists are walked and each value below them is encoded
+    on its own, e.g. every record of a list of records. RawJSON values, which must sit in
+    those two levels, are passed through sliced into chunks.
+    """
+    buffered = []
+    size = 0
+    for part in _json_parts(content):
+        buffered.append(part)
+        size += len(part)
+        if size >= chunk_bytes:
+            yield b"".join(buffered)
+            buffered = []
+            size = 0
+    if buffered:
+        yield b"".join(buffered)
+
+
+def _json_parts(content: Any, depth: int = 0) -> Iterator[bytes]:
+    if isinstance(content, RawJSON):
+        data = content.text.encode("utf-8")
+        for start in range(0, len(data), JSON_STREAM_CHUNK_BYTES):
+            yield data[start:start + JSON_STREAM_CHUNK_BYTES]
+    elif depth < STREAMED_LEVELS and isinstance(content, dict):
+        yield b"{"
+        for i, (key, value) in enumerate(content.items()):
+            yield (b"," if i else b"") + dumps(str(key)) + b":"
+            yield from _json_parts(value, depth + 1)
+        yield b"}"
+    elif depth < STREAMED_LEVELS and isinstance(content, (list, tuple)):
+        yield b"["
+        for i, value in enumerate(content):
+            if i:
+                yield b","
+            yield from _json_parts(value, depth + 1)
+        yield b"]"
+    else:
+        yield dumps(content)
+
+
+class StreamingJSONResponse(StreamingResponse):
+    def __init__(self, content: Any, status_code: int = 200, headers: Optional[dict] = None):
+        # a plain iterator is run in the threadpool chunk by chunk, encoding never blocks the event loop
+        super().__init__(iter_json(content), status_code=status_code, headers=headers, media_type="application/json")
@@ -0,0 +1,178 @@
+"""Declarations of the tables behind the data-access layer, and creating or migrating them.
+
+Every table the API reads is declared once here with its columns and how it is laid out:
+
+- BigQuery tables are clustered on the keys their lookups filter by (user, trip, list),
+  so an equality lookup reads the blocks holding that key instead of the whole table.
+- user_trips is also partitioned by deleted_at. Live trips all sit in the NULL partition,
+  which is the only one the API reads (`deleted_at IS NULL`), while the purge only reads the
+  partitions of deleted trips. No other table has a column its queries filter on by range,
+  so they aren't partitioned.
+- SQLite gets the same tables with primary keys and indexes standing in for clustering.
+
+Local files are migrated when they are opened. BigQuery datasets are migrated by
+`python -m app.services.migrate_schema`, which creates missing tables, adds missing
+columns and applies the clustering. Partitioning an existing table means rebuilding it,
+which is reported but left to an operator.
+"""
+from typing import List, Optional, Sequence
+
+# BigQuery column type -> SQLite column type
+_SQLITE_TYPES = {
+    "STRING": "TEXT",
+    "INT64": "INTEGER",
+    "FLOAT64": "REAL",
+    "TIMESTAMP": "TEXT",
+}
+
+
+class Column:
+    def __init__(self, name: str, type: str, required: bool = False):
+        self.name = name
+        self.type = type
+        self.required = required
+
+
+class TableSchema:
+    """A table, named by its attribute on the backend's Tables."""
+
+    def __init__(self, name: str, columns: Sequence[Column], primary_key: Optional[str] = None,
+                 unique: Sequence[str] = (), cluster_by: Sequence[str] = (), partition_by: Optional[str] = None,
+                 indexes: Sequence[Sequence[str]] = ()):
+        self.name = name
+        self.columns = list(columns)
+        self.primary_key = primary_key
+        self.unique = list(unique)
+        # BigQuery only, at most four columns, the first one prunes the most
+        self.cluster_by = list(cluster_by)
+        # BigQuery only, a TIMESTAMP column partitioned by day
+        self.partition_by = partition_by
+        # SQLite only, named <table>_<first column>
+        self.indexes = [list(index) for index in indexes]
+
+
+TABLES = [
+    TableSchema("users", [
+        Column("id", "STRING", required=True),
+        Column("username", "STRING", required=True),
+        Column("password", "STRING", required=True),
+    ], primary_key="id", unique=["username"], cluster_by=["username"]),
+    TableSchema("users_info", [
+        Column("user_id", "STRING", required=True),
+        Column("name", "STRING"),
+        Column("age", "INT64"),
+        Column("gender", "STRING"),
+    ], primary_key="user_id", cluster_by=["user_id"]),
+    TableSchema("trips", [
+        Column("trip_id", "STRING", required=True),
+        Column("user_id", "STRING", required=True),
+        Column("city", "STRING"),
+        Column("country", "STRING"),
+        Column("start_date", "STRING"),
+        Column("end_date", "STRING"),
+        Column("luggage_type", "STRING"),
+        Column("trip_purpose", "STRING"),
+        Column("deleted_at", "TIMESTAMP"),
+        # bumped by every update, NULL until the first one
+        Column("version", "INT64"),
+    ], primary_key="trip_id", cluster_by=["user_id", "start_date", "trip_id"], partition_by="deleted_at",
+        indexes=[["user_id", "start_date", "trip_id"]]),
+    TableSchema("trip_weather", [
+        Column("trip_id", "STRING", required=True),
+        Column("min_temp", "FLOAT64"),
+        Column("max_temp", "FLOAT64"),
+        Column("uv", "FLOAT64"),
+        Column("description", "STRING"),
+        Column("confidence", "FLOAT64"),
+    ], primary_key="trip_id", cluster_by=["trip_id"]),
+    TableSchema("historical_weather", [
+        Column("trip_id", "STRING", required=True),
+        Column("historical_stats", "STRING"),
+    ], primary_key="trip_id", cluster_by=["trip_id"]),
+    TableSchema("packing_lists", [
+        Column("list_id", "STRING", required=True),
+        Column("trip_id", "STRING", required=True),
+        Column("packing_list", "STRING"),
+        Column("total_items", "INT64"),
+        Column("packed_items", "INT64"),
+        Column("version", "INT64"),
+    ], primary_key="list_id", cluster_by=["trip_id", "list_id"], indexes=[["trip_id", "list_id"]]),
+]
+
+
+def _column_sql(column: Column, type: str) -> str:
+    return f"{column.name} {type}{' NOT NULL' if column.required else ''}"
+
+
+def bigquery_table_ddl(table: TableSchema, qualified_name: str) -> str:
+    columns = ",\n".join(f"    {_column_sql(column, column.type)}" for column in table.columns)
+    sql = f"CREATE TABLE IF NOT EXISTS {qualified_name} (\n{columns}\n)"
+    if table.partition_by:
+        sql += f"\nPARTITION BY DATE({table.partition_by})"
+    if table.cluster_by:
+        sql += f"\nCLUSTER BY {', '.join(table.cluster_by)}"
+    return sql
+
+
+def sqlite_table_ddl(table: TableSchema, name: str) -> str:
+    columns = []
+    for column in table.columns:
+        sql = _column_sql(column, _SQLITE_TYPES[column.type])
+        if column.name == table.primary_key:
+            sql = f"{column.name} {_SQLITE_TYPES[column.type]} PRIMARY KEY"
+        elif column.name in table.unique:
+            sql += " UNIQUE"
+        columns.append(f"    {sql}")
+    columns_sql = ",\n".join(columns)
+    return f"CREATE TABLE IF NOT EXISTS {name} (\n{columns_sql}\n)"
+
+
+def migrate_sqlite(connection, tables) -> List[str]:
+    """Create missing tables, columns and indexes in a local database. Returns what was changed."""
+    changes = []
+    for table in TABLES:
+        name = getattr(tables, table.name)
+        connection.execute(sqlite_table_ddl(table, name))
+        present = {row[1] for row in connection.execute(f"PRAGMA table_info({name})")}
+        for column in table.columns:
+            if column.name not in present:
+                # files created before the column was declared
+                connection.execute(f"ALTER TABLE {name} ADD COLUMN {column.name} {_SQLITE_TYPES[column.type]}")
+                changes.append(f"added {name}.{column.name}")
+        for index in table.indexes:
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {name}_{index[0]} ON {name} ({', '.join(index)})")
+    return changes
+
+
+def migrate_bigquery(backend) -> List[str]:
+    """Create missing tables, add missing columns and apply the clustering. Returns what was changed or needs doing."""
+    from google.api_core.exceptions import NotFound
+
+    changes = []
+    for table in TABLES:
+        name = getattr(backend.tables, table.name)
+        try:
+            existing = backend.client.get_table(name.strip("`"))
+        except NotFound:
+            backend.execute(bigquery_table_ddl(table, name))
+            changes.append(f"created {name}")
+            continue
+
+        present = {field.name for field in existing.schema}
+        for column in table.columns:
+            if column.name not in present:
+                # added columns are always NULLABLE
+                backend.execute(f"ALTER TABLE {name} ADD COLUMN IF NOT EXISTS {column.name} {column.type}")
+                changes.append(f"added {name}.{column.name}")
+
+        if list(existing.clustering_fields or []) != table.cluster_by:
+            existing.clustering_fields = table.cluster_by or None
+            backend.client.update_table(existing, ["clustering_fields"])
+            # BigQuery applies the new clustering to rows written from now on
+            changes.append(f"clustered {name} by {', '.join(table.cluster_by)}")
+
+        partitioned_by = existing.time_partitioning.field if existing.time_partitioning else None
+        if table.partition_by and partitioned_by != table.partition_by:
+            changes.append(f"{name} should be partitioned by {table.partition_by}, which needs the table rebuilt "
+                           f"(CREATE TABLE ... PARTITION BY ... AS SELECT), not done automatically")
+    return changes
@@ -0,0 +1,80 @@
+"""Password hashing off the event loop.
+
+bcrypt costs tens of milliseconds of CPU per call. Running it inline in an async handler
+stalls every other request on the worker, so hashing and verification run in a small
+bounded thread pool (bcrypt releases the GIL while hashing).
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from app.core.metrics import metrics
+
+# bcrypt cost factor, stored hashes with a different cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# hashes waiting or running before new ones are turned away
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending = 0
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+
+
+async def _run(operation: str, fn, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_QUEUE_LIMIT:
+        metrics.increment("password_hash.rejected")
+        raise PasswordHasherBusy()
+
+    queued_at = time.perf_counter()
+
+    def timed():
+        started_at = time.perf_counter()
+        metrics.observe("password_hash.queue_wait_seconds", started_at - queued_at)
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe(f"password_hash.{operation}_seconds", time.perf_counter() - started_at)
+
+    # _pending is only touched from the event loop thread
+    _pending += 1
+    metrics.set_gauge("password_hash.queue_depth", _pending)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, timed)
+    finally:
+        _pending -= 1
+        metrics.set_gauge("password_hash.queue_depth", _pending)
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password with the configured bcrypt cost."""
+    return await _run("hash", pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Check a password against its stored hash.
+
+    Returns (valid, new_hash). new_hash is set when the stored hash uses a different
+    cost than BCRYPT_ROUNDS and should replace it.
+    """
+    return await _run("verify", pwd_context.verify_and_update, password, hashed_password)
+
+
+def shutdown_password_hasher():
+    _executor.shutdown(wait=False)
@@ -0,0 +1,71 @@
+"""Sliding-window counters for throttling login attempts.
+
+Each key (a username or a client IP) keeps two fixed windows, the current one and the
+previous one, and the count over the last `window_seconds` is estimated by weighting the
+previous window by how much of it still overlaps. That keeps the memory per key constant,
+and the number of keys is capped by evicting the least recently seen ones.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+
+class SlidingWindowCounter:
+    def __init__(self, limit: int, window_seconds: float, max_keys: int):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        # key -> [current window start, count in current window, count in previous window]
+        self._windows: "OrderedDict[Hashable, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _window(self, key: Hashable, now: float, create: bool) -> Optional[List[float]]:
+        window = self._windows.get(key)
+        if window is None:
+            if not create:
+                return None
+            window = self._windows[key] = [now, 0, 0]
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+
+        # roll the windows forward to now
+        elapsed_windows = int((now - window[0]) // self.window_seconds)
+        if elapsed_windows == 1:
+            window[0] += self.window_seconds
+            window[2] = window[1]
+            window[1] = 0
+        elif elapsed_windows > 1:
+            window[0] = now
+            window[1] = 0
+            window[2] = 0
+        return window
+
+    def _estimate(self, window: List[float], now: float) -> float:
+        overlap = 1 - (now - window[0]) / self.window_seconds
+        return window[1] + window[2] * overlap
+
+    def retry_after(self, key: Hashable) -> Optional[int]:
+        """Seconds until the key is allowed again, or None if it is under the limit."""
+        now = time.time()
+        with self._lock:
+            window = self._window(key, now, create=False)
+            if window is None or self._estimate(window, now) < self.limit:
+                return None
+            # by the end of the current window only its own count is left to weigh against the limit
+            return max(1, math.ceil(window[0] + self.window_seconds - now))
+
+    def hit(self, key: Hashable):
+        now = time.time()
+        with self._lock:
+            self._window(key, now, create=True)[1] += 1
+
+    def reset(self, key: Hashable):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def __len__(self):
+        return len(self._windows)
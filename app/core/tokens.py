@@ -0,0 +1,256 @@
+"""JWT access and refresh tokens plus the in-memory revocation list.
+
+Access tokens are short-lived and carry everything a request needs (sub, username, jti),
+so authenticating a request is a signature check and a revocation lookup with no
+storage access. Refresh tokens are long-lived and only accepted by /auth/refresh,
+which is where the users table is checked again.
+
+Revocations live in process memory: a bloom filter answers "definitely not revoked"
+for almost every request and an exact map of jti -> expiry confirms the rest. Entries
+are dropped once the token they revoke has expired anyway. Revoking every token of a
+user stores a cutoff compared with the iat claim, which carries fractions of a second
+so a token issued earlier in the same second is revoked too.
+
+Two backends, picked with TOKEN_REVOCATION_BACKEND:
+
+- "memory" (the default): per worker process. With several workers, a worker only
+  knows about the revocations it served itself, so run a single worker or use redis.
+- "redis": every revocation is also written to redis (QUERY_CACHE_REDIS_URL), and a
+  token this worker doesn't know as revoked costs one redis round trip per request.
+  When redis can't be reached only the local revocations are enforced.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from jose import JWTError, jwt
+
+from app.core.clients import get_redis_client
+from app.core.metrics import metrics
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+# "memory" keeps revocations per worker, "redis" shares them with every worker
+TOKEN_REVOCATION_BACKEND = os.getenv("TOKEN_REVOCATION_BACKEND", "memory")
+
+ACCESS_TOKEN = "access"
+REFRESH_TOKEN = "refresh"
+
+
+class TokenError(Exception):
+    """Raised when a token is malformed, expired, of the wrong type or revoked."""
+
+
+class BloomFilter:
+    """Fixed-size bloom filter over strings."""
+
+    def __init__(self, size_bits: int = 1 << 20, hash_count: int = 7):
+        self.size_bits = size_bits
+        self.hash_count = hash_count
+        self._bits = bytearray(size_bits // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        # double hashing: k positions from two 64-bit hashes
+        return [(first + i * second) % self.size_bits for i in range(self.hash_count)]
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, value: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RevocationList:
+    """Revoked token ids and per-user cutoffs, kept until the tokens they cover expire."""
+
+    def __init__(self, purge_interval_seconds: float = 60):
+        self.purge_interval_seconds = purge_interval_seconds
+        self._revoked: Dict[str, float] = {}
+        # user_id -> (cutoff, until): tokens issued before the cutoff are revoked (deleted accounts, logout everywhere)
+        self._user_cutoffs: Dict[str, Tuple[float, float]] = {}
+        self._bloom = BloomFilter()
+        self._last_purge = time.time()
+        self._lock = threading.Lock()
+
+    def revoke(self, jti: str, expires_at: float):
+        with self._lock:
+            self._revoked[jti] = expires_at
+            self._bloom.add(jti)
+            self._maybe_purge()
+
+    def revoke_user(self, user_id: str, until: float) -> float:
+        """Revoke every token issued to the user so far. `until` is when the longest-lived one expires.
+
+        Returns the cutoff, tokens issued after it (a login right after a password change) stay valid.
+        """
+        cutoff = time.time()
+        with self._lock:
+            self._user_cutoffs[user_id] = (cutoff, until)
+            self._maybe_purge()
+        return cutoff
+
+    def is_revoked(self, jti: str, user_id: str, issued_at: float) -> bool:
+        if self.is_user_revoked(user_id, issued_at):
+            return True
+        if not self._bloom.might_contain(jti):
+            return False
+        return jti in self._revoked
+
+    def is_user_revoked(self, user_id: str, issued_at: float) -> bool:
+        """Whether the user's tokens issued at issued_at were all revoked, the check for tokens without a jti."""
+        cutoff = self._user_cutoffs.get(user_id)
+        return cutoff is not None and issued_at < cutoff[0]
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < self.purge_interval_seconds:
+            return
+        self._last_purge = now
+        self._revoked = {jti: expires_at for jti, expires_at in self._revoked.items() if expires_at > now}
+        self._user_cutoffs = {user_id: cutoff for user_id, cutoff in self._user_cutoffs.items() if cutoff[1] > now}
+        # bloom filters can't forget, so rebuild it from what is still revoked
+        self._bloom = BloomFilter(self._bloom.size_bits, self._bloom.hash_count)
+        for jti in self._revoked:
+            self._bloom.add(jti)
+
+
+class SharedRevocationList(RevocationList):
+    """The revocation list of this worker, with every revocation also kept in redis for the others."""
+
+    prefix = "packwise:revoked:"
+
+    @property
+    def client(self):
+        return get_redis_client()
+
+    def revoke(self, jti: str, expires_at: float):
+        super().revoke(jti, expires_at)
+        try:
+            self.client.set(f"{self.prefix}jti:{jti}", "1", ex=_expiry(expires_at))
+        except Exception as e:
+            _error("write", e)
+
+    def revoke_user(self, user_id: str, until: float) -> float:
+        cutoff = super().revoke_user(user_id, until)
+        try:
+            self.client.set(f"{self.prefix}user:{user_id}", repr(cutoff), ex=_expiry(until))
+        except Exception as e:
+            _error("write", e)
+        return cutoff
+
+    def is_revoked(self, jti: str, user_id: str, issued_at: float) -> bool:
+        if super().is_revoked(jti, user_id, issued_at):
+            return True
+        try:
+            revoked, cutoff = self.client.mget([f"{self.prefix}jti:{jti}", f"{self.prefix}user:{user_id}"])
+        except Exception as e:
+            _error("read", e)
+            return False
+        return revoked is not None or (cutoff is not None and issued_at < float(cutoff))
+
+    def is_user_revoked(self, user_id: str, issued_at: float) -> bool:
+        if super().is_user_revoked(user_id, issued_at):
+            return True
+        try:
+            cutoff = self.client.get(f"{self.prefix}user:{user_id}")
+        except Exception as e:
+            _error("read", e)
+            return False
+        return cutoff is not None and issued_at < float(cutoff)
+
+
+def _expiry(expires_at: float) -> int:
+    return max(1, math.ceil(expires_at - time.time()))
+
+
+def _error(operation: str, e: Exception):
+    metrics.increment("token_revocations.errors")
+    print(f"Token revocation {operation} failed: {str(e)}")
+
+
+def create_revocation_list(name: str = TOKEN_REVOCATION_BACKEND) -> RevocationList:
+    if name == "memory":
+        return RevocationList()
+    if name == "redis":
+        return SharedRevocationList()
+    raise ValueError(f"Unknown TOKEN_REVOCATION_BACKEND: {name}")
+
+
+revocations = create_revocation_list()
+
+
+def _create_token(claims: Dict[str, Any], token_type: str, lifetime_seconds: float) -> str:
+    # iat keeps the fraction of a second, so revoking every token of a user also covers
+    # the ones issued earlier in the same second
+    now = time.time()
+    to_encode = dict(claims)
+    to_encode.update({
+        "type": token_type,
+        "jti": uuid.uuid4().hex,
+        "iat": now,
+        "exp": int(now + lifetime_seconds),
+    })
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def create_access_token(user_id: str, username: Optional[str] = None) -> str:
+    claims = {"sub": user_id}
+    if username is not None:
+        claims["username"] = username
+    return _create_token(claims, ACCESS_TOKEN, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def create_refresh_token(user_id: str, username: Optional[str] = None) -> str:
+    claims = {"sub": user_id}
+    if username is not None:
+        claims["username"] = username
+    return _create_token(claims, REFRESH_TOKEN, REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60)
+
+
+def decode_token(token: str, token_type: str) -> Dict[str, Any]:
+    """Verify a token's signature, expiry, type and revocation status and return its claims."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        raise TokenError(str(e))
+    check_claims(payload, token_type)
+    return payload
+
+
+def check_claims(payload: Dict[str, Any], token_type: str):
+    """Check the type and revocation status of claims from an already verified token."""
+    if payload.get("type") != token_type:
+        raise TokenError(f"Expected a {token_type} token")
+    if not payload.get("sub") or not payload.get("jti"):
+        raise TokenError("Token is missing claims")
+    if revocations.is_revoked(payload["jti"], payload["sub"], payload.get("iat", 0)):
+        raise TokenError("Token has been revoked")
+
+
+def check_legacy_claims(payload: Dict[str, Any]):
+    """Check a legacy token, which only carries sub (and no iat), against the per-user revocations."""
+    if revocations.is_user_revoked(payload["sub"], payload.get("iat", 0)):
+        raise TokenError("Token has been revoked")
+
+
+def revoke_token(payload: Dict[str, Any]):
+    """Revoke a decoded token until it would have expired anyway."""
+    revocations.revoke(payload["jti"], payload.get("exp", time.time()))
+
+
+def revoke_all_tokens(user_id: str):
+    """Revoke every token issued to a user so far."""
+    revocations.revoke_user(user_id, time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60)
@@ -1,12 +1,55 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 from app.api import auth, trips, dashboard, packing, packing_recommender
-import os
-from dotenv import load_dotenv
+from app.core.clients import clients
+from app.core.database import async_db, db
+from app.core.metrics import metrics
+from app.core.progress_events import progress_events
+from app.core.middleware import CancelOnDisconnectMiddleware, CompressionMiddleware
+from app.core.responses import FastJSONResponse
+from app.core.security import shutdown_password_hasher
+from app.services.purge_deleted_trips import TRIP_PURGE_INTERVAL_SECONDS, purge_periodically
 
-load_dotenv()
+# load registered usernames so most "username taken" checks stay local
+async def load_username_index():
+    try:
+        await auth.warm_username_index()
+    except Exception as e:
+        # registration still works without the index, every check just goes to the warehouse
+        print(f"Error warming username index: {str(e)}")
 
-app = FastAPI(title="PackWise API", description="Backend for PackWise travel assistant.", version="1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # replays inserts a previous process queued but never wrote, then writes new ones in the background
+    if db.insert_buffer is not None:
+        db.insert_buffer.start()
+    # the index loads in the background so the worker starts serving right away
+    index_task = asyncio.create_task(load_username_index())
+    # deleted trips are only marked, their rows are removed in batches by this task
+    purge_task = asyncio.create_task(purge_periodically()) if TRIP_PURGE_INTERVAL_SECONDS > 0 else None
+    # with the redis broker, listens for progress events published by every worker
+    progress_events.start()
+    yield
+    # end the open progress streams
+    progress_events.close()
+    index_task.cancel()
+    if purge_task is not None:
+        purge_task.cancel()
+    # write back packing list item edits that are still waiting on their debounce
+    await packing.packing_buffer.flush_all()
+    # then every queued insert
+    if db.insert_buffer is not None:
+        await asyncio.to_thread(db.insert_buffer.close)
+    shutdown_password_hasher()
+    async_db.shutdown()
+    db.close()
+    clients.close_all()
+
+# responses are encoded with orjson when it is installed
+app = FastAPI(title="PackWise API", description="Backend for PackWise travel assistant.", version="1.0", lifespan=lifespan,
+              default_response_class=FastJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -17,6 +60,12 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# gzip or brotli for larger bodies, negotiated from Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+
+# stop handlers (and their warehouse jobs) whose client has gone away
+app.add_middleware(CancelOnDisconnectMiddleware)
+
 # Register routers
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(dashboard.router, prefix="/dashboard", tags=["Dashboard"])
@@ -28,6 +77,11 @@ app.include_router(packing_recommender.router, prefix="/packing_recommendations"
 def home():
     return {"message": "Welcome to PackWise API"}
 
+# per-process counters, gauges and latency percentiles
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
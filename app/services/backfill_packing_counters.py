@@ -0,0 +1,58 @@
+"""One-off job that adds and fills the total_items / packed_items counters on packing_lists.
+
+Run it once after deploying the counter columns:
+
+    python -m app.services.backfill_packing_counters
+
+Lists written after the deploy already carry their counters, so the job only touches
+rows where the counters are still NULL and is safe to re-run.
+"""
+from app.core.database import db
+from app.services.packing_progress import count_packing_items
+from app.services.packing_list_cache import loads
+
+# number of lists written back per UPDATE statement (keeps us well under the DML quota)
+BATCH_SIZE = 500
+
+
+def add_counter_columns():
+    """Add the counter columns to the packing lists table if they don't exist yet."""
+    db.migrate_schema()
+
+
+def write_counters(counts):
+    """Write a batch of (list_id, total_items, packed_items) tuples in a single statement."""
+    db.write_packing_counters(counts)
+
+
+def backfill_packing_counters() -> int:
+    """Compute the counters for every list that doesn't have them yet. Returns the number of lists updated."""
+    add_counter_columns()
+
+    updated = 0
+    batch = []
+    for row in db.list_packing_lists_without_counters():
+        try:
+            # a one-off scan has nothing to gain from the shared cache, only the faster codec
+            packing_list = loads(row["packing_list"]) if row["packing_list"] else None
+        except ValueError:
+            # invalid lists count as empty so they aren't picked up again on the next run
+            packing_list = None
+
+        total_items, packed_items = count_packing_items(packing_list)
+        batch.append((row["list_id"], total_items, packed_items))
+
+        if len(batch) >= BATCH_SIZE:
+            write_counters(batch)
+            updated += len(batch)
+            batch = []
+
+    if batch:
+        write_counters(batch)
+        updated += len(batch)
+
+    return updated
+
+
+if __name__ == "__main__":
+    print(f"Backfilled counters for {backfill_packing_counters()} packing lists")
@@ -0,0 +1,111 @@
+"""Reduced views of a trip's historical weather, computed inside the database.
+
+A trip's historical weather is a single JSON array with a record per trip day and past
+year, each carrying the day's temperatures, UV index and all its hourly descriptions.
+Clients charting it need a fraction of that, so the query built here unpacks the array in
+the database (BigQuery JSON functions, or SQLite JSON1 locally) and only returns:
+
+- the requested fields of each record, or
+- one row per year (aggregate="year") or per trip day across years (aggregate="day", in
+  trip order, so a trip over New Year lists its December days first), with the day
+  count and the averages of the requested temperatures and UV index,
+
+optionally restricted to the most recent `years` years present. The stored JSON never
+reaches the API, let alone gets decoded there.
+"""
+from typing import Optional, Sequence
+
+# fields of a historical weather record
+RECORD_FIELDS = ["date", "year", "min_temp", "max_temp", "avg_temp", "uv_index", "descriptions"]
+# fields that are averaged when records are aggregated
+AGGREGATE_FIELDS = ["min_temp", "max_temp", "avg_temp", "uv_index"]
+# aggregate -> (key column, its SQL over the records, name of the count column)
+AGGREGATES = {
+    "year": ("year", "year", "days"),
+    "day": ("day", "SUBSTR(date, 6, 5)", "years"),
+}
+
+# SQL reading each record field out of the array element `r`
+_RECORD_SQL = {
+    "bigquery": {
+        "date": "JSON_VALUE(r, '$.date')",
+        "year": "CAST(JSON_VALUE(r, '$.year') AS INT64)",
+        "min_temp": "CAST(JSON_VALUE(r, '$.min_temp') AS FLOAT64)",
+        "max_temp": "CAST(JSON_VALUE(r, '$.max_temp') AS FLOAT64)",
+        "avg_temp": "CAST(JSON_VALUE(r, '$.avg_temp') AS FLOAT64)",
+        "uv_index": "CAST(JSON_VALUE(r, '$.uv_index') AS FLOAT64)",
+        # JSON text, decoded by the caller
+        "descriptions": "JSON_QUERY(r, '$.descriptions')",
+    },
+    # local stand-in (SQLite JSON1) with the same columns, for running without BigQuery
+    "sqlite": {
+        "date": "json_extract(r.value, '$.date')",
+        "year": "CAST(json_extract(r.value, '$.year') AS INTEGER)",
+        "min_temp": "json_extract(r.value, '$.min_temp')",
+        "max_temp": "json_extract(r.value, '$.max_temp')",
+        "avg_temp": "json_extract(r.value, '$.avg_temp')",
+        "uv_index": "json_extract(r.value, '$.uv_index')",
+        "descriptions": "json_extract(r.value, '$.descriptions')",
+    },
+}
+
+# the records of the trip's array, only for @user_id's live trip
+_RECORDS_SOURCE = {
+    "bigquery": """
+        FROM {trips} t
+        JOIN {historical_weather} h ON h.trip_id = t.trip_id,
+        UNNEST(JSON_QUERY_ARRAY(h.historical_stats)) AS r
+    """,
+    "sqlite": """
+        FROM {trips} t
+        JOIN {historical_weather} h ON h.trip_id = t.trip_id
+        JOIN json_each(CASE WHEN json_valid(h.historical_stats) AND json_type(h.historical_stats) = 'array'
+                            THEN h.historical_stats ELSE '[]' END) AS r
+    """,
+}
+
+
+def historical_weather_query(historical_table: str, trip_table: str, fields: Sequence[str],
+                             aggregate: Optional[str] = None, years: Optional[int] = None,
+                             dialect: str = "bigquery") -> str:
+    """Query returning the reduced historical weather of @trip_id for @user_id, see the module docstring.
+
+    `fields` must come from RECORD_FIELDS, or AGGREGATE_FIELDS with an aggregate. With
+    `years` the query takes an @years parameter.
+    """
+    record_sql = _RECORD_SQL[dialect]
+    # date and year are always read, they order, filter and group the records
+    columns = ["date", "year"] + [field for field in fields if field not in ("date", "year")]
+    source = _RECORDS_SOURCE[dialect].format(trips=trip_table, historical_weather=historical_table)
+
+    recent = ""
+    if years is not None:
+        recent = "WHERE year >= (SELECT MIN(year) FROM (SELECT DISTINCT year FROM records ORDER BY year DESC LIMIT @years) y)"
+
+    selected = [f"{record_sql[column]} AS {column}" for column in columns]
+    if aggregate is None:
+        select = f"SELECT {', '.join(fields)} FROM records {recent} ORDER BY date"
+    else:
+        key, key_sql, count = AGGREGATES[aggregate]
+        averages = "".join(f", ROUND(AVG({field}), 1) AS {field}" for field in fields)
+        order = key_sql
+        if aggregate == "day":
+            # days before the trip's start day in the calendar come after the turn of the year
+            selected.append(f"CASE WHEN SUBSTR({record_sql['date']}, 6, 5) < SUBSTR(t.start_date, 6, 5) THEN 1 ELSE 0 END"
+                            " AS next_year")
+            order = f"MIN(next_year), {key_sql}"
+        select = f"""
+            SELECT {key_sql} AS {key}, COUNT(*) AS {count}{averages}
+            FROM records {recent}
+            GROUP BY {key_sql}
+            ORDER BY {order}
+        """
+
+    return f"""
+        WITH records AS (
+            SELECT {", ".join(selected)}
+            {source}
+            WHERE t.trip_id = @trip_id AND t.user_id = @user_id AND t.deleted_at IS NULL
+        )
+        {select}
+    """
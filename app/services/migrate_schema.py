@@ -0,0 +1,171 @@
+"""Creates or migrates the tables declared in app.core.schema, and checks what the API's queries scan.
+
+    python -m app.services.migrate_schema                # create missing tables and columns, apply clustering
+    python -m app.services.migrate_schema --check-bytes  # dry-run the queries, fail if one scans too much
+
+Migrating is safe to re-run: existing tables only get the columns and clustering they are
+missing. Changes that would need a table rebuilt are printed instead of done.
+
+The check calls every data-access method the routers and background jobs use against a
+backend that dry-runs each statement, which is free and also catches SQL BigQuery
+rejects. It exits non-zero when a call would scan more than QUERY_BYTES_BUDGET bytes, so
+it can run in CI against a dataset with production-like volume. Dry-run estimates include
+partition pruning but not clustering, so they are an upper bound for clustered lookups:
+a regression they catch is a query reading a column or partition it shouldn't.
+"""
+import argparse
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.database import BigQueryBackend, Database, PACKING_LIST_COLUMNS, TRIP_COLUMNS, db
+
+# most bytes a single data-access call may be estimated to scan
+QUERY_BYTES_BUDGET = int(os.getenv("QUERY_BYTES_BUDGET", str(100 * 1024 * 1024)))
+
+# ids the statements are estimated with, what they match doesn't change the estimate
+USER = "schema-check-user"
+TRIP = "schema-check-trip"
+LIST = "schema-check-list"
+TRIP_FIELDS = {"city": "Paris", "country": "France", "start_date": "2025-01-01", "end_date": "2025-01-08",
+               "luggage_type": "hand", "trip_purpose": "vacation"}
+TRIP_INFO = {"trip_id": TRIP, "trip_purpose": "vacation", "country": "France", "city": "Paris",
+             "min_temp": 10.0, "max_temp": 20.0}
+
+# (name, call, scans the whole table by design and is only reported)
+CHECKS: List[Tuple[str, Callable[[Database], Any], bool]] = [
+    ("get_user", lambda d: d.get_user(USER), False),
+    ("get_user_credentials", lambda d: d.get_user_credentials("schema-check"), False),
+    ("list_usernames", lambda d: d.list_usernames(), True),
+    ("create_user", lambda d: d.create_user(USER, "schema-check", "hash", "Name", 30, None), False),
+    ("update_password", lambda d: d.update_password(USER, "hash"), False),
+    ("get_user_info", lambda d: d.get_user_info(USER), False),
+    ("update_user_info", lambda d: d.update_user_info(USER, {"name": "Name"}), False),
+    ("get_trip", lambda d: d.get_trip(TRIP, USER), False),
+    ("get_trip_unchecked", lambda d: d.get_trip(TRIP), False),
+    ("trip_exists", lambda d: d.trip_exists(TRIP, USER), False),
+    ("list_trips", lambda d: d.list_trips(USER, TRIP_COLUMNS, 51), False),
+    ("list_trips_after", lambda d: d.list_trips(USER, TRIP_COLUMNS, 51, ["2025-01-01", TRIP]), False),
+    ("update_trip", lambda d: d.update_trip(TRIP, USER, TRIP_FIELDS), False),
+    ("delete_trip", lambda d: d.delete_trip(TRIP, USER), False),
+    ("delete_trips", lambda d: d.delete_trips([TRIP, f"{TRIP}-2"], USER), False),
+    ("purge_deleted_trips", lambda d: d.purge_deleted_trips(), False),
+    ("get_trip_weather", lambda d: d.get_trip_weather(TRIP, USER), False),
+    ("get_trip_weather_unchecked", lambda d: d.get_trip_weather(TRIP), False),
+    ("update_trip_weather", lambda d: d.update_trip_weather(TRIP, {"min_temp": 10.0, "max_temp": 20.0}), False),
+    ("get_historical_weather", lambda d: d.get_historical_weather(TRIP, USER), False),
+    ("get_historical_weather_view", lambda d: d.get_historical_weather_view(TRIP, USER, ["min_temp", "max_temp"], "year", 5),
+     False),
+    ("get_packing_list", lambda d: d.get_packing_list(LIST, USER), False),
+    ("get_packing_list_version", lambda d: d.get_packing_list_version(LIST, USER), False),
+    ("get_packing_counters", lambda d: d.get_packing_counters(LIST, USER), False),
+    ("list_packing_lists", lambda d: d.list_packing_lists(TRIP, USER, PACKING_LIST_COLUMNS, 51, LIST), False),
+    ("get_trip_packing_totals", lambda d: d.get_trip_packing_totals(TRIP, USER), False),
+    ("list_trips_packing_totals", lambda d: d.list_trips_packing_totals([TRIP, f"{TRIP}-2"], USER), False),
+    ("get_user_packing_progress", lambda d: d.get_user_packing_progress(USER), False),
+    ("get_user_packing_progress_json", lambda d: d.get_user_packing_progress(USER, from_json=True), False),
+    ("update_packing_list", lambda d: d.update_packing_list(LIST, "{}", 0, 0, USER), False),
+    ("delete_packing_list", lambda d: d.delete_packing_list(LIST, USER), False),
+    ("list_all_trips", lambda d: d.list_all_trips(USER), False),
+    ("list_user_packing_counters", lambda d: d.list_user_packing_counters(USER), False),
+    ("get_packing_list_trip_info", lambda d: d.get_packing_list_trip_info(LIST, USER), False),
+    ("find_similar_trips", lambda d: d.find_similar_trips(TRIP_INFO, "%sunny%", 0.5), True),
+    ("get_packing_lists_for_trips", lambda d: d.get_packing_lists_for_trips([TRIP, f"{TRIP}-2"]), False),
+]
+
+
+class DryRunFailed(Exception):
+    """Raised when BigQuery rejects a statement's dry run."""
+
+
+class DryRunBackend(BigQueryBackend):
+    """Dry-runs statements instead of running them, keeping BigQuery's estimate of the bytes each one scans.
+
+    Reads come back empty and writes change nothing, so the methods take their "not found"
+    paths, which still issue every statement a request would. Methods that expect a row
+    fail on the empty result, after their statements have been estimated.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.estimates: List[int] = []
+
+    def _dry_run(self, sql: str, params: Optional[Dict[str, Any]]):
+        try:
+            job = self.client.query(sql, job_config=self._job_config(params, dry_run=True, use_query_cache=False))
+        except Exception as e:
+            raise DryRunFailed(str(e))
+        self.estimates.append(job.total_bytes_processed or 0)
+
+    def query(self, sql: str, params: Optional[Dict[str, Any]] = None):
+        self._dry_run(sql, params)
+        return []
+
+    def query_batches(self, sql: str, params: Optional[Dict[str, Any]] = None):
+        self._dry_run(sql, params)
+        return iter(())
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> int:
+        self._dry_run(sql, params)
+        return 0
+
+    def execute_many(self, sql: str, params_list: Sequence[Dict[str, Any]]):
+        if params_list:
+            self._dry_run(sql, params_list[0])
+
+    def insert_rows(self, table: str, rows, row_ids=None):
+        # streaming inserts aren't billed by bytes scanned
+        pass
+
+
+def check_query_bytes(budget: int = QUERY_BYTES_BUDGET) -> bool:
+    """Dry-run every check and print its estimate. Returns False if one failed or went over the budget."""
+    backend = DryRunBackend()
+    # no cache and no insert buffer, every call goes to the backend
+    dry_db = Database(backend)
+    passed = True
+    for name, call, scans_all in CHECKS:
+        backend.estimates = []
+        try:
+            call(dry_db)
+        except DryRunFailed as e:
+            passed = False
+            print(f"{name:<32} ERROR {str(e)}")
+            continue
+        except Exception:
+            # NotFound / Forbidden or an empty result the method didn't expect, its statements ran by then
+            pass
+
+        scanned = sum(backend.estimates)
+        if scans_all:
+            status = "full scan by design"
+        elif scanned > budget:
+            status = "OVER BUDGET"
+            passed = False
+        else:
+            status = "ok"
+        print(f"{name:<32} {scanned:>15,} bytes  {len(backend.estimates)} statements  {status}")
+    return passed
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check-bytes", action="store_true", help="dry-run the queries instead of migrating")
+    parser.add_argument("--budget", type=int, default=QUERY_BYTES_BUDGET, help="most bytes a call may scan")
+    args = parser.parse_args(argv)
+
+    if args.check_bytes:
+        if db.backend.dialect != "bigquery":
+            print("The bytes check needs DATABASE_BACKEND=bigquery")
+            return 2
+        return 0 if check_query_bytes(args.budget) else 1
+
+    changes = db.migrate_schema()
+    for change in changes:
+        print(change)
+    print(f"Schema migrated, {len(changes)} changes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""In-process write buffer for packing lists edited item by item.
+
+PATCH /packing/{id}/items applies its operations to a copy of the list held here and
+only writes the whole list back to storage once the user stops editing for a short
+debounce window, so ticking 40 boxes becomes a single UPDATE instead of 40.
+
+Reads for a list that is held in the buffer are served from the buffer until it has been
+written back, which gives read-your-writes for the user editing it. The buffer is per process, so deployments
+with several workers need sticky sessions for that guarantee to hold across requests.
+"""
+import asyncio
+import contextlib
+import copy
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.services.packing_progress import count_packing_items
+
+
+class PackingOperationError(Exception):
+    """Raised when an item operation can't be applied to a packing list."""
+
+
+def _find_category(packing_list: Dict[str, Any], category_name: str) -> Optional[Dict[str, Any]]:
+    for category in packing_list.get("categories", []):
+        if isinstance(category, dict) and category.get("category_name") == category_name:
+            return category
+    return None
+
+
+def _find_item(category: Dict[str, Any], item_name: str) -> Optional[Dict[str, Any]]:
+    for item in category.get("items", []):
+        if isinstance(item, dict) and item.get("name") == item_name:
+            return item
+    return None
+
+
+def apply_item_operations(packing_list: Dict[str, Any], operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply a batch of item operations and return the updated list.
+
+    The batch is all-or-nothing: operations run against a copy and the original list is
+    left untouched if any of them fails.
+
+    Supported operations:
+    - toggle_packed: set "packed" to the given value, or flip it when no value is given
+    - set_quantity: change the quantity of an item
+    - add: add an item (and its category if it doesn't exist yet)
+    - remove: remove an item
+    """
+    updated = copy.deepcopy(packing_list)
+    if not isinstance(updated.get("categories"), list):
+        updated["categories"] = []
+
+    for operation in operations:
+        op = operation["op"]
+        category = _find_category(updated, operation["category_name"])
+
+        if op == "add":
+            if category is None:
+                category = {"category_name": operation["category_name"], "items": []}
+                updated["categories"].append(category)
+            if _find_item(category, operation["item_name"]) is not None:
+                raise PackingOperationError(f"Item '{operation['item_name']}' already exists in '{operation['category_name']}'")
+
+            item = {"name": operation["item_name"], "quantity": 1, "essential": False, "packed": False, "notes": ""}
+            item.update(operation.get("item") or {})
+            item["name"] = operation["item_name"]
+            if operation.get("quantity") is not None:
+                item["quantity"] = operation["quantity"]
+            if operation.get("packed") is not None:
+                item["packed"] = operation["packed"]
+            category.setdefault("items", []).append(item)
+            continue
+
+        if category is None:
+            raise PackingOperationError(f"Category '{operation['category_name']}' not found")
+        item = _find_item(category, operation["item_name"])
+        if item is None:
+            raise PackingOperationError(f"Item '{operation['item_name']}' not found in '{operation['category_name']}'")
+
+        if op == "toggle_packed":
+            item["packed"] = operation["packed"] if operation.get("packed") is not None else not item.get("packed", False)
+        elif op == "set_quantity":
+            if operation.get("quantity") is None:
+                raise PackingOperationError("set_quantity requires a quantity")
+            item["quantity"] = operation["quantity"]
+        elif op == "remove":
+            category["items"].remove(item)
+        else:
+            raise PackingOperationError(f"Unknown operation '{op}'")
+
+    # keep the model-provided total in step with the items actually in the list
+    if "total_items" in updated:
+        updated["total_items"] = count_packing_items(updated)[0]
+
+    return updated
+
+
+class _BufferedList:
+    def __init__(self, user_id: str, packing_list: Dict[str, Any], trip_id: Optional[str] = None):
+        self.user_id = user_id
+        self.trip_id = trip_id
+        self.packing_list = packing_list
+        # identifies this copy of the list, with version it gives the ETag of what the buffer serves
+        self.token = uuid.uuid4().hex
+        self.version = 0
+        self.flushed_version = 0
+        self.first_unflushed_at: Optional[float] = None
+        # consecutive failed write-backs, and when the next attempt may run
+        self.failures = 0
+        self.retry_at: Optional[float] = None
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.flushed_version
+
+
+class PackingListBuffer:
+    """Holds recently edited packing lists and flushes coalesced writes on a debounce."""
+
+    def __init__(self, write: Callable[[str, Dict[str, Any]], None], debounce_seconds: float = 2.0,
+                 max_delay_seconds: float = 10.0, max_entries: int = 1000,
+                 retry_base_seconds: float = 1.0, retry_max_seconds: float = 60.0):
+        # write(list_id, packing_list) is the blocking storage call, it runs in a worker thread
+        self.write = write
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        # failed write-backs are retried after retry_base_seconds, doubling up to retry_max_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _BufferedList]" = OrderedDict()
+        # lists being replaced or deleted as a whole, set once the write is over
+        self._replacing: Dict[str, asyncio.Event] = {}
+        # bumped whenever a replace starts, tells a load that overlapped one to read again
+        self._replaces = 0
+
+    def get(self, list_id: str) -> Optional[_BufferedList]:
+        entry = self._entries.get(list_id)
+        if entry is not None:
+            self._entries.move_to_end(list_id)
+        return entry
+
+    def hold(self, list_id: str, user_id: str, packing_list: Dict[str, Any], trip_id: Optional[str] = None) -> _BufferedList:
+        """Start holding a list that was just read from storage."""
+        entry = self._entries.get(list_id)
+        if entry is None:
+            entry = _BufferedList(user_id, packing_list, trip_id)
+            self._entries[list_id] = entry
+            self._evict()
+        self._entries.move_to_end(list_id)
+        return entry
+
+    async def hold_loaded(self, list_id: str, user_id: str, load: Callable[[], Awaitable[Tuple[Dict[str, Any], Optional[str]]]]) -> _BufferedList:
+        """The held copy of a list, reading it from storage with load() when there is none.
+
+        load() returns the parsed list and its trip_id. A replace of the list in flight is
+        waited for, and a read that overlapped one is done again, so the copy held is never
+        older than the last full write.
+        """
+        while True:
+            await self.wait_replaced(list_id)
+            entry = self.get(list_id)
+            if entry is not None:
+                return entry
+            replaces = self._replaces
+            packing_list, trip_id = await load()
+            if self._replaces == replaces:
+                # another request may have loaded the list while we were reading, hold keeps the first copy
+                return self.hold(list_id, user_id, packing_list, trip_id)
+
+    async def wait_replaced(self, list_id: str):
+        """Wait until no replace or delete of the list is in flight."""
+        while list_id in self._replacing:
+            await self._replacing[list_id].wait()
+
+    @contextlib.asynccontextmanager
+    async def replacing(self, list_id: str):
+        """Hold off item edits of a list while it is replaced or deleted as a whole.
+
+        The buffered copy is taken out before the write starts, so a PATCH arriving during
+        the write waits for it and then edits what was written, instead of being dropped
+        along with the old copy afterwards. If the write fails the copy is put back.
+        """
+        await self.wait_replaced(list_id)
+        done = self._replacing[list_id] = asyncio.Event()
+        self._replaces += 1
+        try:
+            # wait for an in-flight write back so it can't land after the replace
+            await self.settle(list_id)
+            entry = self._entries.pop(list_id, None)
+            try:
+                yield
+            except BaseException:
+                if entry is not None and list_id not in self._entries:
+                    self._entries[list_id] = entry
+                    if entry.dirty:
+                        self._schedule_flush(list_id, entry)
+                raise
+        finally:
+            del self._replacing[list_id]
+            done.set()
+
+    def apply(self, list_id: str, operations: List[Dict[str, Any]]) -> _BufferedList:
+        """Apply operations to a held list and schedule it to be flushed."""
+        entry = self._entries[list_id]
+        try:
+            entry.packing_list = apply_item_operations(entry.packing_list, operations)
+        except PackingOperationError:
+            # nothing pending on a freshly loaded list, let reads go back to storage
+            if not entry.dirty and entry.flush_task is None:
+                del self._entries[list_id]
+            raise
+        entry.version += 1
+        if entry.first_unflushed_at is None:
+            entry.first_unflushed_at = time.monotonic()
+        self._schedule_flush(list_id, entry)
+        return entry
+
+    async def settle(self, list_id: str):
+        """Cancel a scheduled flush and wait for an in-flight one, before a full write or delete."""
+        entry = self._entries.get(list_id)
+        if entry is None:
+            return
+        self._cancel_flush(entry)
+        if entry.flush_task is not None and not entry.flush_task.done():
+            try:
+                await asyncio.shield(entry.flush_task)
+            except Exception:
+                pass
+
+    def discard(self, list_id: str):
+        """Forget a list, e.g. because it was replaced or deleted. Pending edits are dropped."""
+        entry = self._entries.pop(list_id, None)
+        if entry is not None:
+            self._cancel_flush(entry)
+
+    def discard_trips(self, trip_ids: Iterable[str]):
+        """Forget the lists of deleted trips, their pending edits would only write to deleted rows."""
+        trip_ids = set(trip_ids)
+        for list_id, entry in list(self._entries.items()):
+            if entry.trip_id in trip_ids:
+                self.discard(list_id)
+
+    async def flush(self, list_id: str):
+        """Write a held list back to storage now if it has unflushed edits."""
+        entry = self._entries.get(list_id)
+        if entry is None:
+            return
+        self._cancel_flush(entry)
+        if entry.flush_task is not None and not entry.flush_task.done():
+            # a flush is already writing, wait for it and then write whatever came after it
+            await asyncio.shield(entry.flush_task)
+        if not entry.dirty:
+            return
+
+        version = entry.version
+        packing_list = entry.packing_list
+        entry.flush_task = asyncio.ensure_future(asyncio.to_thread(self.write, list_id, packing_list))
+        try:
+            await asyncio.shield(entry.flush_task)
+        except Exception as e:
+            # keep the edits and try again with backoff, storage is likely rate limiting or down
+            entry.failures += 1
+            backoff = min(self.retry_base_seconds * 2 ** (entry.failures - 1), self.retry_max_seconds)
+            entry.retry_at = time.monotonic() + backoff
+            print(f"Error flushing packing list {list_id} (attempt {entry.failures}), retrying in {backoff:.1f}s: {str(e)}")
+            self._schedule_flush(list_id, entry)
+            raise
+
+        entry.flushed_version = max(entry.flushed_version, version)
+        entry.failures = 0
+        entry.retry_at = None
+        # edits made while this write was running start a new max-delay window
+        entry.first_unflushed_at = time.monotonic() if entry.dirty else None
+        if not entry.dirty and self._entries.get(list_id) is entry:
+            # storage is up to date, reads can go back to it
+            del self._entries[list_id]
+
+    async def flush_user(self, user_id: str):
+        """Flush every list the user has pending edits on, so aggregate queries see them."""
+        now = time.monotonic()
+        for list_id, entry in list(self._entries.items()):
+            # a list that is backing off after a failed write waits for its retry
+            if entry.user_id == user_id and entry.dirty and (entry.retry_at is None or entry.retry_at <= now):
+                try:
+                    await self.flush(list_id)
+                except Exception:
+                    continue
+
+    async def flush_all(self):
+        """Flush every pending list, used on shutdown."""
+        for list_id, entry in list(self._entries.items()):
+            if entry.dirty:
+                try:
+                    await self.flush(list_id)
+                except Exception:
+                    continue
+
+    def _schedule_flush(self, list_id: str, entry: _BufferedList):
+        now = time.monotonic()
+        if entry.retry_at is not None:
+            # backing off after a failed write, new edits don't bring the retry forward
+            delay = max(0.0, entry.retry_at - now)
+        else:
+            # debounce, but never hold edits back for longer than max_delay_seconds
+            waited = now - (entry.first_unflushed_at or now)
+            delay = max(0.0, min(self.debounce_seconds, self.max_delay_seconds - waited))
+
+        if entry.flush_handle is not None:
+            entry.flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        entry.flush_handle = loop.call_later(delay, self._start_flush, list_id)
+
+    def _start_flush(self, list_id: str):
+        entry = self._entries.get(list_id)
+        if entry is None:
+            return
+        entry.flush_handle = None
+        task = asyncio.ensure_future(self.flush(list_id))
+        # errors are logged and rescheduled inside flush
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def _cancel_flush(self, entry: _BufferedList):
+        if entry.flush_handle is not None:
+            entry.flush_handle.cancel()
+            entry.flush_handle = None
+
+    def _evict(self):
+        # only lists without pending edits can be dropped, dirty ones stay until flushed
+        if len(self._entries) <= self.max_entries:
+            return
+        # the most recently used entry is the one being worked on and is never dropped
+        for list_id, entry in list(self._entries.items())[:-1]:
+            if len(self._entries) <= self.max_entries:
+                break
+            if not entry.dirty and (entry.flush_task is None or entry.flush_task.done()):
+                del self._entries[list_id]
@@ -0,0 +1,139 @@
+"""Shared cache of parsed packing lists.
+
+Packing lists are stored as JSON strings and the same list is read by several endpoints
+in one page load. Every reader goes through get_parsed_packing_list, which parses a list
+once per (list_id, content hash) and keeps the result in a bounded LRU. Because the key
+includes a hash of the stored JSON, an updated list can never be served stale.
+
+Parsed lists are shared between callers and must be treated as read-only; copy them
+before making changes.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import app.core.config  # noqa: F401, loads .env before the settings below are read
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library codec
+    orjson = None
+
+# total size of the cached lists, measured on their JSON text
+PACKING_LIST_CACHE_MAX_BYTES = int(os.getenv("PACKING_LIST_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class PackingListFormatError(ValueError):
+    """Raised when a stored packing list isn't valid JSON or doesn't look like a packing list."""
+
+
+def loads(raw):
+    """Decode JSON text (str or bytes) with the fastest codec available."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dumps(obj) -> str:
+    """Encode an object as compact JSON text with the fastest codec available."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def validate_packing_list(packing_list: Any) -> Dict[str, Any]:
+    """Check the top-level shape of a parsed packing list."""
+    if not isinstance(packing_list, dict):
+        raise PackingListFormatError("Packing list is not a JSON object")
+    if "categories" in packing_list and not isinstance(packing_list["categories"], list):
+        raise PackingListFormatError("Packing list categories are not a list")
+    return packing_list
+
+
+class PackingListCache:
+    """LRU of parsed packing lists bounded by the byte size of their JSON text."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._latest_keys: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, list_id: str, raw) -> Dict[str, Any]:
+        """Return the parsed and validated packing list for the stored JSON text."""
+        data = raw.encode("utf-8") if isinstance(raw, str) else raw
+        key = (list_id, hashlib.blake2b(data, digest_size=16).hexdigest())
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        try:
+            packing_list = validate_packing_list(loads(data))
+        except ValueError as e:
+            # orjson.JSONDecodeError and json.JSONDecodeError are both ValueErrors
+            if isinstance(e, PackingListFormatError):
+                raise
+            raise PackingListFormatError(f"Packing list contains invalid JSON: {str(e)}")
+
+        self._put(key, packing_list, len(data))
+        return packing_list
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._latest_keys.clear()
+            self.current_bytes = 0
+
+    def _put(self, key: Tuple[str, str], packing_list: Dict[str, Any], size: int):
+        # a list bigger than the whole cache is parsed but never cached
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            # an older version of the same list can never be hit again, drop it right away
+            old_key = self._latest_keys.get(key[0])
+            if old_key is not None and old_key in self._entries:
+                self.current_bytes -= self._entries.pop(old_key)[1]
+
+            self._entries[key] = (packing_list, size)
+            self._latest_keys[key[0]] = key
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                evicted_key, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                if self._latest_keys.get(evicted_key[0]) == evicted_key:
+                    del self._latest_keys[evicted_key[0]]
+
+
+packing_list_cache = PackingListCache(PACKING_LIST_CACHE_MAX_BYTES)
+
+
+def get_parsed_packing_list(list_id: str, raw: Optional[str]) -> Dict[str, Any]:
+    """Parse a stored packing list through the shared cache. Empty lists parse to {}."""
+    if not raw:
+        return {}
+    return packing_list_cache.get(list_id, raw)
@@ -1,38 +1,12 @@
-from google.cloud import bigquery
-from google import genai
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Initialize API and BigQuery clients
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-USER_DATASET_ID = os.getenv("USER_DATASET_ID")
-TRIP_DATASET_ID = os.getenv("TRIP_DATASET_ID")
-USER_INFO_TABLE_ID = os.getenv("USER_INFO_TABLE_ID")
-TRIP_TABLE_ID = os.getenv("TRIP_TABLE_ID")
-TRIP_WEATHER_TABLE_ID = os.getenv("TRIP_WEATHER_TABLE_ID")
-
-client = bigquery.Client(project="capstone-sophiallamas")
-gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+from app.core.clients import get_gemini_client
+from app.core.database import db
 
 
 # Function to fetch user, trip, and weather info
 def fetch_trip_details(trip_id):
-    query = f'''
-        SELECT * FROM `{TRIP_DATASET_ID}.{TRIP_TABLE_ID}` WHERE trip_id = '{trip_id}'
-    '''
-    trip_info = client.query(query).to_dataframe().to_dict(orient='records')[0]
-
-    user_query = f'''
-        SELECT * FROM `{USER_DATASET_ID}.{USER_INFO_TABLE_ID}` WHERE user_id = '{trip_info['user_id']}'
-    '''
-    user_info = client.query(user_query).to_dataframe().to_dict(orient='records')[0]
-
-    weather_query = f'''
-        SELECT * FROM `{TRIP_DATASET_ID}.{TRIP_WEATHER_TABLE_ID}` WHERE trip_id = '{trip_id}'
-    '''
-    weather_info = client.query(weather_query).to_dataframe().to_dict(orient='records')[0]
+    trip_info = db.get_trip(trip_id)
+    user_info = db.get_user_info(trip_info['user_id'])
+    weather_info = db.get_trip_weather(trip_id)
 
     return user_info, trip_info, weather_info
 
@@ -68,7 +42,7 @@ def generate_packing_list(trip_id):
     }}
     '''
 
-    response = gemini_client.models.generate_content(
+    response = get_gemini_client().models.generate_content(
         model='gemini-2.0-flash',
         contents=prompt,
     )
@@ -0,0 +1,95 @@
+from typing import Any, Tuple
+
+
+def count_packing_items(packing_list: Any) -> Tuple[int, int]:
+    """Count the total and packed items of a parsed packing list.
+
+    The counters are stored alongside each list (total_items / packed_items columns)
+    so the progress endpoints never have to parse the packing list JSON.
+    Malformed categories and items are skipped rather than failing the whole list, and
+    an item counts as packed when "packed" == True, so true, 1 and 1.0 but not "true".
+    """
+    if not isinstance(packing_list, dict) or not isinstance(packing_list.get("categories"), list):
+        return 0, 0
+
+    total_items = 0
+    packed_items = 0
+    for category in packing_list["categories"]:
+        if not isinstance(category, dict) or not isinstance(category.get("items"), list):
+            continue
+
+        for item in category["items"]:
+            if not isinstance(item, dict):
+                continue
+
+            total_items += 1
+            if item.get("packed") == True:
+                packed_items += 1
+
+    return total_items, packed_items
+
+
+def progress_percent(packed_items: int, total_items: int) -> float:
+    """Percentage of packed items, rounded the way the progress endpoints report it."""
+    if not total_items:
+        return 0
+    return round(packed_items / total_items * 100, 2)
+
+
+# per-list item counts computed inside the warehouse from the packing list JSON,
+# following the same rules as count_packing_items: categories and items must be arrays,
+# only object items are counted and packed matches == True: the boolean true or a number
+# equal to 1 (JSON_QUERY returns the JSON text of the value, so a string "true" comes back
+# quoted and never matches)
+_JSON_LIST_COUNTS = {
+    "bigquery": """
+        (SELECT AS STRUCT COUNT(*) AS total_items,
+                COUNTIF(JSON_QUERY(item, '$.packed') = 'true'
+                        OR SAFE_CAST(JSON_QUERY(item, '$.packed') AS FLOAT64) = 1) AS packed_items
+         FROM UNNEST(JSON_QUERY_ARRAY(p.packing_list, '$.categories')) AS category,
+              UNNEST(JSON_QUERY_ARRAY(category, '$.items')) AS item
+         WHERE STARTS_WITH(LTRIM(item), '{'))
+    """,
+    # local stand-in (SQLite JSON1) with the same semantics, for running without BigQuery
+    "sqlite": """
+        (SELECT json_object('total_items', COUNT(*),
+                            'packed_items', COALESCE(SUM(json_type(item.value, '$.packed') = 'true'
+                                                         OR (json_type(item.value, '$.packed') IN ('integer', 'real')
+                                                             AND json_extract(item.value, '$.packed') = 1)), 0))
+         FROM json_each(CASE WHEN json_valid(p.packing_list)
+                              AND json_type(p.packing_list, '$.categories') = 'array'
+                             THEN p.packing_list ELSE '{"categories": []}' END, '$.categories') AS category
+         JOIN json_each(CASE WHEN category.type = 'object'
+                              AND json_type(category.value, '$.items') = 'array'
+                             THEN category.value ELSE '{"items": []}' END, '$.items') AS item
+         WHERE item.type = 'object')
+    """,
+}
+
+_COUNT_FIELD = {
+    "bigquery": "counts.{}",
+    "sqlite": "json_extract(counts, '$.{}')",
+}
+
+
+def user_progress_json_query(packing_table: str, trip_table: str, dialect: str = "bigquery") -> str:
+    """Query returning a single row (list_count, average_progress) for @user_id.
+
+    Unlike the counter-based query it reads the packing list JSON directly, so it also
+    covers lists whose counters haven't been backfilled. Lists without items are skipped
+    and average_progress is NULL when the user has none, like the Python computation.
+    """
+    total_items = _COUNT_FIELD[dialect].format("total_items")
+    packed_items = _COUNT_FIELD[dialect].format("packed_items")
+    return f"""
+        WITH per_list AS (
+            SELECT {_JSON_LIST_COUNTS[dialect]} AS counts
+            FROM {packing_table} p
+            JOIN {trip_table} t ON p.trip_id = t.trip_id
+            WHERE t.user_id = @user_id AND t.deleted_at IS NULL
+        )
+        SELECT COUNT(*) AS list_count,
+               AVG(100.0 * {packed_items} / {total_items}) AS average_progress
+        FROM per_list
+        WHERE {total_items} > 0
+    """
@@ -0,0 +1,45 @@
+"""Job that removes deleted trips for good.
+
+Deleting a trip only marks it deleted, so the request costs a single UPDATE. This job
+removes every marked trip together with its packing lists, weather and historical weather,
+one statement per table for all of them. It is meant to be run on its own, once for the
+whole deployment, e.g. from a scheduler:
+
+    python -m app.services.purge_deleted_trips
+
+Setting TRIP_PURGE_INTERVAL_SECONDS makes the API run it in the background instead, for a
+single-worker setup: every worker runs its own, and although purging is idempotent, each
+of them is a full scan of the tables.
+"""
+import asyncio
+import os
+
+from app.core.database import db
+from app.core.metrics import metrics
+
+# seconds between purges in each API worker, 0 (the default) leaves purging to the command above
+TRIP_PURGE_INTERVAL_SECONDS = float(os.getenv("TRIP_PURGE_INTERVAL_SECONDS", "0"))
+
+
+def purge_deleted_trips() -> int:
+    """Remove every deleted trip and its data. Returns the number of trips removed."""
+    purged = db.purge_deleted_trips()
+    metrics.increment("trip_purge.runs")
+    metrics.increment("trip_purge.trips", purged)
+    return purged
+
+
+async def purge_periodically(interval_seconds: float = TRIP_PURGE_INTERVAL_SECONDS):
+    """Purge every interval_seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            # a purge can take longer than a request is allowed to, so it doesn't go through async_db
+            await asyncio.to_thread(purge_deleted_trips)
+        except Exception as e:
+            metrics.increment("trip_purge.errors")
+            print(f"Error purging deleted trips: {str(e)}")
+
+
+if __name__ == "__main__":
+    print(f"Purged {purge_deleted_trips()} deleted trips")
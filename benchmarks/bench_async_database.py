@@ -0,0 +1,87 @@
+"""Throughput of trip reads as concurrent users grow, blocking calls vs AsyncDatabase.
+
+A Database on in-memory SQLite stands in for the warehouse, with every statement
+delayed by --latency to mimic a BigQuery round-trip. Two routes read the same trip: one
+calls the Database inline from its async handler, the way the routers used to, and one
+awaits AsyncDatabase. Simulated users send requests back to back through the ASGI app
+and the benchmark reports requests per second for each route. The async route levels off
+at DATABASE_MAX_CONCURRENCY calls per statement latency.
+
+    python -m benchmarks.bench_async_database [--latency 0.05] [--requests 10]
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app.core.database import AsyncDatabase, Database, SQLiteBackend
+
+USER_COUNTS = [1, 4, 16, 32]
+
+
+def _database(latency: float) -> Database:
+    database = Database(SQLiteBackend(":memory:"))
+    database.insert_trip({"trip_id": "t1", "user_id": "u1", "city": "Oslo", "country": "Norway",
+                          "start_date": "2026-12-30", "end_date": "2027-01-02", "luggage_type": "carry-on",
+                          "trip_purpose": "leisure"})
+    query = database.backend.query
+
+    def slow_query(sql, params=None):
+        time.sleep(latency)
+        return query(sql, params)
+
+    database.backend.query = slow_query
+    return database
+
+
+def _app(database: Database, async_db: AsyncDatabase) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/inline/{trip_id}")
+    async def inline(trip_id: str):
+        return database.get_trip(trip_id, "u1")
+
+    @app.get("/async/{trip_id}")
+    async def facade(trip_id: str):
+        return await async_db.get_trip(trip_id, "u1")
+
+    return app
+
+
+async def _load(client: httpx.AsyncClient, path: str, users: int, requests: int):
+    async def user():
+        for _ in range(requests):
+            response = await client.get(path)
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    return users * requests / (time.perf_counter() - started)
+
+
+async def _run(latency: float, requests: int):
+    database = _database(latency)
+    async_db = AsyncDatabase(database)
+    transport = httpx.ASGITransport(app=_app(database, async_db))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"statement latency {latency * 1000:.0f} ms, {requests} requests per user")
+        print(f"{'users':>5} {'inline req/s':>13} {'async req/s':>12}")
+        for users in USER_COUNTS:
+            inline = await _load(client, "/inline/t1", users, requests)
+            facade = await _load(client, "/async/t1", users, requests)
+            print(f"{users:>5} {inline:>13.1f} {facade:>12.1f}")
+    async_db.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every statement")
+    parser.add_argument("--requests", type=int, default=10, help="requests sent by each user")
+    args = parser.parse_args()
+    asyncio.run(_run(args.latency, args.requests))
+
+
+if __name__ == "__main__":
+    main()
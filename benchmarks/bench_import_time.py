@@ -0,0 +1,60 @@
+"""Cold-start cost of importing the app, with clients built on first use vs at import.
+
+Each run is a fresh interpreter, as on a new container. "lazy" imports app.main the way
+the app starts now. "eager" imports it and then does what importing it used to do: load
+the BigQuery and Gemini SDKs and build five BigQuery clients and a Gemini client (with
+anonymous credentials, so no network or credentials are needed). Reports the median
+time over --runs runs and which SDKs ended up imported.
+
+    python -m benchmarks.bench_import_time [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import app.main
+if sys.argv[1] == "eager":
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import bigquery
+    from google import genai
+    # one client per router, like the modules used to build at import time
+    bigquery_clients = [bigquery.Client(project="benchmark", credentials=AnonymousCredentials()) for _ in range(5)]
+    gemini_client = genai.Client(api_key="benchmark")
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "modules": [name for name in ("google.cloud.bigquery", "google.genai") if name in sys.modules],
+}))
+"""
+
+
+def _run(mode: str) -> dict:
+    # no credentials in the environment, as in a test run
+    env = {key: value for key, value in os.environ.items() if key != "GOOGLE_APPLICATION_CREDENTIALS"}
+    output = subprocess.run([sys.executable, "-c", _SCRIPT, mode], check=True, capture_output=True, text=True,
+                            env=env, cwd=ROOT).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per mode")
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'median s':>9} {'min s':>7}  SDKs imported")
+    for mode in ("lazy", "eager"):
+        results = [_run(mode) for _ in range(args.runs)]
+        seconds = [result["seconds"] for result in results]
+        print(f"{mode:<6} {statistics.median(seconds):>9.3f} {min(seconds):>7.3f}  {', '.join(results[0]['modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Latency of unrelated requests on a worker while it handles a burst of logins.
+
+Runs the same burst of bcrypt verifications twice on one event loop: inline, the way
+the handlers used to call pwd_context.verify, and through app.core.security's bounded
+pool. Meanwhile a probe stands in for the worker's other requests, it is scheduled every
+few milliseconds and records how late it runs. Reports the probe's p50/p99/max delay and
+how long the burst took.
+
+    python -m benchmarks.bench_password_hashing [--logins 40] [--rounds 12]
+"""
+import argparse
+import asyncio
+import time
+
+from passlib.context import CryptContext
+
+from app.core import security
+
+PROBE_INTERVAL_SECONDS = 0.005
+
+
+def _percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+async def _probe(delays, stop):
+    # an unrelated request: it should run PROBE_INTERVAL_SECONDS after it was scheduled
+    while not stop.is_set():
+        scheduled = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL_SECONDS)
+        delays.append(time.perf_counter() - scheduled - PROBE_INTERVAL_SECONDS)
+
+
+async def _burst(logins: int, hashed: str, offloaded: bool):
+    async def login():
+        if offloaded:
+            await security.verify_password("correct horse", hashed)
+        else:
+            security.pwd_context.verify("correct horse", hashed)
+
+    delays, stop = [], asyncio.Event()
+    probe = asyncio.create_task(_probe(delays, stop))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    return sorted(delays), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=40, help="concurrent logins in the burst")
+    parser.add_argument("--rounds", type=int, default=security.BCRYPT_ROUNDS, help="bcrypt cost factor")
+    args = parser.parse_args()
+
+    context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=args.rounds)
+    security.pwd_context = context
+    hashed = context.hash("correct horse")
+
+    print(f"{args.logins} concurrent logins, bcrypt cost {args.rounds}, {security.PASSWORD_HASH_WORKERS} hash workers")
+    print(f"{'mode':<10} {'burst s':>8} {'probe p50 ms':>13} {'probe p99 ms':>13} {'probe max ms':>13}")
+    for mode, offloaded in (("inline", False), ("pool", True)):
+        delays, elapsed = asyncio.run(_burst(args.logins, hashed, offloaded))
+        print(f"{mode:<10} {elapsed:>8.2f} {_percentile(delays, 50) * 1000:>13.1f} "
+              f"{_percentile(delays, 99) * 1000:>13.1f} {delays[-1] * 1000:>13.1f}")
+    security.shutdown_password_hasher()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Serialization time and wire size of large responses, before and after the response layer.
+
+Two representative payloads are built locally: a generated packing list and the
+historical weather of a two-week trip over ten past years, with hourly descriptions.
+
+- "stdlib" is what the app did before: FastAPI's jsonable_encoder walk and the standard
+  library encoder of JSONResponse, sent uncompressed.
+- "orjson" is FastJSONResponse's encoder, "stream" is StreamingJSONResponse's chunked
+  encoding (historical weather is stored as JSON text, so it is sent as RawJSON).
+- The wire sizes are the body as sent with no Accept-Encoding, gzip at GZIP_COMPRESS_LEVEL
+  and brotli at BROTLI_QUALITY (when the optional brotli package is installed).
+
+    python -m benchmarks.bench_responses [--repeat 50]
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.core.middleware import BROTLI_QUALITY, GZIP_COMPRESS_LEVEL, brotli
+from app.core.responses import RawJSON, dumps, iter_json, orjson
+
+DESCRIPTIONS = ["Sunny", "Partly cloudy", "Light rain shower", "Overcast", "Patchy light drizzle", "Clear"]
+
+
+def packing_list():
+    rng = random.Random(0)
+    return {"trip_id": "t1", "list_id": "l1", "packing_list": {"total_items": 150, "categories": [
+        {"category_name": f"Category {c}", "items": [
+            {"name": f"Item {rng.randrange(10 ** 6)}", "quantity": rng.randint(1, 5), "essential": rng.random() < 0.3,
+             "packed": rng.random() < 0.5, "notes": "Keep it in the carry-on bag" if rng.random() < 0.2 else ""}
+            for i in range(15)]}
+        for c in range(10)]}}
+
+
+def historical_weather():
+    rng = random.Random(0)
+    records = [{"date": f"{year}-07-{day:02d}", "year": year, "min_temp": rng.randint(10, 18),
+                "max_temp": rng.randint(20, 32), "avg_temp": round(rng.uniform(15, 25), 1), "uv_index": rng.randint(1, 9),
+                "descriptions": [rng.choice(DESCRIPTIONS) for _ in range(24)]}
+               for year in range(2015, 2025) for day in range(1, 15)]
+    return {"trip_id": "t1", "historical_data": records}
+
+
+def _time(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = fn()
+    return (time.perf_counter() - started) / repeat * 1000, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50, help="encodings timed per payload")
+    args = parser.parse_args()
+
+    weather = historical_weather()
+    stored_weather = json.dumps(weather["historical_data"], separators=(",", ":"))
+    payloads = {
+        "packing list": (packing_list(), None),
+        "historical weather": (weather, {"trip_id": "t1", "historical_data": RawJSON(stored_weather)}),
+    }
+
+    print(f"encoder: {'orjson' if orjson is not None else 'stdlib json (orjson not installed)'}, "
+          f"brotli: {'installed' if brotli is not None else 'not installed'}")
+    print(f"{'payload':<19} {'encoding':<7} {'ms':>7} {'identity KB':>12} {'gzip KB':>8} {'br KB':>7}")
+    for name, (content, streamed) in payloads.items():
+        encoders = {
+            "stdlib": lambda: JSONResponse(jsonable_encoder(content)).body,
+            "orjson": lambda: dumps(content),
+        }
+        if streamed is not None:
+            encoders["stream"] = lambda: b"".join(iter_json(streamed))
+        for encoding, encode in encoders.items():
+            ms, body = _time(encode, args.repeat)
+            assert json.loads(body) == json.loads(encoders["stdlib"]())
+            # the old layer sent every body uncompressed
+            gzipped = len(gzip.compress(body, GZIP_COMPRESS_LEVEL)) / 1024 if encoding != "stdlib" else None
+            brotlied = len(brotli.compress(body, quality=BROTLI_QUALITY)) / 1024 if brotli and encoding != "stdlib" else None
+            print(f"{name:<19} {encoding:<7} {ms:>7.2f} {len(body) / 1024:>12.1f} "
+                  f"{'-' if gzipped is None else f'{gzipped:.1f}':>8} {'-' if brotlied is None else f'{brotlied:.1f}':>7}")
+
+
+if __name__ == "__main__":
+    main()
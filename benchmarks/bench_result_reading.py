@@ -0,0 +1,102 @@
+"""Cost of reading query results as rows vs through pandas, for lookups and bulk scans.
+
+No warehouse is needed: results are built locally in the shapes BigQuery hands back.
+
+- single: one trip row. "pandas" is the old path (to_dataframe(), which goes through
+  Arrow, then .iloc[0].to_dict()), "rows" is what the backend does now (dict(row.items())
+  on the REST result rows).
+- bulk: --rows packing lists of about 2 KB each. "pandas" builds the whole result as a
+  DataFrame and then iterates its records, "arrow" reads record batches of
+  DATABASE_SCAN_BATCH_ROWS with to_pylist() as the Storage Read API path does.
+
+Reports the time per operation and the peak Python memory while reading. Needs the
+optional pyarrow and pandas packages.
+
+    python -m benchmarks.bench_result_reading [--rows 20000]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import pandas
+import pyarrow
+from google.cloud.bigquery.table import Row
+
+from app.core.database import DATABASE_SCAN_BATCH_ROWS, TRIP_COLUMNS
+
+TRIP = {"trip_id": "t1", "user_id": "u1", "city": "Oslo", "country": "Norway", "start_date": "2026-12-30",
+        "end_date": "2027-01-02", "luggage_type": "carry-on", "trip_purpose": "leisure"}
+
+
+def _packing_list(i: int) -> str:
+    items = [{"name": f"Item {n}", "quantity": 1, "essential": n % 3 == 0, "packed": n % 2 == 0, "notes": ""}
+             for n in range(25)]
+    return json.dumps({"categories": [{"category_name": "Clothes", "items": items}], "total_items": 25, "seed": i})
+
+
+def _measure(fn, repeat: int):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - started) / repeat
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_single(repeat: int):
+    rows = [Row(tuple(TRIP[column] for column in TRIP_COLUMNS), {column: i for i, column in enumerate(TRIP_COLUMNS)})]
+
+    def through_pandas():
+        frame = pyarrow.Table.from_pylist([dict(row.items()) for row in rows]).to_pandas()
+        return frame.iloc[0].to_dict()
+
+    def as_rows():
+        return [dict(row.items()) for row in rows][0]
+
+    assert through_pandas() == as_rows()
+    return {"pandas": _measure(through_pandas, repeat), "rows": _measure(as_rows, repeat)}
+
+
+def bench_bulk(count: int):
+    table = pyarrow.table({
+        "list_id": [f"l{i}" for i in range(count)],
+        "trip_id": [f"t{i}" for i in range(count)],
+        "packing_list": [_packing_list(i) for i in range(count)],
+    })
+
+    def through_pandas():
+        seen = 0
+        for record in table.to_pandas().to_dict("records"):
+            seen += len(record["packing_list"])
+        return seen
+
+    def as_arrow_batches():
+        seen = 0
+        for batch in table.to_batches(max_chunksize=DATABASE_SCAN_BATCH_ROWS):
+            for record in batch.to_pylist():
+                seen += len(record["packing_list"])
+        return seen
+
+    assert through_pandas() == as_arrow_batches()
+    return {"pandas": _measure(through_pandas, 3), "arrow": _measure(as_arrow_batches, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000, help="packing lists in the bulk scan")
+    parser.add_argument("--repeat", type=int, default=2000, help="single-row lookups timed")
+    args = parser.parse_args()
+
+    print(f"pandas {pandas.__version__}, pyarrow {pyarrow.__version__}")
+    print(f"{'mode':<7} {'reader':<7} {'time':>12} {'peak MB':>9}")
+    for reader, (elapsed, peak) in bench_single(args.repeat).items():
+        print(f"{'single':<7} {reader:<7} {elapsed * 1e6:>9.1f} us {peak / 1e6:>9.2f}")
+    for reader, (elapsed, peak) in bench_bulk(args.rows).items():
+        print(f"{'bulk':<7} {reader:<7} {elapsed * 1000:>9.1f} ms {peak / 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
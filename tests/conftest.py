@@ -0,0 +1,5 @@
+import os
+
+# the tests run against in-memory SQLite, never BigQuery
+os.environ.setdefault("DATABASE_BACKEND", "sqlite")
+os.environ.setdefault("DATABASE_PATH", ":memory:")
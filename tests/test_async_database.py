@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.database import AsyncDatabase, current_scope
+
+
+class FakeJob:
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class SlowDatabase:
+    """Blocks like a warehouse round-trip and records how many calls overlap."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.running = 0
+        self.peak = 0
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def get_trip(self, trip_id):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        job = FakeJob()
+        self.jobs.append(job)
+        current_scope().add_job(job)
+        try:
+            job.cancelled.wait(self.seconds)
+            return {"trip_id": trip_id}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_calls_run_concurrently_up_to_the_limit():
+    database = SlowDatabase(0.1)
+    async_db = AsyncDatabase(database, max_concurrency=4)
+
+    async def scenario():
+        started = time.perf_counter()
+        rows = await asyncio.gather(*(async_db.get_trip(f"t{i}") for i in range(8)))
+        return rows, time.perf_counter() - started
+
+    rows, elapsed = asyncio.run(scenario())
+    async_db.shutdown()
+    assert [row["trip_id"] for row in rows] == [f"t{i}" for i in range(8)]
+    # two rounds of four rather than eight calls one after another
+    assert database.peak == 4
+    assert elapsed < 0.5
+
+
+def test_the_event_loop_keeps_running_during_a_call():
+    async_db = AsyncDatabase(SlowDatabase(0.2), max_concurrency=1)
+
+    async def scenario():
+        ticks = 0
+        call = asyncio.ensure_future(async_db.get_trip("t1"))
+        while not call.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return ticks
+
+    assert asyncio.run(scenario()) >= 10
+    async_db.shutdown()
+
+
+def test_a_call_that_times_out_answers_504_and_cancels_its_job():
+    database = SlowDatabase(5)
+    async_db = AsyncDatabase(database, max_concurrency=1)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(async_db.get_trip("t1", timeout=0.05))
+    assert error.value.status_code == 504
+    assert database.jobs[0].cancelled.wait(1)
+    async_db.shutdown()
+
+
+def test_cancelling_the_request_cancels_its_job():
+    database = SlowDatabase(5)
+    async_db = AsyncDatabase(database, max_concurrency=1)
+
+    async def scenario():
+        call = asyncio.ensure_future(async_db.get_trip("t1"))
+        await asyncio.sleep(0.05)
+        # what the disconnect middleware does when the client goes away
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    asyncio.run(scenario())
+    assert database.jobs[0].cancelled.wait(1)
+    async_db.shutdown()
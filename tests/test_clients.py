@@ -0,0 +1,62 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from app.core.clients import ClientRegistry
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_the_app_builds_no_clients():
+    env = {key: value for key, value in os.environ.items() if key != "GOOGLE_APPLICATION_CREDENTIALS"}
+    env["DATABASE_BACKEND"] = "bigquery"
+    output = subprocess.run([sys.executable, "-c", """
+import json, sys
+import app.main
+from app.core.clients import clients
+print(json.dumps({"clients": sorted(clients._clients),
+                  "sdks": [name for name in ("google.cloud.bigquery", "google.genai") if name in sys.modules]}))
+"""], check=True, capture_output=True, text=True, env=env, cwd=ROOT).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == {"clients": [], "sdks": []}
+
+
+def test_each_client_is_built_once_on_first_use():
+    built = []
+    registry = ClientRegistry()
+    registry.register("warehouse", lambda: built.append(object()) or built[-1])
+    assert not registry.is_initialized("warehouse")
+
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(registry.get("warehouse"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(built) == 1
+    assert all(client is built[0] for client in seen)
+
+
+def test_close_all_closes_built_clients_and_keeps_going_on_errors():
+    closed = []
+    registry = ClientRegistry()
+    registry.register("broken", lambda: "broken", close=lambda client: 1 / 0)
+    registry.register("warehouse", lambda: "warehouse", close=closed.append)
+    registry.register("unused", lambda: "unused", close=closed.append)
+    registry.get("broken")
+    registry.get("warehouse")
+
+    registry.close_all()
+    assert closed == ["warehouse"]
+    # closed clients are built again on their next use
+    assert not registry.is_initialized("warehouse")
+
+
+def test_a_set_client_replaces_the_factory():
+    registry = ClientRegistry()
+    registry.register("gemini", lambda: 1 / 0)
+    fake = object()
+    registry.set("gemini", fake)
+    assert registry.get("gemini") is fake
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import dashboard
+from app.api.auth import get_current_user
+from app.core.dashboard_snapshot import DashboardSnapshots
+from app.core.database import TRIP_KEY, AsyncDatabase, Database, SQLiteBackend, get_async_db
+
+
+def _packing_list(*packed):
+    return json.dumps({"categories": [{"category_name": "Clothes",
+                                       "items": [{"name": f"item-{i}", "packed": value} for i, value in enumerate(packed)]}]})
+
+
+def _database(dashboards=None):
+    database = Database(SQLiteBackend(":memory:"), dashboards=dashboards)
+    database.create_user("u1", "ana", "hash", "Ana", 30, None)
+    for trip_id, user_id, start_date in [("t1", "u1", "2026-12-20"), ("t2", "u1", "2026-11-02"),
+                                         ("t3", "u1", "2026-11-02"), ("t-other", "u2", "2026-10-01")]:
+        database.insert_trip({"trip_id": trip_id, "user_id": user_id, "city": "Oslo", "country": "Norway",
+                              "start_date": start_date, "end_date": "2027-01-02", "luggage_type": "hand",
+                              "trip_purpose": "vacation"})
+    database.insert_packing_list({"list_id": "l1", "trip_id": "t1", "packing_list": _packing_list(True, False),
+                                  "total_items": 2, "packed_items": 1})
+    database.insert_packing_list({"list_id": "l2", "trip_id": "t1", "packing_list": _packing_list(True, True),
+                                  "total_items": 2, "packed_items": 2})
+    database.insert_packing_list({"list_id": "l3", "trip_id": "t-other", "packing_list": _packing_list(True),
+                                  "total_items": 1, "packed_items": 1})
+    return database
+
+
+def _client(database):
+    app = FastAPI()
+    app.include_router(dashboard.router, prefix="/dashboard")
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+    return TestClient(app)
+
+
+def _pages(client, **params):
+    pages, cursor = [], None
+    while True:
+        body = client.get("/dashboard/", params={**params, **({"cursor": cursor} if cursor else {})}).json()
+        pages.append(body["trips"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return body["message"], pages
+
+
+def test_without_snapshots_only_the_page_is_read(monkeypatch):
+    database = _database()
+
+    def whole_dashboard(*args):
+        raise AssertionError("the whole dashboard was read")
+
+    monkeypatch.setattr(database, "list_all_trips", whole_dashboard)
+    monkeypatch.setattr(database, "list_user_packing_counters", whole_dashboard)
+    totals_read = []
+    list_trips_packing_totals = database.list_trips_packing_totals
+    monkeypatch.setattr(database, "list_trips_packing_totals",
+                        lambda trip_ids, user_id: totals_read.append(trip_ids) or list_trips_packing_totals(trip_ids, user_id))
+
+    message, pages = _pages(_client(database), limit=2)
+
+    assert message == "Welcome to your dashboard, Ana!"
+    # ordered by start date, ties broken by trip id
+    assert [[trip["trip_id"] for trip in page] for page in pages] == [["t2", "t3"], ["t1"]]
+    assert pages[1][0]["packing_progress"] == {"total_items": 4, "packed_items": 3, "progress": 75.0, "lists_count": 2}
+    assert pages[0][0]["packing_progress"] == {"total_items": 0, "packed_items": 0, "progress": 0, "lists_count": 0}
+    # the totals are read for the trips on each page only
+    assert totals_read == [["t2", "t3"], ["t1"]]
+
+
+def test_pages_without_progress_skip_the_totals(monkeypatch):
+    database = _database()
+
+    def totals(*args):
+        raise AssertionError("totals read for a page that doesn't show them")
+
+    monkeypatch.setattr(database, "list_trips_packing_totals", totals)
+
+    _, pages = _pages(_client(database), limit=2, fields="city")
+    assert pages == [[{"trip_id": "t2", "city": "Oslo"}, {"trip_id": "t3", "city": "Oslo"}], [{"trip_id": "t1", "city": "Oslo"}]]
+
+
+@pytest.mark.parametrize("params", [{"limit": 1}, {"limit": 2, "fields": "start_date,packing_progress"}])
+def test_pages_match_the_snapshot_dashboard(params):
+    paged = _pages(_client(_database()), **params)
+    from_snapshot = _pages(_client(_database(DashboardSnapshots(TRIP_KEY, ttl_seconds=30))), **params)
+    assert paged == from_snapshot
@@ -0,0 +1,39 @@
+from app.core.dashboard_snapshot import DashboardSnapshots
+
+TRIPS = [
+    {"trip_id": "t1", "user_id": "u1", "city": "Oslo", "trip_start": "2026-12-20"},
+    {"trip_id": "t2", "user_id": "u1", "city": "Rome", "trip_start": "2026-11-02"},
+]
+LISTS = [{"list_id": "l1", "trip_id": "t1", "total_items": 4, "packed_items": 1}]
+
+
+def _build(snapshots):
+    return snapshots.finish(snapshots.begin("u1"), "Ana", TRIPS, LISTS)
+
+
+def test_snapshots_are_off_by_default():
+    snapshots = DashboardSnapshots(["trip_start"])
+    _build(snapshots)
+    assert snapshots.get("u1") is None
+
+
+def test_writes_patch_a_stored_snapshot():
+    snapshots = DashboardSnapshots(["trip_start"], ttl_seconds=30)
+    _build(snapshots)
+    version = snapshots.get("u1")["version"]
+
+    snapshots.list_updated("l1", 4, 3)
+    snapshots.trip_written({"trip_id": "t3", "user_id": "u1", "city": "Lima", "trip_start": "2027-01-05"})
+
+    dashboard = snapshots.get("u1")
+    assert dashboard["version"] != version
+    assert [trip["trip_id"] for trip in dashboard["trips"]] == ["t2", "t1", "t3"]
+    assert dashboard["trips"][1]["packed_items"] == 3
+
+
+def test_a_write_racing_a_build_keeps_it_from_being_stored():
+    snapshots = DashboardSnapshots(["trip_start"], ttl_seconds=30)
+    build = snapshots.begin("u1")
+    snapshots.trips_deleted("u1", ["t2"])
+    snapshots.finish(build, "Ana", TRIPS, LISTS)
+    assert snapshots.get("u1") is None
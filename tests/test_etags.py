@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import dashboard, packing, trips
+from app.api.auth import get_current_user
+from app.core.dashboard_snapshot import DashboardSnapshots
+from app.core.database import TRIP_KEY, AsyncDatabase, Database, SQLiteBackend, get_async_db
+from app.core.etags import etag, matches
+from app.services.packing_list_buffer import PackingListBuffer
+
+PACKING_LIST = {"categories": [{"category_name": "Clothes", "items": [{"name": "Socks", "packed": False}]}]}
+TOGGLE = {"operations": [{"op": "toggle_packed", "category_name": "Clothes", "item_name": "Socks"}]}
+TRIP = {"city": "Oslo", "country": "Norway", "start_date": "2026-12-30", "end_date": "2027-01-02",
+        "luggage_type": "hand", "trip_purpose": "vacation"}
+
+
+class FakePredictor:
+    def __init__(self, api_key):
+        pass
+
+    def predict_trip_weather(self, city, start_date, end_date):
+        return {"predicted_min_temp": -5, "predicted_max_temp": 2, "predicted_uv_index": 1,
+                "predicted_description": "Snow", "confidence_score": 0.8, "historical_data": []}
+
+
+def _database(dashboards=None):
+    database = Database(SQLiteBackend(":memory:"), dashboards=dashboards)
+    database.create_user("u1", "ana", "hash", "Ana", 30, None)
+    database.insert_trip({**TRIP, "trip_id": "trip-1", "user_id": "u1"})
+    database.insert_trip_weather({"trip_id": "trip-1", "min_temp": -5, "max_temp": 2, "uv": 1,
+                                  "description": "Snow", "confidence": 0.8})
+    database.insert_packing_list({"list_id": "list-1", "trip_id": "trip-1", "packing_list": json.dumps(PACKING_LIST),
+                                  "total_items": 1, "packed_items": 0})
+    return database
+
+
+def _client(monkeypatch, database):
+    monkeypatch.setattr(packing, "db", database)
+    buffer = PackingListBuffer(packing.write_packing_list, debounce_seconds=60, max_delay_seconds=60)
+    monkeypatch.setattr(packing, "packing_buffer", buffer)
+    monkeypatch.setattr(trips, "packing_buffer", buffer)
+    monkeypatch.setattr(dashboard, "packing_buffer", buffer)
+    monkeypatch.setattr(trips, "WeatherPredictor", FakePredictor)
+    app = FastAPI()
+    app.include_router(trips.router, prefix="/trips")
+    app.include_router(packing.router, prefix="/packing")
+    app.include_router(dashboard.router, prefix="/dashboard")
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+    return TestClient(app)
+
+
+def _revalidate(client, path, tag):
+    return client.get(path, headers={"If-None-Match": tag})
+
+
+def test_if_none_match_comparison():
+    tag = etag("trip", "trip-1", 3)
+    assert matches(tag, tag)
+    assert matches(f'"other", W/{tag}', tag)
+    assert matches("*", tag)
+    assert not matches(None, tag)
+    assert not matches(etag("trip", "trip-1", 4), tag)
+
+
+def test_trip_revalidates_until_it_is_updated(monkeypatch):
+    client = _client(monkeypatch, _database())
+
+    first = client.get("/trips/trip-1")
+    tag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    assert "version" not in first.json()
+
+    unchanged = _revalidate(client, "/trips/trip-1", tag)
+    assert unchanged.status_code == 304
+    assert unchanged.content == b"" and unchanged.headers["ETag"] == tag
+
+    assert client.put("/trips/update/trip-1", json={**TRIP, "city": "Bergen"}).status_code == 200
+    changed = _revalidate(client, "/trips/trip-1", tag)
+    assert changed.status_code == 200
+    assert changed.json()["city"] == "Bergen"
+    assert changed.headers["ETag"] != tag
+
+
+def test_packing_list_revalidates_without_reading_the_list(monkeypatch):
+    database = _database()
+    client = _client(monkeypatch, database)
+    path = "/packing/list?list_id=list-1"
+    tag = client.get(path).headers["ETag"]
+
+    statements = []
+    query = database.backend.query
+    monkeypatch.setattr(database.backend, "query", lambda sql, params=None: statements.append(sql) or query(sql, params))
+    assert _revalidate(client, path, tag).status_code == 304
+    assert len(statements) == 1 and "packing_list," not in statements[0]
+
+    # an edit held by the buffer changes the tag, and the buffered copy revalidates too
+    assert client.patch("/packing/list-1/items", json=TOGGLE).status_code == 200
+    buffered = _revalidate(client, path, tag)
+    assert buffered.status_code == 200
+    assert buffered.json()["packing_list"]["categories"][0]["items"][0]["packed"] is True
+    assert _revalidate(client, path, buffered.headers["ETag"]).status_code == 304
+
+    # once written back the stored version is served, with its own tag
+    asyncio.run(packing.packing_buffer.flush("list-1"))
+    stored = _revalidate(client, path, buffered.headers["ETag"])
+    assert stored.status_code == 200
+    assert stored.json() == buffered.json()
+    assert _revalidate(client, path, stored.headers["ETag"]).status_code == 304
+
+
+@pytest.mark.parametrize("ttl_seconds", [0, 30], ids=["built on every load", "snapshot"])
+def test_dashboard_revalidates_until_a_write(monkeypatch, ttl_seconds):
+    database = _database(DashboardSnapshots(TRIP_KEY, ttl_seconds=ttl_seconds))
+    client = _client(monkeypatch, database)
+    tag = client.get("/dashboard/").headers["ETag"]
+
+    assert _revalidate(client, "/dashboard/", tag).status_code == 304
+    # another projection is another response
+    assert _revalidate(client, "/dashboard/?fields=city", tag).status_code == 200
+
+    database.update_packing_list("list-1", json.dumps(PACKING_LIST), 1, 1, "u1")
+    changed = _revalidate(client, "/dashboard/", tag)
+    assert changed.status_code == 200
+    assert changed.json()["trips"][0]["packing_progress"]["progress"] == 100.0
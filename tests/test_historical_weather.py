@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from app.core.database import Database, Forbidden, NotFound, SQLiteBackend
+
+
+def _record(date, avg_temp):
+    return {"date": date, "year": int(date[:4]), "min_temp": avg_temp - 2, "max_temp": avg_temp + 2,
+            "avg_temp": avg_temp, "uv_index": 1, "descriptions": ["Snow"]}
+
+
+@pytest.fixture
+def database():
+    database = Database(SQLiteBackend(":memory:"))
+    for trip_id, start_date, end_date in [("new-year", "2026-12-30", "2027-01-02"), ("empty", "2026-06-01", "2026-06-02"),
+                                          ("none", "2026-07-01", "2026-07-01")]:
+        database.insert_trip({"trip_id": trip_id, "user_id": "u1", "city": "Oslo", "country": "Norway",
+                              "start_date": start_date, "end_date": end_date, "luggage_type": "carry-on",
+                              "trip_purpose": "leisure"})
+    # every trip day in two past years, stored in date order
+    records = [_record(f"{year}-{day}", temp) for year in (2024, 2025)
+               for day, temp in [("01-01", -3), ("01-02", -4), ("12-30", -1), ("12-31", -2)]]
+    database.insert_historical_weather("new-year", json.dumps(records))
+    database.insert_historical_weather("empty", "[]")
+    return database
+
+
+def test_trip_days_are_listed_in_trip_order(database):
+    rows = database.get_historical_weather_view("new-year", "u1", ["avg_temp"], aggregate="day")
+    assert [(row["day"], row["years"], row["avg_temp"]) for row in rows] == [
+        ("12-30", 2, -1), ("12-31", 2, -2), ("01-01", 2, -3), ("01-02", 2, -4)]
+
+
+def test_years_and_fields(database):
+    rows = database.get_historical_weather_view("new-year", "u1", ["avg_temp"], aggregate="year", years=1)
+    assert rows == [{"year": 2025, "days": 4, "avg_temp": -2.5}]
+    rows = database.get_historical_weather_view("new-year", "u1", ["date", "max_temp"])
+    assert rows[0] == {"date": "2024-01-01", "max_temp": -1}
+
+
+def test_empty_views_are_told_apart_without_reading_the_stored_json(database, monkeypatch):
+    statements = []
+    query = database.backend.query
+    monkeypatch.setattr(database.backend, "query", lambda sql, params=None: statements.append(sql) or query(sql, params))
+
+    assert database.get_historical_weather_view("empty", "u1", ["date"]) == []
+    assert database.get_historical_weather_view("none", "u1", ["date"]) is None
+    assert len(statements) == 4
+    assert not any("historical_stats" in sql and "json_each" not in sql for sql in statements)
+
+    with pytest.raises(Forbidden):
+        database.get_historical_weather_view("empty", "u2", ["date"])
+    with pytest.raises(NotFound):
+        database.get_historical_weather_view("missing", "u1", ["date"])
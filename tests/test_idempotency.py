@@ -0,0 +1,179 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.api import packing, trips
+from app.api.auth import get_current_user
+from app.core import idempotency
+from app.core.database import AsyncDatabase, Database, SQLiteBackend, get_async_db
+from app.core.idempotency import IdempotencyStore, MemoryIdempotencyBackend
+
+TRIP = {"city": "Oslo", "country": "Norway", "start_date": "2026-12-30", "end_date": "2027-01-02",
+        "luggage_type": "hand", "trip_purpose": "vacation"}
+
+
+def _store(**kwargs):
+    return IdempotencyStore(MemoryIdempotencyBackend(100, 60), **kwargs)
+
+
+def test_a_completed_request_is_replayed():
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return {"trip_id": f"trip-{len(calls)}"}
+
+    async def scenario():
+        store = _store()
+        first = await store.run("u1:create_trip", "key-1", TRIP, handler)
+        replay = await store.run("u1:create_trip", "key-1", TRIP, handler)
+        # keys are scoped, another user's request with the same key runs
+        other = await store.run("u2:create_trip", "key-1", TRIP, handler)
+        return first, replay, other
+
+    first, replay, other = asyncio.run(scenario())
+
+    assert first == {"trip_id": "trip-1"}
+    assert replay.body == b'{"trip_id":"trip-1"}'
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert other == {"trip_id": "trip-2"}
+    assert len(calls) == 2
+
+
+def test_a_key_reused_for_another_request_is_refused():
+    async def handler():
+        return {"ok": True}
+
+    async def scenario():
+        store = _store()
+        await store.run("u1:create_trip", "key-1", TRIP, handler)
+        await store.run("u1:create_trip", "key-1", {**TRIP, "city": "Bergen"}, handler)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(scenario())
+    assert error.value.status_code == 422
+
+
+def test_a_duplicate_waits_for_the_running_request():
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return {"trip_id": "trip-1"}
+
+    async def scenario():
+        store = _store(wait_seconds=5)
+        first = asyncio.ensure_future(store.run("u1:create_trip", "key-1", TRIP, handler))
+        await asyncio.sleep(0.05)
+        duplicate = await store.run("u1:create_trip", "key-1", TRIP, handler)
+        return await first, duplicate
+
+    first, duplicate = asyncio.run(scenario())
+
+    assert first == {"trip_id": "trip-1"}
+    assert duplicate.headers["idempotent-replayed"] == "true"
+    assert len(calls) == 1
+
+
+def test_a_duplicate_gives_up_after_the_wait():
+    async def handler():
+        await asyncio.sleep(0.5)
+        return {"trip_id": "trip-1"}
+
+    async def scenario():
+        store = _store(wait_seconds=0.15)
+        first = asyncio.ensure_future(store.run("u1:create_trip", "key-1", TRIP, handler))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        try:
+            await store.run("u1:create_trip", "key-1", TRIP, handler)
+        except HTTPException as e:
+            return e, time.monotonic() - started, await first
+
+    error, waited, first = asyncio.run(scenario())
+
+    assert error.status_code == 409
+    assert waited >= 0.1
+    assert first == {"trip_id": "trip-1"}
+
+
+def test_a_failed_request_releases_its_key():
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        if len(calls) == 1:
+            raise HTTPException(status_code=500, detail="weather API down")
+        return {"trip_id": "trip-1"}
+
+    async def scenario():
+        store = _store()
+        with pytest.raises(HTTPException):
+            await store.run("u1:create_trip", "key-1", TRIP, handler)
+        # not stored, the retry runs the request again
+        return await store.run("u1:create_trip", "key-1", TRIP, handler)
+
+    assert asyncio.run(scenario()) == {"trip_id": "trip-1"}
+    assert len(calls) == 2
+
+
+class FakePredictor:
+    calls = 0
+
+    def __init__(self, api_key):
+        pass
+
+    def predict_trip_weather(self, city, start_date, end_date):
+        FakePredictor.calls += 1
+        return {"predicted_min_temp": -5, "predicted_max_temp": 2, "predicted_uv_index": 1,
+                "predicted_description": "Snow", "confidence_score": 0.8, "historical_data": []}
+
+
+class SlowTripDatabase(Database):
+    def insert_trip(self, row):
+        time.sleep(0.3)
+        return super().insert_trip(row)
+
+
+def _client(monkeypatch, database, timeout_seconds=5):
+    FakePredictor.calls = 0
+    monkeypatch.setattr(trips, "WeatherPredictor", FakePredictor)
+    monkeypatch.setattr(idempotency, "idempotency", _store())
+    app = FastAPI()
+    app.include_router(trips.router, prefix="/trips")
+    app.include_router(packing.router, prefix="/packing")
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database, timeout_seconds=timeout_seconds)
+    return TestClient(app)
+
+
+def test_create_trip_is_replayed_for_the_same_key(monkeypatch):
+    database = Database(SQLiteBackend(":memory:"))
+    client = _client(monkeypatch, database)
+
+    first = client.post("/trips/", json=TRIP, headers={"Idempotency-Key": "key-1"})
+    retry = client.post("/trips/", json=TRIP, headers={"Idempotency-Key": "key-1"})
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert FakePredictor.calls == 1
+    assert len(database.list_all_trips("u1")) == 1
+
+
+def test_errors_raised_while_creating_keep_their_status(monkeypatch):
+    client = _client(monkeypatch, SlowTripDatabase(SQLiteBackend(":memory:")), timeout_seconds=0.05)
+
+    # the database timeout stays a 504 rather than turning into a 500
+    response = client.post("/trips/", json=TRIP, headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 504
+    # and the key was released, the retry runs again
+    assert client.post("/trips/", json=TRIP, headers={"Idempotency-Key": "key-1"}).status_code == 504
+    assert FakePredictor.calls == 2
+
+    # an unknown trip stays a 404
+    assert client.post("/packing/generate/missing").status_code == 404
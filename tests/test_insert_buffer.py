@@ -0,0 +1,88 @@
+import importlib
+import os
+
+from app.core import insert_buffer
+from app.core.insert_buffer import InsertBuffer, WriteAheadLog
+
+
+def test_buffer_is_opt_in(monkeypatch):
+    monkeypatch.delenv("INSERT_BUFFER_ENABLED", raising=False)
+    try:
+        assert importlib.reload(insert_buffer).create_insert_buffer(lambda *args: None) is None
+    finally:
+        monkeypatch.undo()
+        importlib.reload(insert_buffer)
+
+
+def _segments(wal):
+    return sorted(name for name in os.listdir(wal.directory) if name.startswith("segment-"))
+
+
+def test_workers_sharing_a_directory_keep_their_own_logs(tmp_path):
+    running = InsertBuffer(lambda *args: None, wal_dir=str(tmp_path), max_delay_seconds=60)
+    running.add("user_trips", [{"trip_id": "t1"}], tags=["trip:t1"])
+
+    starting = WriteAheadLog(str(tmp_path))
+    # the running worker's rows are neither replayed nor deleted by the new one
+    assert starting.replay() == []
+    starting.delete_closed()
+    segments = _segments(running._wal)
+    assert len(segments) == 1
+    with open(os.path.join(running._wal.directory, segments[0])) as f:
+        assert '"trip_id":"t1"' in f.read()
+
+    starting.close()
+    running.close()
+
+
+def test_logs_of_an_exited_worker_are_replayed_once(tmp_path):
+    writes = []
+    crashed = WriteAheadLog(str(tmp_path))
+    crashed.append("user_trips", [insert_buffer._QueuedRow("row-1", {"trip_id": "t1"}, ["trip:t1"])])
+    # the process dies: its lock is released, its segments stay behind
+    crashed._file.close()
+    crashed._lock_file.close()
+
+    buffer = InsertBuffer(lambda table, rows, row_ids: writes.append((table, row_ids)),
+                          wal_dir=str(tmp_path), max_delay_seconds=60)
+    buffer.start()
+    other = WriteAheadLog(str(tmp_path))
+    assert other.replay() == []
+    assert buffer.flush()
+    buffer.close()
+    other.close()
+
+    assert writes == [("user_trips", ["row-1"])]
+    # everything was written, nothing is left to replay
+    assert os.listdir(tmp_path) == []
+
+
+def test_reads_leave_a_failed_write_to_the_backoff(monkeypatch):
+    attempts = []
+    fail = [True]
+
+    def write(table, rows, row_ids):
+        attempts.append(row_ids)
+        if fail[0]:
+            raise RuntimeError("quota exceeded")
+
+    buffer = InsertBuffer(write, wal_dir=None, max_delay_seconds=60)
+    try:
+        buffer.add("trips", [{"trip_id": "t1"}], ["trip:t1"])
+        buffer.flush_pending(["trip:t1"])
+        assert len(attempts) == 1
+
+        # backing off, reads go ahead without retrying the write
+        for _ in range(3):
+            buffer.flush_pending(["trip:t1"])
+        assert len(attempts) == 1
+        assert buffer.has_pending(["trip:t1"])
+
+        # once the backoff is over a read writes the rows again
+        fail[0] = False
+        monkeypatch.setattr(buffer, "_retry_at", 0.0)
+        buffer.flush_pending(["trip:t1"])
+        assert len(attempts) == 2
+        assert not buffer.has_pending(["trip:t1"])
+    finally:
+        buffer.close()
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.api import auth
+from app.core import tokens
+from app.core.cache import TTLCache
+from app.core.database import get_async_db
+from app.core.tokens import RevocationList
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.lookups = 0
+
+    async def get_user(self, user_id):
+        self.lookups += 1
+        return {"id": user_id, "username": "ana"}
+
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(tokens, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(auth, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(tokens, "revocations", RevocationList())
+    monkeypatch.setattr(auth, "verified_users", TTLCache(100, 60))
+    return FakeDatabase()
+
+
+@pytest.fixture
+def client(database):
+    app = FastAPI()
+    app.include_router(auth.router, prefix="/auth")
+    app.dependency_overrides[get_async_db] = lambda: database
+
+    @app.get("/me")
+    async def me(user_id: str = Depends(auth.get_current_user)):
+        return {"user_id": user_id}
+
+    return TestClient(app)
+
+
+def legacy_token(user_id):
+    # what tokens looked like before they carried a type and a jti
+    return jwt.encode({"sub": user_id, "exp": int(time.time()) + 900}, "test-secret", algorithm=tokens.ALGORITHM)
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_legacy_tokens_are_verified_once_then_cached(client, database):
+    token = legacy_token("user-1")
+    for _ in range(3):
+        assert client.get("/me", headers=bearer(token)).json() == {"user_id": "user-1"}
+    assert database.lookups == 1
+
+
+def test_logout_with_a_legacy_token_revokes_the_users_tokens(client, database):
+    token = legacy_token("user-1")
+    assert client.get("/me", headers=bearer(token)).status_code == 200
+
+    assert client.post("/auth/logout", headers=bearer(token)).status_code == 200
+    assert client.get("/me", headers=bearer(token)).status_code == 401
+    assert client.get("/me", headers=bearer(legacy_token("user-1"))).status_code == 401
+    # other users and tokens issued after the logout are unaffected
+    assert client.get("/me", headers=bearer(legacy_token("user-2"))).status_code == 200
+    assert client.get("/me", headers=bearer(tokens.create_access_token("user-1"))).status_code == 200
+
+
+def test_a_cached_verification_doesnt_outlive_a_revocation(client, database):
+    token = legacy_token("user-1")
+    assert client.get("/me", headers=bearer(token)).status_code == 200
+
+    # revoked by another path, the cached verification is still there
+    tokens.revoke_all_tokens("user-1")
+    assert client.get("/me", headers=bearer(token)).status_code == 401
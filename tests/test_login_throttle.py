@@ -0,0 +1,139 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import auth
+from app.core import throttle, tokens
+from app.core.database import get_async_db
+from app.core.throttle import SlidingWindowCounter
+
+USERS = {f"user{i}": {"id": f"id-{i}", "username": f"user{i}", "password": "hash"} for i in range(50)}
+
+
+class FakeDatabase:
+    async def get_user_credentials(self, username):
+        return USERS.get(username)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(throttle.time, "time", lambda: now[0])
+    return now
+
+
+def test_counter_rejects_a_key_at_the_limit(clock):
+    counter = SlidingWindowCounter(5, 900, 1000)
+    for _ in range(4):
+        counter.hit("user1")
+    assert counter.retry_after("user1") is None
+
+    counter.hit("user1")
+    assert 0 < counter.retry_after("user1") <= 900
+    # other keys are unaffected
+    assert counter.retry_after("user2") is None
+
+
+def test_reset_clears_the_key(clock):
+    counter = SlidingWindowCounter(5, 900, 1000)
+    for _ in range(5):
+        counter.hit("user1")
+    counter.reset("user1")
+    assert counter.retry_after("user1") is None
+
+
+def test_previous_window_is_weighted_by_its_overlap(clock):
+    counter = SlidingWindowCounter(5, 900, 1000)
+    for _ in range(5):
+        counter.hit("user1")
+
+    # halfway through the next window half of the old failures still count
+    clock[0] += 900 + 450
+    assert counter.retry_after("user1") is None
+    for _ in range(2):
+        counter.hit("user1")
+    assert counter.retry_after("user1") is None
+    counter.hit("user1")
+    assert counter.retry_after("user1") is not None
+
+    # two windows later everything has expired
+    clock[0] += 1800
+    assert counter.retry_after("user1") is None
+
+
+def test_key_count_is_capped(clock):
+    counter = SlidingWindowCounter(5, 900, 100)
+    for i in range(1000):
+        counter.hit(f"10.0.{i // 256}.{i % 256}")
+    assert len(counter) == 100
+
+
+@pytest.fixture
+def bcrypt_calls(monkeypatch):
+    calls = []
+
+    async def verify_password(password, hashed):
+        calls.append(password)
+        return password == "right", None
+
+    monkeypatch.setattr(auth, "verify_password", verify_password)
+    return calls
+
+
+@pytest.fixture
+def client(monkeypatch, bcrypt_calls):
+    monkeypatch.setattr(tokens, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(auth, "TRUST_PROXY_HEADERS", True)
+    monkeypatch.setattr(auth, "username_failures", SlidingWindowCounter(5, 900, 1000))
+    monkeypatch.setattr(auth, "ip_failures", SlidingWindowCounter(20, 900, 1000))
+    app = FastAPI()
+    app.include_router(auth.router, prefix="/auth")
+    app.dependency_overrides[get_async_db] = FakeDatabase
+    return TestClient(app)
+
+
+def login(client, username, password, ip):
+    return client.post("/auth/token", data={"username": username, "password": password},
+                       headers={"X-Forwarded-For": ip})
+
+
+def test_failures_lock_out_the_username_from_every_ip(client, bcrypt_calls):
+    for i in range(5):
+        assert login(client, "user1", "wrong", f"10.0.0.{i}").status_code == 401
+
+    response = login(client, "user1", "right", "10.0.1.1")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    # the rejected attempt never reached bcrypt
+    assert len(bcrypt_calls) == 5
+    # other accounts are unaffected
+    assert login(client, "user2", "right", "10.0.0.1").status_code == 200
+
+
+def test_failures_lock_out_the_ip_for_every_username(client):
+    for i in range(20):
+        assert login(client, f"user{i}", "wrong", "10.0.0.1").status_code == 401
+
+    assert login(client, "user30", "right", "10.0.0.1").status_code == 429
+    assert login(client, "user30", "right", "10.0.0.2").status_code == 200
+
+
+def test_a_successful_login_clears_the_username_failures(client):
+    for _ in range(4):
+        login(client, "user1", "wrong", "10.0.0.1")
+    assert login(client, "user1", "right", "10.0.0.1").status_code == 200
+    for _ in range(4):
+        assert login(client, "user1", "wrong", "10.0.0.1").status_code == 401
+
+
+def test_credential_stuffing_burst_is_bounded(client, bcrypt_calls):
+    # 500 guesses spread over 50 accounts from 10 addresses, unknown usernames included
+    statuses = []
+    for attempt in range(500):
+        username = f"user{attempt % 60}"
+        statuses.append(login(client, username, f"guess{attempt}", f"10.0.0.{attempt % 10}").status_code)
+
+    # each address gets 20 failures before it is locked out, so bcrypt runs at most 200 times
+    assert statuses.count(401) <= 200
+    assert len(bcrypt_calls) <= 200
+    assert statuses.count(429) == 500 - statuses.count(401)
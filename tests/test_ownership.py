@@ -0,0 +1,101 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import packing, trips
+from app.api.auth import get_current_user
+from app.core.database import AsyncDatabase, Database, SQLiteBackend, get_async_db
+from app.services.packing_list_buffer import PackingListBuffer
+
+PACKING_LIST = {"categories": [{"category_name": "Clothes", "items": [{"name": "Socks", "packed": False}]}]}
+TRIP = {"city": "Oslo", "country": "Norway", "start_date": "2026-12-30", "end_date": "2027-01-02",
+        "luggage_type": "hand", "trip_purpose": "vacation"}
+
+# (method, path with {trip} or {list}, body), each tried on the user's own, another user's and an unknown id
+ROUTES = [
+    ("GET", "/trips/{trip}", None),
+    ("GET", "/trips/weather/{trip}", None),
+    ("GET", "/trips/weather/historical/{trip}", None),
+    ("PUT", "/trips/update/{trip}", TRIP),
+    ("DELETE", "/trips/delete/{trip}", None),
+    ("GET", "/packing/list?list_id={list}", None),
+    ("GET", "/packing/progress/{list}", None),
+    ("PUT", "/packing/{list}", {"packing_list": PACKING_LIST}),
+    ("PATCH", "/packing/{list}/items", {"operations": [{"op": "toggle_packed", "category_name": "Clothes",
+                                                        "item_name": "Socks"}]}),
+    ("DELETE", "/packing/{list}", None),
+]
+
+
+class FakePredictor:
+    def __init__(self, api_key):
+        pass
+
+    def predict_trip_weather(self, city, start_date, end_date):
+        return {"predicted_min_temp": -5, "predicted_max_temp": 2, "predicted_uv_index": 1,
+                "predicted_description": "Snow", "confidence_score": 0.8, "historical_data": []}
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = Database(SQLiteBackend(":memory:"))
+    for trip_id, user_id in [("trip-mine", "u1"), ("trip-theirs", "u2"), ("trip-deleted", "u1")]:
+        database.insert_trip({**TRIP, "trip_id": trip_id, "user_id": user_id})
+        database.insert_trip_weather({"trip_id": trip_id, "min_temp": -5, "max_temp": 2, "uv": 1,
+                                      "description": "Snow", "confidence": 0.8})
+        database.insert_historical_weather(trip_id, "[]")
+        database.insert_packing_list({"list_id": trip_id.replace("trip", "list"), "trip_id": trip_id,
+                                      "packing_list": json.dumps(PACKING_LIST), "total_items": 1, "packed_items": 0})
+    database.delete_trip("trip-deleted", "u1")
+
+    monkeypatch.setattr(packing, "db", database)
+    buffer = PackingListBuffer(packing.write_packing_list, debounce_seconds=60, max_delay_seconds=60)
+    monkeypatch.setattr(packing, "packing_buffer", buffer)
+    monkeypatch.setattr(trips, "packing_buffer", buffer)
+    monkeypatch.setattr(trips, "WeatherPredictor", FakePredictor)
+    return database
+
+
+@pytest.fixture
+def client(database):
+    app = FastAPI()
+    app.include_router(trips.router, prefix="/trips")
+    app.include_router(packing.router, prefix="/packing")
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+    return TestClient(app)
+
+
+def _call(client, method, path, body, name):
+    return client.request(method, path.format(trip=f"trip-{name}", list=f"list-{name}"), json=body)
+
+
+@pytest.mark.parametrize("method,path,body", ROUTES)
+def test_unknown_and_deleted_ids_are_404_and_other_users_ids_403(client, method, path, body):
+    assert _call(client, method, path, body, "missing").status_code == 404
+    # a deleted trip and its lists are gone, not someone else's
+    assert _call(client, method, path, body, "deleted").status_code == 404
+    assert _call(client, method, path, body, "theirs").status_code == 403
+    assert _call(client, method, path, body, "mine").status_code == 200
+
+
+@pytest.mark.parametrize("method,path,body", [route for route in ROUTES if route[0] != "GET"])
+def test_refused_writes_change_nothing(client, database, method, path, body):
+    assert _call(client, method, path, body, "theirs").status_code == 403
+
+    assert database.get_trip("trip-theirs", "u2")["city"] == "Oslo"
+    assert json.loads(database.get_packing_list("list-theirs", "u2")["packing_list"]) == PACKING_LIST
+    assert packing.packing_buffer.get("list-theirs") is None
+
+
+def test_owned_reads_cost_a_single_statement(client, database, monkeypatch):
+    statements = []
+    query = database.backend.query
+    monkeypatch.setattr(database.backend, "query", lambda sql, params=None: statements.append(sql) or query(sql, params))
+
+    for path in ["/trips/weather/trip-mine", "/trips/weather/historical/trip-theirs", "/packing/progress/list-missing"]:
+        statements.clear()
+        client.get(path)
+        assert len(statements) == 1, path
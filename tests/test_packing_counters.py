@@ -0,0 +1,91 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import packing
+from app.api.auth import get_current_user
+from app.core.database import AsyncDatabase, Database, SQLiteBackend, get_async_db
+from app.services import backfill_packing_counters
+
+
+def _packing_list(*packed):
+    return {"categories": [{"category_name": "Clothes",
+                            "items": [{"name": f"item-{i}", "packed": value} for i, value in enumerate(packed)]}]}
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = Database(SQLiteBackend(":memory:"))
+    for trip_id, user_id in [("trip-1", "u1"), ("trip-2", "u1"), ("trip-other", "u2")]:
+        database.insert_trip({"trip_id": trip_id, "user_id": user_id, "city": "Oslo", "country": "Norway",
+                              "start_date": "2026-12-30", "end_date": "2027-01-02", "luggage_type": "carry-on",
+                              "trip_purpose": "leisure"})
+    monkeypatch.setattr(packing, "db", database)
+    monkeypatch.setattr(backfill_packing_counters, "db", database)
+    return database
+
+
+@pytest.fixture
+def client(database):
+    app = FastAPI()
+    app.include_router(packing.router, prefix="/packing")
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+    return TestClient(app)
+
+
+def _insert(database, list_id, trip_id, packing_list, counters=True):
+    row = {"list_id": list_id, "trip_id": trip_id, "packing_list": json.dumps(packing_list)}
+    if counters:
+        row["total_items"], row["packed_items"] = packing.count_packing_items(packing_list)
+    database.insert_packing_list(row)
+
+
+def test_progress_is_served_from_the_counters(client, database):
+    _insert(database, "list-1", "trip-1", _packing_list(True, False, False, False))
+    _insert(database, "list-2", "trip-1", _packing_list(True, True))
+    _insert(database, "list-3", "trip-2", _packing_list())
+
+    assert client.get("/packing/progress/list-1").json() == {"total_items": 4, "packed_items": 1, "progress": 25.0}
+    assert client.get("/packing/progress/trip/trip-1").json() == {
+        "trip_id": "trip-1", "total_items": 6, "packed_items": 3, "progress": 50.0, "lists_count": 2}
+    # lists without items are left out of the average
+    assert client.get("/packing/progress/all").json() == {"average_progress": 62.5}
+
+
+def test_writes_keep_the_counters_in_step(client, database):
+    _insert(database, "list-1", "trip-1", _packing_list(False, False))
+
+    response = client.put("/packing/list-1", json={"packing_list": _packing_list(True, True, False)})
+    assert response.status_code == 200
+    assert database.get_packing_counters("list-1", "u1") == {"total_items": 3, "packed_items": 2}
+    assert client.get("/packing/progress/list-1").json()["progress"] == 66.67
+
+
+def test_unknown_and_foreign_lists_and_trips(client, database):
+    _insert(database, "list-other", "trip-other", _packing_list(True))
+
+    assert client.get("/packing/progress/missing").status_code == 404
+    assert client.get("/packing/progress/list-other").status_code == 403
+    assert client.get("/packing/progress/trip/trip-other").status_code == 404
+
+
+def test_backfill_fills_only_missing_counters(database):
+    _insert(database, "list-1", "trip-1", _packing_list(True, False), counters=False)
+    _insert(database, "list-2", "trip-1", _packing_list(True), counters=False)
+    database.insert_packing_list({"list_id": "list-bad", "trip_id": "trip-2", "packing_list": "{not json"})
+    # already counted, the backfill must leave it alone
+    database.insert_packing_list({"list_id": "list-3", "trip_id": "trip-2",
+                                  "packing_list": json.dumps(_packing_list(True)), "total_items": 7, "packed_items": 7})
+
+    assert backfill_packing_counters.backfill_packing_counters() == 3
+    assert database.get_packing_counters("list-1", "u1") == {"total_items": 2, "packed_items": 1}
+    assert database.get_packing_counters("list-2", "u1") == {"total_items": 1, "packed_items": 1}
+    # invalid lists count as empty so they aren't picked up again
+    assert database.get_packing_counters("list-bad", "u1") == {"total_items": 0, "packed_items": 0}
+    assert database.get_packing_counters("list-3", "u1") == {"total_items": 7, "packed_items": 7}
+
+    # safe to re-run
+    assert backfill_packing_counters.backfill_packing_counters() == 0
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api import packing, trips
+from app.api.auth import get_current_user
+from app.core.database import AsyncDatabase, Database, SQLiteBackend, get_async_db
+from app.services.packing_list_buffer import PackingListBuffer
+
+PACKING_LIST = {"categories": [{"category_name": "Clothes", "items": [{"name": "Socks", "packed": False}]}]}
+TOGGLE = [{"op": "toggle_packed", "category_name": "Clothes", "item_name": "Socks"}]
+
+
+def test_failed_flushes_back_off_past_the_max_delay():
+    attempts = []
+
+    def failing_write(list_id, packing_list):
+        attempts.append(time.monotonic())
+        raise RuntimeError("quota exceeded")
+
+    async def scenario():
+        buffer = PackingListBuffer(failing_write, debounce_seconds=0.01, max_delay_seconds=0.02,
+                                   retry_base_seconds=0.05, retry_max_seconds=0.2)
+        buffer.hold("list-1", "user-1", PACKING_LIST)
+        buffer.apply("list-1", TOGGLE)
+        await asyncio.sleep(0.8)
+        # an edit during the backoff doesn't bring the retry forward
+        buffer.apply("list-1", TOGGLE)
+        await asyncio.sleep(0.1)
+        entry = buffer.get("list-1")
+        buffer.discard("list-1")
+        return entry
+
+    entry = asyncio.run(scenario())
+
+    # 0.01 + 0.05 + 0.1 + 0.2 + 0.2 + 0.2 ... instead of retrying in a tight loop
+    assert 4 <= len(attempts) <= 7
+    gaps = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+    assert all(gap >= 0.045 for gap in gaps)
+    assert entry.dirty and entry.failures == len(attempts)
+
+
+def test_successful_flush_resets_the_backoff():
+    writes = []
+    fail = [True]
+
+    def flaky_write(list_id, packing_list):
+        if fail[0]:
+            fail[0] = False
+            raise RuntimeError("streaming buffer")
+        writes.append(packing_list)
+
+    async def scenario():
+        buffer = PackingListBuffer(flaky_write, debounce_seconds=0.01, max_delay_seconds=0.05,
+                                   retry_base_seconds=0.05)
+        buffer.hold("list-1", "user-1", PACKING_LIST)
+        buffer.apply("list-1", TOGGLE)
+        await asyncio.sleep(0.2)
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    assert len(writes) == 1
+    assert writes[0]["categories"][0]["items"][0]["packed"] is True
+    # written back, reads go to storage again
+    assert buffer.get("list-1") is None
+
+
+def _items(packing_list):
+    return {item["name"]: item["packed"] for item in packing_list["categories"][0]["items"]}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    database = Database(SQLiteBackend(":memory:"))
+    database.insert_trip({"trip_id": "trip-1", "user_id": "user-1", "city": "Oslo", "country": "Norway",
+                          "start_date": "2026-12-30", "end_date": "2027-01-02", "luggage_type": "carry-on",
+                          "trip_purpose": "leisure"})
+    database.insert_packing_list({"list_id": "list-1", "trip_id": "trip-1", "packing_list": json.dumps(PACKING_LIST),
+                                  "total_items": 1, "packed_items": 0})
+    monkeypatch.setattr(packing, "db", database)
+    buffer = PackingListBuffer(packing.write_packing_list, debounce_seconds=60, max_delay_seconds=60)
+    monkeypatch.setattr(packing, "packing_buffer", buffer)
+    monkeypatch.setattr(trips, "packing_buffer", buffer)
+
+    app = FastAPI()
+    app.include_router(packing.router, prefix="/packing")
+    app.include_router(trips.router, prefix="/trips")
+    app.dependency_overrides[get_current_user] = lambda: "user-1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+    app.state.database = database
+    app.state.buffer = buffer
+    return app
+
+
+def test_item_edits_sent_during_a_replace_apply_to_the_new_list(app, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    write_packing_list = packing.write_packing_list
+
+    def slow_write(*args):
+        started.set()
+        release.wait(5)
+        return write_packing_list(*args)
+
+    monkeypatch.setattr(packing, "write_packing_list", slow_write)
+    replacement = {"categories": [{"category_name": "Clothes", "items": [
+        {"name": "Socks", "packed": False}, {"name": "Boots", "packed": False}]}]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # an edit already buffered is superseded by the PUT
+            assert (await client.patch("/packing/list-1/items", json={"operations": TOGGLE})).status_code == 200
+
+            put = asyncio.ensure_future(client.put("/packing/list-1", json={"packing_list": replacement}))
+            await asyncio.to_thread(started.wait, 5)
+            # Boots only exists in the list being written
+            patch = asyncio.ensure_future(client.patch("/packing/list-1/items", json={"operations": [
+                {"op": "toggle_packed", "category_name": "Clothes", "item_name": "Boots"}]}))
+            await asyncio.sleep(0.05)
+            assert not patch.done()
+
+            release.set()
+            assert (await put).status_code == 200
+            response = await patch
+            assert response.status_code == 200
+            assert response.json()["packed_items"] == 1
+
+            await app.state.buffer.flush("list-1")
+
+    asyncio.run(scenario())
+
+    row = app.state.database.get_packing_list("list-1", "user-1")
+    assert _items(json.loads(row["packing_list"])) == {"Socks": False, "Boots": True}
+
+
+def test_a_failed_replace_keeps_the_buffered_edits(app, monkeypatch):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            assert (await client.patch("/packing/list-1/items", json={"operations": TOGGLE})).status_code == 200
+            # someone else's PUT is refused and must not throw the owner's edits away
+            app.dependency_overrides[get_current_user] = lambda: "user-2"
+            assert (await client.put("/packing/list-1", json={"packing_list": PACKING_LIST})).status_code == 403
+
+            entry = app.state.buffer.get("list-1")
+            assert entry is not None and entry.dirty
+            app.state.buffer.discard("list-1")
+
+    asyncio.run(scenario())
+
+
+def test_deleting_a_trip_drops_its_buffered_lists(app):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            assert (await client.patch("/packing/list-1/items", json={"operations": TOGGLE})).status_code == 200
+            assert app.state.buffer.get("list-1") is not None
+
+            assert (await client.delete("/trips/delete/trip-1")).status_code == 200
+            assert app.state.buffer.get("list-1") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+import json
+import sqlite3
+
+import pytest
+
+from app.services.packing_progress import count_packing_items, progress_percent, user_progress_json_query
+
+# every path counts packed == True as packed: true, 1 and 1.0, but not "true" or 2
+PACKING_LISTS = [
+    {"categories": [{"category_name": "Clothes", "items": [
+        {"name": "Socks", "packed": True},
+        {"name": "Shirt", "packed": "true"},
+        {"name": "Hat", "packed": 1},
+        {"name": "Scarf", "packed": 1.0},
+        {"name": "Coat", "packed": False},
+        {"name": "Gloves"},
+    ]}]},
+    {"categories": [
+        {"category_name": "Toiletries", "items": [{"name": "Toothbrush", "packed": True}, "not an item"]},
+        {"category_name": "Broken", "items": "not a list"},
+        "not a category",
+    ]},
+    {"categories": []},
+    {"categories": [{"category_name": "Docs", "items": [
+        {"name": "Passport", "packed": None},
+        {"name": "Visa", "packed": "yes"},
+        {"name": "Map", "packed": 2},
+    ]}]},
+]
+
+
+def test_packed_means_equal_to_true():
+    assert count_packing_items(PACKING_LISTS[0]) == (6, 3)
+    assert count_packing_items(PACKING_LISTS[1]) == (1, 1)
+    assert count_packing_items(PACKING_LISTS[3]) == (3, 0)
+
+
+def _python_progress(packing_lists):
+    percents = []
+    for packing_list in packing_lists:
+        total_items, packed_items = count_packing_items(packing_list)
+        if total_items:
+            percents.append(100.0 * packed_items / total_items)
+    return len(percents), (sum(percents) / len(percents) if percents else None)
+
+
+@pytest.fixture
+def connection():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE user_trips (trip_id TEXT, user_id TEXT, deleted_at TEXT)")
+    connection.execute("CREATE TABLE packing_lists (list_id TEXT, trip_id TEXT, packing_list TEXT)")
+    for index, packing_list in enumerate(PACKING_LISTS):
+        connection.execute("INSERT INTO user_trips VALUES (?, 'user-1', NULL)", (f"trip-{index}",))
+        connection.execute("INSERT INTO packing_lists VALUES (?, ?, ?)",
+                           (f"list-{index}", f"trip-{index}", json.dumps(packing_list)))
+    # invalid JSON counts as an empty list, like a list that fails to parse
+    connection.execute("INSERT INTO user_trips VALUES ('trip-bad', 'user-1', NULL)")
+    connection.execute("INSERT INTO packing_lists VALUES ('list-bad', 'trip-bad', '{not json')")
+    yield connection
+    connection.close()
+
+
+def test_sql_progress_matches_the_counters(connection):
+    sql = user_progress_json_query("packing_lists", "user_trips", dialect="sqlite")
+    list_count, average_progress = connection.execute(sql, {"user_id": "user-1"}).fetchone()
+
+    expected_count, expected_average = _python_progress(PACKING_LISTS)
+    assert list_count == expected_count == 3
+    assert progress_percent(average_progress, 100) == progress_percent(expected_average, 100)
+
+
+def test_bigquery_rule_compares_the_json_text_of_packed():
+    sql = user_progress_json_query("packing_lists", "user_trips", dialect="bigquery")
+    # JSON_VALUE would also match the string "true" (and "1")
+    assert "JSON_QUERY(item, '$.packed') = 'true'" in sql
+    assert "SAFE_CAST(JSON_QUERY(item, '$.packed') AS FLOAT64) = 1" in sql
+    assert "JSON_VALUE(item, '$.packed')" not in sql
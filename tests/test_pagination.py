@@ -0,0 +1,98 @@
+import json
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.api import packing
+from app.api.auth import get_current_user
+from app.api.dashboard import get_user_trips
+from app.core.database import TRIP_COLUMNS, TRIP_KEY, AsyncDatabase, Database, SQLiteBackend, get_async_db
+from app.core.pagination import decode_cursor, encode_cursor, keyset_predicate, parse_fields
+
+# three trips share a start date, so the order between them comes from trip_id alone
+TRIPS = [("trip-c", "2026-11-02"), ("trip-a", "2026-11-02"), ("trip-d", "2026-12-20"), ("trip-b", "2026-11-02"),
+         ("trip-e", "2026-10-01")]
+ORDER = ["trip-e", "trip-a", "trip-b", "trip-c", "trip-d"]
+
+
+@pytest.fixture
+def database():
+    database = Database(SQLiteBackend(":memory:"))
+    for trip_id, start_date in TRIPS:
+        database.insert_trip({"trip_id": trip_id, "user_id": "u1", "city": "Oslo", "country": "Norway",
+                              "start_date": start_date, "end_date": "2027-01-02", "luggage_type": "hand",
+                              "trip_purpose": "vacation"})
+    return database
+
+
+@pytest.mark.parametrize("values", [["2026-11-02", "trip-a"], ["list-1"], [None, "é/+="]])
+def test_cursors_round_trip(values):
+    cursor = encode_cursor(values)
+    # safe in a query string as it is
+    assert all(character.isalnum() or character in "-_" for character in cursor)
+    assert decode_cursor(cursor, len(values)) == values
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor!", encode_cursor(["2026-11-02"]), encode_cursor(["a", "b", "c"]),
+                                    "eyJhIjoxfQ"])
+def test_cursors_we_did_not_issue_are_refused(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, 2)
+    assert error.value.status_code == 400
+
+
+def test_keyset_predicate_breaks_ties_on_the_later_columns():
+    assert keyset_predicate(["start_date", "p.trip_id"]) == (
+        "((start_date > @after_start_date) OR (start_date = @after_start_date AND p.trip_id > @after_trip_id))")
+
+
+def test_parse_fields():
+    assert parse_fields(None, ["list_id", "trip_id"], default=["list_id"]) == ["list_id"]
+    assert parse_fields("trip_id, ", ["list_id", "trip_id"], always=["list_id"]) == ["list_id", "trip_id"]
+    with pytest.raises(HTTPException) as error:
+        parse_fields("trip_id,secret", ["list_id", "trip_id"])
+    assert error.value.status_code == 400
+
+
+def test_trip_pages_neither_skip_nor_repeat_ties(database):
+    seen, after = [], None
+    while True:
+        rows = database.list_trips("u1", ["trip_id"] + TRIP_KEY, 2, after)
+        if not rows:
+            break
+        seen += [row["trip_id"] for row in rows]
+        after = [rows[-1][column] for column in TRIP_KEY]
+    assert seen == ORDER
+
+
+def test_snapshot_pages_order_ties_like_the_query(database):
+    snapshot = {"trips": [{**row, "lists_count": 0, "total_items": 0, "packed_items": 0}
+                          for row in database.list_all_trips("u1")]}
+    seen, cursor = [], None
+    while True:
+        trips, cursor = get_user_trips(snapshot, 2, cursor, "trip_id")
+        seen += [trip["trip_id"] for trip in trips]
+        if cursor is None:
+            break
+    assert seen == ORDER
+    assert [row["trip_id"] for row in database.list_trips("u1", TRIP_COLUMNS, 10)] == ORDER
+
+
+def test_packing_list_pages(database):
+    for list_id in ["list-3", "list-1", "list-2"]:
+        database.insert_packing_list({"list_id": list_id, "trip_id": "trip-a", "packing_list": json.dumps({"categories": []}),
+                                      "total_items": 0, "packed_items": 0})
+    app = FastAPI()
+    app.include_router(packing.router, prefix="/packing")
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+    client = TestClient(app)
+
+    first = client.get("/packing/lists/trip-a", params={"limit": 2}).json()
+    assert first["packing_lists"] == [{"list_id": "list-1"}, {"list_id": "list-2"}]
+    last = client.get("/packing/lists/trip-a", params={"limit": 2, "cursor": first["next_cursor"], "fields": "trip_id"}).json()
+    assert last == {"packing_lists": [{"list_id": "list-3", "trip_id": "trip-a"}], "next_cursor": None}
+
+    assert client.get("/packing/lists/trip-a", params={"cursor": "garbage!"}).status_code == 400
+    assert client.get("/packing/lists/trip-a", params={"limit": 0}).status_code == 422
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import threading
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api import packing, trips
+from app.api.auth import get_current_user
+from app.core.database import AsyncDatabase, Database, SQLiteBackend, get_async_db
+from app.core.progress_events import CLOSED, RESYNC, LocalBroker, format_event
+from app.services.packing_list_buffer import PackingListBuffer
+
+PACKING_LIST = {"categories": [{"category_name": "Clothes", "items": [{"name": "Socks", "packed": False},
+                                                                       {"name": "Hat", "packed": False}]}]}
+
+
+def test_events_reach_every_subscription_of_the_user():
+    async def scenario():
+        broker = LocalBroker()
+        tab_1, tab_2, other_user = broker.subscribe("u1"), broker.subscribe("u1"), broker.subscribe("u2")
+        await broker.publish("u1", "list_deleted", list_id="list-1")
+        # published from a worker thread, as the redis listener does
+        thread = threading.Thread(target=broker.deliver, args=("u1", {"event": "list_deleted", "data": {"list_id": "list-2"}}))
+        thread.start()
+        thread.join()
+
+        received = [[await tab.get(1), await tab.get(1)] for tab in (tab_1, tab_2)]
+        nothing = await other_user.get(0.05)
+
+        broker.unsubscribe(tab_2)
+        await broker.publish("u1", "list_deleted", list_id="list-3")
+        return received, nothing, await tab_2.get(0.05), await tab_1.get(1)
+
+    received, nothing, unsubscribed, still_subscribed = asyncio.run(scenario())
+
+    expected = [{"event": "list_deleted", "data": {"list_id": "list-1"}},
+                {"event": "list_deleted", "data": {"list_id": "list-2"}}]
+    assert received == [expected, expected]
+    assert nothing is None and unsubscribed is None
+    assert still_subscribed["data"] == {"list_id": "list-3"}
+
+
+def test_a_subscriber_that_falls_behind_gets_a_resync():
+    async def scenario():
+        broker = LocalBroker(max_queued=2)
+        subscription = broker.subscribe("u1")
+        for i in range(3):
+            await broker.publish("u1", "list_deleted", list_id=f"list-{i}")
+        await asyncio.sleep(0)
+        return await subscription.get(1), await subscription.get(0.05)
+
+    first, second = asyncio.run(scenario())
+    assert first is RESYNC and second is None
+
+
+def test_events_are_formatted_as_server_sent_events():
+    assert format_event({"event": "list_deleted", "data": {"list_id": "list-1"}}) == \
+        b'event: list_deleted\ndata: {"list_id": "list-1"}\n\n'
+
+
+@pytest.fixture
+def app(monkeypatch):
+    database = Database(SQLiteBackend(":memory:"))
+    database.insert_trip({"trip_id": "trip-1", "user_id": "u1", "city": "Oslo", "country": "Norway",
+                          "start_date": "2026-12-30", "end_date": "2027-01-02", "luggage_type": "hand",
+                          "trip_purpose": "vacation"})
+    database.insert_packing_list({"list_id": "list-1", "trip_id": "trip-1", "packing_list": json.dumps(PACKING_LIST),
+                                  "total_items": 2, "packed_items": 0})
+    monkeypatch.setattr(packing, "db", database)
+    buffer = PackingListBuffer(packing.write_packing_list, debounce_seconds=60, max_delay_seconds=60)
+    monkeypatch.setattr(packing, "packing_buffer", buffer)
+    monkeypatch.setattr(trips, "packing_buffer", buffer)
+    broker = LocalBroker(max_queued=2)
+    monkeypatch.setattr(packing, "progress_events", broker)
+    monkeypatch.setattr(trips, "progress_events", broker)
+
+    app = FastAPI()
+    app.include_router(packing.router, prefix="/packing")
+    app.include_router(trips.router, prefix="/trips")
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+    app.state.database = database
+    app.state.broker = broker
+    return app
+
+
+def _parse(chunk):
+    event, data = chunk.decode("utf-8").strip().split("\n")
+    return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+def test_the_stream_sends_a_snapshot_then_the_writes_then_resyncs(app):
+    broker = app.state.broker
+
+    async def scenario():
+        async_db = AsyncDatabase(app.state.database)
+        # the stream is read straight from the route, the test transport would wait for it to end
+        response = await packing.packing_progress_events("u1", async_db)
+        stream = response.body_iterator
+        chunks = [_parse(await stream.__anext__())]
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            # an edit in another tab
+            toggle = {"operations": [{"op": "toggle_packed", "category_name": "Clothes", "item_name": "Hat"}]}
+            assert (await client.patch("/packing/list-1/items", json=toggle)).status_code == 200
+            chunks.append(_parse(await stream.__anext__()))
+
+            # more writes than the subscription holds: the stream reads everything again
+            for _ in range(3):
+                assert (await client.patch("/packing/list-1/items", json=toggle)).status_code == 200
+            chunks.append(_parse(await stream.__anext__()))
+
+            assert (await client.delete("/trips/delete/trip-1")).status_code == 200
+            chunks.append(_parse(await stream.__anext__()))
+
+        broker.close()
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+        return chunks
+
+    snapshot, updated, resync, deleted = asyncio.run(scenario())
+
+    assert snapshot == ("snapshot", {"lists": [{"list_id": "list-1", "trip_id": "trip-1", "total_items": 2,
+                                                "packed_items": 0, "progress": 0}]})
+    assert updated == ("list_updated", {"list_id": "list-1", "total_items": 2, "packed_items": 1, "progress": 50.0})
+    # toggled three more times, the buffered edits are written back before the counts are read
+    assert resync == ("snapshot", {"lists": [{"list_id": "list-1", "trip_id": "trip-1", "total_items": 2,
+                                              "packed_items": 0, "progress": 0}]})
+    assert deleted == ("trips_deleted", {"trip_ids": ["trip-1"]})
+    # the closed stream let go of its subscription
+    assert broker._subscriptions == {}
@@ -0,0 +1,84 @@
+import pytest
+
+from app.services import migrate_schema
+
+
+class FakeJob:
+    def __init__(self, total_bytes_processed):
+        self.total_bytes_processed = total_bytes_processed
+
+
+class FakeDryRunClient:
+    """Estimates every statement at 1 KB, except those containing one of `costs`' keys."""
+
+    def __init__(self, costs=None, rejected=None):
+        self.costs = costs or {}
+        self.rejected = rejected
+        self.statements = []
+
+    def query(self, sql, job_config):
+        # nothing may actually run, or come from the cache instead of being estimated
+        assert job_config.dry_run and not job_config.use_query_cache
+        self.statements.append(sql)
+        if self.rejected and self.rejected in sql:
+            raise RuntimeError("Unrecognized name: bogus_column")
+        return FakeJob(next((cost for marker, cost in self.costs.items() if marker in sql), 1024))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def install(**kwargs):
+        fake = FakeDryRunClient(**kwargs)
+        monkeypatch.setattr(migrate_schema.DryRunBackend, "client", property(lambda self: fake))
+        return fake
+    return install
+
+
+def _report(capsys):
+    return {line.split()[0]: line for line in capsys.readouterr().out.splitlines()}
+
+
+def test_every_check_is_estimated_within_the_budget(client, capsys):
+    fake = client()
+
+    assert migrate_schema.check_query_bytes(budget=10 * 1024)
+
+    report = _report(capsys)
+    assert set(report) == {name for name, _, _ in migrate_schema.CHECKS}
+    # a check that issued nothing would pass without measuring anything
+    assert all(" 0 statements" not in line for line in report.values())
+    assert all(line.endswith("ok") or line.endswith("full scan by design") for line in report.values())
+    assert len(fake.statements) >= len(migrate_schema.CHECKS)
+
+
+def test_a_query_over_the_budget_fails_the_check(client, capsys):
+    # the JSON counting query reads every packing list
+    client(costs={"JSON_QUERY_ARRAY": 500 * 1024 * 1024})
+
+    assert not migrate_schema.check_query_bytes(budget=100 * 1024 * 1024)
+
+    report = _report(capsys)
+    assert "OVER BUDGET" in report["get_user_packing_progress_json"]
+    assert report["get_user_packing_progress"].endswith("ok")
+
+
+def test_full_scans_by_design_are_only_reported(client, capsys):
+    client(costs={"SELECT username FROM": 500 * 1024 * 1024})
+
+    assert migrate_schema.check_query_bytes(budget=100 * 1024 * 1024)
+    assert "full scan by design" in _report(capsys)["list_usernames"]
+
+
+def test_a_statement_bigquery_rejects_fails_the_check(client, capsys):
+    client(rejected="WITH trip_details AS")
+
+    assert not migrate_schema.check_query_bytes()
+    report = _report(capsys)
+    assert "ERROR Unrecognized name" in report["find_similar_trips"]
+    # the other checks still ran
+    assert report["get_packing_lists_for_trips"].endswith("ok")
+
+
+def test_the_check_needs_bigquery(capsys):
+    # the tests run on the sqlite backend
+    assert migrate_schema.main(["--check-bytes"]) == 2
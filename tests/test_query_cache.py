@@ -0,0 +1,63 @@
+import datetime
+import decimal
+
+from app.core import query_cache
+from app.core.query_cache import MemoryCacheBackend, QueryCache, RedisCacheBackend, create_query_cache, trip_tag, user_tag
+
+
+def test_none_turns_the_cache_off():
+    assert create_query_cache("none") is None
+    assert isinstance(create_query_cache("memory"), QueryCache)
+
+
+def test_a_write_invalidates_the_reads_tagged_with_it():
+    cache = QueryCache(MemoryCacheBackend(100, 60))
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [{"trip_id": "t1", "city": "Oslo"}]
+
+    for _ in range(3):
+        cache.get_or_load("get_trip", "SELECT 1", {"trip_id": "t1"}, [user_tag("u1"), trip_tag("t1")], load)
+    assert len(loads) == 1
+
+    cache.invalidate(trip_tag("t1"))
+    cache.get_or_load("get_trip", "SELECT 1", {"trip_id": "t1"}, [user_tag("u1"), trip_tag("t1")], load)
+    assert len(loads) == 2
+
+
+def test_callers_cannot_change_cached_rows():
+    cache = QueryCache(MemoryCacheBackend(100, 60))
+    rows = cache.get_or_load("get_trip", "SELECT 1", None, ["trip:t1"], lambda: [{"city": "Oslo"}])
+    rows[0]["city"] = "Rome"
+    assert cache.get_or_load("get_trip", "SELECT 1", None, ["trip:t1"], lambda: []) == [{"city": "Oslo"}]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return False
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+
+def test_redis_entries_store_dates_and_decimals(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(query_cache, "get_redis_client", lambda: redis)
+    cache = QueryCache(RedisCacheBackend(60))
+    row = {"trip_id": "t1", "start_date": datetime.date(2026, 12, 30), "avg_temp": decimal.Decimal("-2.5")}
+
+    assert cache.get_or_load("get_trip", "SELECT 1", None, [trip_tag("t1")], lambda: [row]) == [row]
+    # served from redis the values come back as they are sent in responses
+    cached = cache.get_or_load("get_trip", "SELECT 1", None, [trip_tag("t1")], lambda: [])
+    assert cached == [{"trip_id": "t1", "start_date": "2026-12-30", "avg_temp": "-2.5"}]
@@ -0,0 +1,113 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api import auth
+from app.core.database import AsyncDatabase, Database, SQLiteBackend, get_async_db
+
+FORM = {"username": "ana", "password": "secret", "name": "Ana", "age": "30"}
+
+
+@pytest.fixture
+def database():
+    return Database(SQLiteBackend(":memory:"))
+
+
+@pytest.fixture
+def hashing(monkeypatch):
+    """Registrations wait inside the password hash until released, like a busy bcrypt."""
+    state = {"started": None, "release": None}
+
+    async def hash_password(password):
+        state["started"].set()
+        await state["release"].wait()
+        return f"hashed-{password}"
+
+    monkeypatch.setattr(auth, "hash_password", hash_password)
+    monkeypatch.setattr(auth, "taken_usernames", set())
+    monkeypatch.setattr(auth, "pending_usernames", set())
+    return state
+
+
+def _run(database, scenario):
+    app = FastAPI()
+    app.include_router(auth.router, prefix="/auth")
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await scenario(client)
+
+    return asyncio.run(run())
+
+
+def test_a_second_registration_of_a_name_in_progress_is_refused(database, hashing):
+    async def scenario(client):
+        hashing["started"], hashing["release"] = asyncio.Event(), asyncio.Event()
+        first = asyncio.ensure_future(client.post("/auth/register", data=FORM))
+        await hashing["started"].wait()
+
+        # refused from the pending names, without a query or a second hash
+        second = await client.post("/auth/register", data={**FORM, "password": "other"})
+        hashing["release"].set()
+        return await first, second
+
+    first, second = _run(database, scenario)
+
+    assert first.status_code == 200
+    assert second.status_code == 400
+    assert database.get_user_credentials("ana")["password"] == "hashed-secret"
+    assert "ana" in auth.taken_usernames and not auth.pending_usernames
+
+
+def test_a_name_taken_by_another_worker_is_caught_by_the_transaction(database, hashing):
+    async def scenario(client):
+        hashing["started"], hashing["release"] = asyncio.Event(), asyncio.Event()
+        first = asyncio.ensure_future(client.post("/auth/register", data=FORM))
+        await hashing["started"].wait()
+        # another worker registers the name while this one is hashing, this index doesn't know it
+        database.create_user("other-id", "ana", "hashed-other", "Ana B", 40, None)
+        hashing["release"].set()
+        return await first
+
+    response = _run(database, scenario)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already exists"
+    assert database.get_user_credentials("ana")["id"] == "other-id"
+    # remembered, the next attempt is refused without a query
+    assert "ana" in auth.taken_usernames and not auth.pending_usernames
+
+
+def test_a_failed_registration_frees_the_name(database, hashing, monkeypatch):
+    create_user = database.create_user
+    failures = [RuntimeError("quota exceeded")]
+
+    def flaky_create_user(*args):
+        if failures:
+            raise failures.pop()
+        return create_user(*args)
+
+    monkeypatch.setattr(database, "create_user", flaky_create_user)
+
+    async def scenario(client):
+        hashing["started"], hashing["release"] = asyncio.Event(), asyncio.Event()
+        hashing["release"].set()
+        return await client.post("/auth/register", data=FORM), await client.post("/auth/register", data=FORM)
+
+    failed, retried = _run(database, scenario)
+
+    assert failed.status_code == 500
+    assert retried.status_code == 200
+
+
+def test_the_index_is_warmed_from_the_users_table(database, monkeypatch):
+    database.create_user("id-1", "ana", "hash", "Ana", 30, None)
+    database.create_user("id-2", "bo", "hash", "Bo", 31, None)
+    monkeypatch.setattr(auth, "taken_usernames", set())
+    monkeypatch.setattr(auth, "get_async_db", lambda: AsyncDatabase(database))
+
+    asyncio.run(auth.warm_username_index())
+    assert auth.taken_usernames == {"ana", "bo"}
@@ -0,0 +1,72 @@
+import gzip
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.middleware import CompressionMiddleware, accepted_encodings
+from app.core.responses import FastJSONResponse, RawJSON, StreamingJSONResponse, dumps, iter_json
+
+WEATHER = [{"date": f"2024-07-{day:02d}", "min_temp": 14 + day, "descriptions": ["Sunny"] * 24} for day in range(1, 29)]
+
+
+def test_streamed_json_matches_the_encoded_content():
+    content = {"trip_id": "t1", "nested": {"a": [1, {"b": None}]}, "historical_data": WEATHER}
+    chunks = list(iter_json(content, chunk_bytes=512))
+    assert len(chunks) > 1
+    assert json.loads(b"".join(chunks)) == json.loads(dumps(content))
+
+
+def test_raw_json_is_sent_as_it_is():
+    stored = json.dumps(WEATHER)
+    body = b"".join(iter_json({"trip_id": "t1", "historical_data": RawJSON(stored)}))
+    assert json.loads(body) == {"trip_id": "t1", "historical_data": WEATHER}
+
+
+def test_accept_encoding_q_values():
+    assert accepted_encodings("gzip;q=0.5, br, identity;q=0") == {"gzip": 0.5, "br": 1.0, "identity": 0.0}
+
+
+def _client():
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+    @app.get("/small")
+    async def small():
+        return {"trip_id": "t1"}
+
+    @app.get("/large")
+    async def large():
+        return {"historical_data": WEATHER}
+
+    @app.get("/streamed")
+    async def streamed():
+        return StreamingJSONResponse({"historical_data": RawJSON(json.dumps(WEATHER))})
+
+    return TestClient(app)
+
+
+def test_large_bodies_are_gzipped_when_accepted():
+    client = _client()
+    # the test client decodes the body, so read the raw stream to see what was sent
+    with client.stream("GET", "/large", headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(raw)) == {"historical_data": WEATHER}
+    assert len(raw) < len(dumps({"historical_data": WEATHER})) / 4
+
+
+def test_small_bodies_and_clients_without_gzip_are_sent_as_they_are():
+    client = _client()
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"historical_data": WEATHER}
+
+
+def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    client = _client()
+    with client.stream("GET", "/streamed", headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(raw)) == {"historical_data": WEATHER}
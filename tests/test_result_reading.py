@@ -0,0 +1,80 @@
+import pytest
+from google.cloud.bigquery.table import Row
+
+from app.core import database
+from app.core.database import BigQueryBackend, Database, SQLiteBackend
+
+
+class FakeResult:
+    """What job.result() returns: REST pages of rows, or Arrow batches over the Storage Read API."""
+
+    def __init__(self, records, page_size):
+        fields = {name: i for i, name in enumerate(records[0])}
+        self.rows = [Row(tuple(record.values()), fields) for record in records]
+        self.records = records
+        self.page_size = page_size
+        self.storage_client = None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    @property
+    def pages(self):
+        return (self.rows[start:start + self.page_size] for start in range(0, len(self.rows), self.page_size))
+
+    def to_arrow_iterable(self, bqstorage_client):
+        import pyarrow
+        self.storage_client = bqstorage_client
+        return pyarrow.Table.from_pylist(self.records).to_batches(max_chunksize=self.page_size)
+
+
+RECORDS = [{"list_id": f"l{i}", "trip_id": f"t{i}", "total_items": i} for i in range(5)]
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = BigQueryBackend()
+    result = FakeResult(RECORDS, page_size=2)
+    monkeypatch.setattr(backend, "_run", lambda sql, params: result)
+    return backend, result
+
+
+def test_lookups_read_plain_rows(backend):
+    backend, _ = backend
+    rows = backend.query("SELECT 1")
+    assert rows == RECORDS
+    assert all(type(row) is dict for row in rows)
+
+
+def test_bulk_reads_stream_arrow_batches_with_the_storage_client(backend, monkeypatch):
+    # optional, like the Storage Read API client itself
+    pytest.importorskip("pyarrow")
+    backend, result = backend
+    storage_client = object()
+    monkeypatch.setattr(backend, "_storage_client", lambda: storage_client)
+
+    batches = list(backend.query_batches("SELECT 1"))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [row for batch in batches for row in batch] == RECORDS
+    assert result.storage_client is storage_client
+
+
+def test_bulk_reads_page_through_rest_results_without_it(backend, monkeypatch):
+    backend, result = backend
+    monkeypatch.setattr(backend, "_storage_client", lambda: None)
+
+    batches = list(backend.query_batches("SELECT 1"))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [row for batch in batches for row in batch] == RECORDS
+    assert result.storage_client is None
+
+
+def test_scans_are_streamed_in_batches(monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_SCAN_BATCH_ROWS", 2)
+    db = Database(SQLiteBackend(":memory:"))
+    for i in range(5):
+        db.insert_packing_list({"list_id": f"l{i}", "trip_id": "t1", "packing_list": "{}"})
+
+    batches = list(db.backend.query_batches("SELECT list_id FROM packing_lists ORDER BY list_id"))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [row["list_id"] for row in db.list_packing_lists_without_counters()] == [f"l{i}" for i in range(5)]
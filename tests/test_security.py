@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import pytest
+from passlib.context import CryptContext
+
+from app.core import security
+from app.core.security import PasswordHasherBusy, hash_password, verify_password
+
+
+@pytest.fixture(autouse=True)
+def cheap_bcrypt(monkeypatch):
+    # the cost the stored hashes should have, low so the tests stay fast
+    monkeypatch.setattr(security, "pwd_context", CryptContext(
+        schemes=["bcrypt"], deprecated="auto",
+        bcrypt__default_rounds=6, bcrypt__min_rounds=6, bcrypt__max_rounds=6,
+    ))
+
+
+def test_hashes_verify_and_old_costs_are_upgraded():
+    async def scenario():
+        hashed = await hash_password("secret")
+        old_hash = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=4).hash("secret")
+        return hashed, await verify_password("secret", hashed), await verify_password("nope", hashed), \
+            await verify_password("secret", old_hash)
+
+    hashed, valid, invalid, upgraded = asyncio.run(scenario())
+    assert hashed.startswith("$2b$06$")
+    assert valid == (True, None)
+    assert invalid == (False, None)
+    assert upgraded[0] is True and upgraded[1].startswith("$2b$06$")
+
+
+def test_hashing_does_not_block_the_event_loop(monkeypatch):
+    monkeypatch.setattr(security, "pwd_context", CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=10))
+
+    async def scenario():
+        gaps = []
+
+        async def probe():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.005)
+                gaps.append(time.perf_counter() - started)
+
+        task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(hash_password("secret") for _ in range(8)))
+        elapsed = time.perf_counter() - started
+        task.cancel()
+        return gaps, elapsed
+
+    gaps, elapsed = asyncio.run(scenario())
+    # the loop kept running other work throughout, instead of stalling for a whole hash at a time
+    assert len(gaps) > 5
+    assert max(gaps) < elapsed / 2
+
+
+def test_a_full_queue_turns_hashes_away(monkeypatch):
+    monkeypatch.setattr(security, "PASSWORD_HASH_QUEUE_LIMIT", 2)
+
+    async def scenario():
+        return await asyncio.gather(*(hash_password("secret") for _ in range(4)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert sum(isinstance(result, PasswordHasherBusy) for result in results) == 2
+    assert security._pending == 0
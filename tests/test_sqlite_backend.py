@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+
+from app.core import database as database_module
+from app.core.database import Database, DatabaseError, SQLiteBackend, create_backend
+
+
+def _trip(trip_id, user_id="u1"):
+    return {"trip_id": trip_id, "user_id": user_id, "city": "Oslo", "country": "Norway", "start_date": "2026-12-30",
+            "end_date": "2027-01-02", "luggage_type": "hand", "trip_purpose": "vacation"}
+
+
+def test_the_file_is_created_on_first_use_and_kept(tmp_path):
+    path = tmp_path / "packwise.db"
+    backend = SQLiteBackend(str(path))
+    assert not path.exists()
+
+    Database(backend).insert_trip(_trip("trip-1"))
+    backend.close()
+
+    # a new process sees what the last one wrote
+    assert Database(SQLiteBackend(str(path))).get_trip("trip-1")["city"] == "Oslo"
+
+
+def test_files_from_before_a_column_was_declared_are_migrated(tmp_path):
+    path = tmp_path / "packwise.db"
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE packing_lists (list_id TEXT PRIMARY KEY, trip_id TEXT, packing_list TEXT)")
+    connection.execute("INSERT INTO packing_lists VALUES ('list-1', 'trip-1', '{}')")
+    connection.commit()
+    connection.close()
+
+    database = Database(SQLiteBackend(str(path)))
+    database.insert_trip(_trip("trip-1"))
+
+    # the counters added later are there, NULL for the old row
+    assert database.get_packing_counters("list-1", "u1") == {"total_items": None, "packed_items": None}
+
+
+def test_a_failed_transaction_writes_nothing():
+    backend = SQLiteBackend(":memory:")
+    database = Database(backend)
+    database.create_user("id-1", "ana", "hash", "Ana", 30, None)
+
+    with pytest.raises(RuntimeError):
+        with backend.transaction():
+            backend.execute("UPDATE users SET password = @password WHERE id = @user_id",
+                            {"password": "new-hash", "user_id": "id-1"})
+            raise RuntimeError("second statement failed")
+
+    assert database.get_user_credentials("ana")["password"] == "hash"
+
+
+def test_replayed_rows_are_not_written_twice():
+    backend = SQLiteBackend(":memory:")
+    row = _trip("trip-1")
+    backend.insert_rows("trips", [row])
+
+    # a plain insert of an existing key fails, a replay (with row ids) skips it
+    with pytest.raises(DatabaseError):
+        backend.insert_rows("trips", [row])
+    backend.insert_rows("trips", [row, _trip("trip-2")], row_ids=["trip-1", "trip-2"])
+
+    assert backend.query("SELECT trip_id FROM user_trips ORDER BY trip_id") == [{"trip_id": "trip-1"}, {"trip_id": "trip-2"}]
+
+
+def test_bulk_reads_come_in_batches(monkeypatch):
+    monkeypatch.setattr(database_module, "DATABASE_SCAN_BATCH_ROWS", 2)
+    backend = SQLiteBackend(":memory:")
+    backend.insert_rows("trips", [_trip(f"trip-{i}") for i in range(5)])
+
+    batches = list(backend.query_batches("SELECT trip_id FROM user_trips WHERE user_id = @user_id ORDER BY trip_id",
+                                         {"user_id": "u1"}))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_the_backend_is_picked_by_name():
+    assert isinstance(create_backend("sqlite"), SQLiteBackend)
+    with pytest.raises(ValueError):
+        create_backend("postgres")
@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from app.core import tokens
+from app.core.tokens import RevocationList, SharedRevocationList, TokenError
+
+
+@pytest.fixture(autouse=True)
+def secret_key(monkeypatch):
+    monkeypatch.setattr(tokens, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(tokens, "revocations", RevocationList())
+
+
+def _clock(monkeypatch, now):
+    monkeypatch.setattr(tokens.time, "time", lambda: now)
+
+
+def test_login_right_after_revoking_every_token_is_valid(monkeypatch):
+    # whole seconds from now, so the tokens haven't expired when they are decoded
+    second = int(time.time())
+    _clock(monkeypatch, second - 1)
+    old_token = tokens.create_access_token("user-1", "ana")
+
+    # the password change and the login that follows it land in the same second
+    _clock(monkeypatch, second + 0.2)
+    tokens.revoke_all_tokens("user-1")
+    _clock(monkeypatch, second + 0.7)
+    new_token = tokens.create_access_token("user-1", "ana")
+
+    assert tokens.decode_token(new_token, tokens.ACCESS_TOKEN)["sub"] == "user-1"
+    with pytest.raises(TokenError):
+        tokens.decode_token(old_token, tokens.ACCESS_TOKEN)
+
+
+def test_tokens_issued_earlier_in_the_cutoff_second_are_revoked(monkeypatch):
+    second = int(time.time())
+    _clock(monkeypatch, second + 0.1)
+    token = tokens.create_access_token("user-1", "ana")
+    _clock(monkeypatch, second + 0.2)
+    tokens.revoke_all_tokens("user-1")
+
+    with pytest.raises(TokenError):
+        tokens.decode_token(token, tokens.ACCESS_TOKEN)
+    assert not tokens.revocations.is_revoked("jti-2", "user-2", second + 0.1)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+
+def test_revocations_are_shared_between_workers_through_redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(tokens, "get_redis_client", lambda: redis)
+    worker, other_worker = SharedRevocationList(), SharedRevocationList()
+    _clock(monkeypatch, 1000.5)
+
+    worker.revoke("jti-1", 2000)
+    worker.revoke_user("user-1", 2000)
+
+    assert other_worker.is_revoked("jti-1", "user-2", 1000)
+    assert other_worker.is_revoked("jti-2", "user-1", 1000.4)
+    assert other_worker.is_user_revoked("user-1", 1000.4)
+    assert not other_worker.is_revoked("jti-2", "user-1", 1000.6)
+    assert not other_worker.is_revoked("jti-3", "user-2", 1000)
+
+
+def test_shared_revocations_fall_back_to_the_local_ones_without_redis(monkeypatch):
+    def unreachable():
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(tokens, "get_redis_client", unreachable)
+    worker = SharedRevocationList()
+    worker.revoke("jti-1", time.time() + 60)
+
+    assert worker.is_revoked("jti-1", "user-1", 0)
+    assert not worker.is_revoked("jti-2", "user-1", 0)
+
+
+def test_revoked_token_is_rejected():
+    token = tokens.create_refresh_token("user-1")
+    payload = tokens.decode_token(token, tokens.REFRESH_TOKEN)
+    tokens.revoke_token(payload)
+
+    with pytest.raises(TokenError):
+        tokens.decode_token(token, tokens.REFRESH_TOKEN)
+    with pytest.raises(TokenError):
+        tokens.decode_token(tokens.create_access_token("user-1"), tokens.REFRESH_TOKEN)
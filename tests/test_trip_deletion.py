@@ -0,0 +1,83 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import trips
+from app.api.auth import get_current_user
+from app.core.database import TRIP_COLUMNS, AsyncDatabase, Database, NotFound, SQLiteBackend, get_async_db
+from app.services import purge_deleted_trips
+
+PACKING_LIST = json.dumps({"categories": [{"category_name": "Clothes", "items": [{"name": "Socks", "packed": True}]}]})
+
+
+@pytest.fixture
+def database():
+    database = Database(SQLiteBackend(":memory:"))
+    for trip_id, user_id in [("trip-1", "u1"), ("trip-2", "u1"), ("trip-3", "u1"), ("trip-other", "u2")]:
+        database.insert_trip({"trip_id": trip_id, "user_id": user_id, "city": "Oslo", "country": "Norway",
+                              "start_date": "2026-12-30", "end_date": "2027-01-02", "luggage_type": "hand",
+                              "trip_purpose": "vacation"})
+        database.insert_trip_weather({"trip_id": trip_id, "min_temp": -5, "max_temp": 2, "uv": 1,
+                                      "description": "Snow", "confidence": 0.8})
+        database.insert_historical_weather(trip_id, "[]")
+        database.insert_packing_list({"list_id": f"list-{trip_id}", "trip_id": trip_id, "packing_list": PACKING_LIST,
+                                      "total_items": 1, "packed_items": 1})
+    return database
+
+
+def test_deleted_trips_are_left_out_of_every_read(database):
+    database.delete_trip("trip-1", "u1")
+
+    for read in [lambda: database.get_trip("trip-1", "u1"),
+                 lambda: database.get_trip_weather("trip-1", "u1"),
+                 lambda: database.get_historical_weather("trip-1", "u1"),
+                 lambda: database.get_packing_list("list-trip-1", "u1"),
+                 lambda: database.get_packing_counters("list-trip-1", "u1")]:
+        with pytest.raises(NotFound):
+            read()
+    assert database.get_trip("trip-1") is None
+    assert not database.trip_exists("trip-1", "u1")
+    assert database.get_trip_packing_totals("trip-1", "u1") is None
+
+    live = ["trip-2", "trip-3"]
+    assert [row["trip_id"] for row in database.list_trips("u1", TRIP_COLUMNS, 10)] == live
+    assert [row["trip_id"] for row in database.list_all_trips("u1")] == live
+    assert sorted(row["list_id"] for row in database.list_user_packing_counters("u1")) == ["list-trip-2", "list-trip-3"]
+    assert [row["trip_id"] for row in database.list_trips_packing_totals(["trip-1", "trip-2"], "u1")] == ["trip-2"]
+    assert database.get_user_packing_progress("u1")["list_count"] == 2
+    assert database.get_user_packing_progress("u1", from_json=True)["list_count"] == 2
+
+
+def test_bulk_delete_reports_the_trips_it_skipped(database):
+    database.delete_trip("trip-3", "u1")
+    app = FastAPI()
+    app.include_router(trips.router, prefix="/trips")
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+    app.dependency_overrides[get_async_db] = lambda: AsyncDatabase(database)
+    client = TestClient(app)
+
+    # another user's, an unknown and an already deleted trip are skipped, not failed on
+    response = client.post("/trips/delete", json={"trip_ids": ["trip-1", "trip-other", "missing", "trip-3", "trip-2", "trip-1"]})
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "2 trips deleted successfully", "deleted": ["trip-1", "trip-2"],
+                               "not_found": ["trip-other", "missing", "trip-3"]}
+    assert database.list_all_trips("u1") == []
+    assert database.get_trip("trip-other", "u2")["trip_id"] == "trip-other"
+
+    assert client.post("/trips/delete", json={"trip_ids": ["trip-1"]}).json()["deleted"] == []
+    assert client.post("/trips/delete", json={"trip_ids": []}).status_code == 400
+
+
+def test_the_purge_removes_deleted_trips_and_their_data(database, monkeypatch):
+    monkeypatch.setattr(purge_deleted_trips, "db", database)
+    database.delete_trips(["trip-1", "trip-2"], "u1")
+
+    assert purge_deleted_trips.purge_deleted_trips() == 2
+    assert database.get_trip_weather("trip-1") is None
+    assert database.get_packing_lists_for_trips(["trip-1", "trip-2", "trip-3"]) == [
+        {"list_id": "list-trip-3", "trip_id": "trip-3", "packing_list": PACKING_LIST}]
+    # nothing left to purge
+    assert purge_deleted_trips.purge_deleted_trips() == 0